@@ -1,37 +1,110 @@
+import json
 import logging
-from urllib.parse import quote
+import time
+from urllib.parse import urlencode
 
-import advertools as adv
 import dash
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
-import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
 from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 from dash_table.FormatTemplate import Format
+from flask import (Response, abort, request, send_file,
+                   stream_with_context)
+from flask_compress import Compress
 from plotly.subplots import make_subplots
 
-from twitter_stalker.constants import (auth_params, exclude_columns,
-                                       phrase_len_dict, regex_dict,
-                                       )
+from twitter_stalker import archive
+from twitter_stalker.cache import dataset_exists, load_dataset, load_derived
+from twitter_stalker.constants import (compress_algorithms, compress_br_level,
+                                       compress_level, compress_min_bytes,
+                                       compress_responses, logo_filename,
+                                       logo_url, metrics_enabled,
+                                       payload_float_digits)
+from twitter_stalker.downloads import iter_csv, iter_csv_chunks, iter_parquet
+from twitter_stalker.fetch import (latest_version, load_job_state,
+                                   start_fetch_job)
+from twitter_stalker.frequency import load_token_matrix
 from twitter_stalker.html_components import Layout
+from twitter_stalker.indexes import load_column_index
+from twitter_stalker.metrics import instrument, observe_dataset_load
+from twitter_stalker.network import load_graph, load_layout
+from twitter_stalker.schema import column_types, dataset_summary
+from twitter_stalker.table import view_name, view_rows
+from twitter_stalker.timeseries import FREQUENCIES, load_rollup, to_series
 from twitter_stalker.utils import *
 
 logging.basicConfig(level=logging.INFO)
 
-adv.twitter.set_auth_params(**auth_params)
-
 app = dash.Dash(
     __name__,
-    external_stylesheets=[dbc.themes.CYBORG]
+    external_stylesheets=[dbc.themes.CYBORG],
+    compress=False
 )
 app.title = "Twitter Stalker"
 
 server = app.server
 
+if metrics_enabled:
+    instrument(app)
+
+# enabled here rather than with Dash(compress=True), which always uses
+# gzip; registered after the metrics so that they count compressed bytes.
+# Dash serves its JS bundles as text/javascript, which Flask-Compress
+# leaves out by default
+if compress_responses:
+    server.config.update(COMPRESS_MIMETYPES=['text/html', 'text/css',
+                                             'application/json',
+                                             'application/javascript',
+                                             'text/javascript'],
+                         COMPRESS_ALGORITHM=compress_algorithms,
+                         COMPRESS_LEVEL=compress_level,
+                         COMPRESS_BR_LEVEL=compress_br_level,
+                         COMPRESS_MIN_SIZE=compress_min_bytes)
+    Compress(server)
+
 app.layout = Layout
 
+
+def get_dataset(key):
+    """Return the cached DataFrame for the key held in `twitter_df`"""
+    start = time.perf_counter()
+    df = load_dataset(key)
+    if df is None:
+        raise PreventUpdate
+    observe_dataset_load(time.perf_counter() - start, len(df))
+    return df
+
+
+def is_archive(key):
+    """Return whether key is an archive key (see archive.py) rather than a
+    dataset key, raising PreventUpdate if the archive expired"""
+    if not archive.is_archive_key(key):
+        return False
+    if archive.archive_files(key) is None:
+        raise PreventUpdate
+    return True
+
+
+def get_summary(key):
+    """Return the dataset_summary of the dataset or archive key"""
+    if is_archive(key):
+        return archive.load_summary(key)
+    return load_derived(key, 'summary',
+                        lambda: dataset_summary(get_dataset(key)))
+
+
+def get_column_type(key, col):
+    """Return the precomputed filter type of col in the dataset key"""
+    if is_archive(key):
+        return get_summary(key)['types'].get(col)
+    types = load_derived(key, 'column_types',
+                         lambda: column_types(get_dataset(key)))
+    return types.get(col)
+
+
 @app.callback([Output('text_columns', 'options'),
                Output('text_columns', 'value'),
                Output('output_table_col_select', 'value')],
@@ -51,32 +124,51 @@ def set_text_columns_dropdown_options(n_clicks, query, search_type):
     return ([{'label': 'Tweet Text', 'value': 'tweet_full_text'},
             {'label': 'User Description','value': 'user_description'}],
             'tweet_full_text',
-            search_tweet_cols if search_type == 'Search Tweets' else
+            search_tweet_cols
+            if search_type in ['Search Tweets', 'Search Archive'] else
             ['tweet_created_at', 'tweet_full_text',
              'user_location', 'tweet_favourite_count'])
 
 
-@app.callback(Output('wtd_freq_chart_title', 'children'),
-              [Input('regex_options', 'value'),
-               Input('twitter_df', 'data')])
-def display_wtd_freq_chart_title(regex, df):
-    if regex is None or df is None:
-        raise PreventUpdate
-    return 'Most Frequently Used ' + regex + ' (' + str(len(df)) +  ' Results)'
-
-
-@app.callback(Output('user_overview', 'children'),
-              [Input('twitter_df', 'data'),
-               Input('search_type', 'value')])
-def display_user_overview(df, search_type):
+@app.callback(Output('dataset_summary', 'data'),
+              [Input('twitter_df', 'data')])
+def summarize_dataset(df):
+    """Send the metadata of a new dataset (see schema.dataset_summary) to
+    the browser once; the callbacks showing it run clientside"""
     if df is None:
         raise PreventUpdate
-    df = pd.DataFrame(df)
-    n_tweets = len(df)
-    n_users = df['user_screen_name'].nunique()
-    num_tweets = '' if search_type == 'Search Users' else \
-        'Number of tweets: ' + str(n_tweets) + ' | '
-    return num_tweets + 'Number of Users: ' + str(n_users)
+    return get_summary(latest_version(df))
+
+
+app.clientside_callback(
+    """
+    function(regex, summary) {
+        if (!regex || !summary) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        return 'Most Frequently Used ' + regex + ' (' + summary.rows +
+            ' Results)';
+    }
+    """,
+    Output('wtd_freq_chart_title', 'children'),
+    [Input('regex_options', 'value'),
+     Input('dataset_summary', 'data')])
+
+
+app.clientside_callback(
+    """
+    function(summary, search_type) {
+        if (!summary) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        var num_tweets = search_type === 'Search Users' ? '' :
+            'Number of tweets: ' + summary.rows + ' | ';
+        return num_tweets + 'Number of Users: ' + summary.users;
+    }
+    """,
+    Output('user_overview', 'children'),
+    [Input('dataset_summary', 'data'),
+     Input('search_type', 'value')])
 
 
 @app.callback(Output('wtd_freq_chart', 'figure'),
@@ -90,11 +182,13 @@ def plot_wtd_frequency(df, text_col, num_col, regex, search_type):
     if (df is None) or (text_col is None) or (num_col is None) or \
             (search_type is None):
         raise PreventUpdate
-    df = pd.DataFrame(df)
-    wtd_freq_df = adv.word_frequency(df[text_col], df[num_col],
-                                     regex=regex_dict.get(regex),
-                                     phrase_len=phrase_len_dict.get(regex)
-                                     or 1)[:20]
+    key = latest_version(df)
+    if is_archive(key):
+        wtd_freq_df = archive.load_frequency(key, text_col, num_col, regex)
+    else:
+        df = get_dataset(key)
+        tokens = load_token_matrix(key, df, text_col, regex)
+        wtd_freq_df = tokens.frequency(df[num_col], k=20)
     fig = make_subplots(rows=1, cols=2,
                         subplot_titles=['Weighted Frequency',
                                         'Absolute Frequency'],
@@ -129,23 +223,22 @@ def plot_wtd_frequency(df, text_col, num_col, regex, search_type):
     return fig
 
 
-@app.callback(Output('user_analysis_chart', 'figure'),
-              [Input('twitter_df', 'data'),
-               Input('search_type', 'value')])
-def plot_user_analysis_chart(df, search_type):
-    if (df is None) or (search_type is None):
-        raise PreventUpdate
+def user_analysis_figure(df, search_type):
+    """Return the User Analysis subplots of a dataset, binned server side so
+    that the figure holds one point per bin or category, not per user"""
     subplot_titles = ['Followers Count', 'Statuses Count',
                       'Friends Count', 'Favourites Count',
                       'Verified', 'Tweet Source',
                       'Lang', 'User Created At']
-    df = pd.DataFrame(df).drop_duplicates('user_screen_name')
+    df = df.drop_duplicates('user_screen_name')
     fig = make_subplots(rows=2, cols=4,
                         subplot_titles=subplot_titles)
 
     for i, col in enumerate(subplot_titles[:4], start=1):
         col = ('user_' + col).replace(' ', '_').lower()
-        fig.append_trace(go.Histogram(x=df[col], nbinsx=30,name='Users'),
+        centers, counts, widths = bin_values(df[col], bins=30)
+        fig.append_trace(go.Bar(x=centers, y=counts, width=widths,
+                                name='Users'),
                          1, i)
     for i, col in enumerate(subplot_titles[4:7], start=5):
         if (i == 6) and (search_type == 'Search Users'):
@@ -154,32 +247,143 @@ def plot_user_analysis_chart(df, search_type):
             col = 'tweet_source'
         else:
             col = ('user_' + col).replace(' ', '_').lower()
-        fig.append_trace(go.Bar(x=df[col].value_counts().index[:14], width=0.9,
-                                y=df[col].value_counts().values[:14],
+        counts = df[col].value_counts()[:14]
+        fig.append_trace(go.Bar(x=counts.index, width=0.9,
+                                y=counts.values,
                                 name='Users'), 2, i-4)
-    fig.append_trace(go.Histogram(x=df['user_created_at'],name='Users',
-                                  nbinsx=30, ), 2, 4)
+    centers, counts, widths = bin_values(df['user_created_at'], bins=30)
+    fig.append_trace(go.Bar(x=centers, y=counts, width=widths,
+                            name='Users'), 2, 4)
 
     fig['layout'].update(height=600,
                          plot_bgcolor='#878787',
                          paper_bgcolor='#878787',
-                         showlegend=False
+                         showlegend=False,
                           )
     return fig
 
-@app.callback(Output('numeric_columns', 'options'),
-              [Input('twitter_df', 'data')])
-def set_text_columns_ddown_options(df):
-    if df is None:
+
+@app.callback(Output('user_analysis_chart', 'figure'),
+              [Input('tabs', 'active_tab'),
+               Input('twitter_df', 'data'),
+               Input('search_type', 'value')])
+def plot_user_analysis_chart(active_tab, df, search_type):
+    if (active_tab != 'user_analysis_tab') or (df is None) or \
+            (search_type is None):
+        raise PreventUpdate
+    key = latest_version(df)
+    # cached as a dict, which unpickles much faster than a go.Figure
+    users = archive.load_users if is_archive(key) else get_dataset
+    return load_derived(key, 'user_analysis.' + search_type,
+                        lambda: user_analysis_figure(users(key),
+                                                     search_type).to_dict())
+
+
+@app.callback([Output('network_chart', 'figure'),
+               Output('network_summary', 'children')],
+              [Input('tabs', 'active_tab'),
+               Input('twitter_df', 'data'),
+               Input('network_edge_type', 'value'),
+               Input('network_top_n', 'value')])
+def plot_network(active_tab, df, edge_type, top_n):
+    if (active_tab != 'network_tab') or (df is None):
+        raise PreventUpdate
+    key = latest_version(df)
+    if is_archive(key):
+        graph = archive.load_graph(key, edge_type)
+    else:
+        graph = load_graph(key, get_dataset(key), edge_type)
+    # retweeters are looked up a few tweets per request, and never waited
+    # for: the others are looked up on the next visits of the tab
+    missing = ''
+    if graph.error:
+        missing = (' (the retweeters of ' + str(graph.missing) + ' tweets '
+                   'could not be looked up: ' + graph.error + ')')
+    elif graph.missing:
+        missing = (' (the retweeters of ' + str(graph.missing) + ' tweets '
+                   'are left to look up, come back to this tab later)')
+    if graph.n_edges == 0:
+        return ({'layout': go.Layout(plot_bgcolor='#878787',
+                                     paper_bgcolor='#878787')},
+                'No ' + edge_type.lower() + ' in this dataset' + missing)
+    nodes, edges, pos = load_layout(key, graph, edge_type, top_n)
+    local = {node: i for i, node in enumerate(nodes)}
+    edge_x, edge_y = [], []
+    for source, target in zip(graph.source[edges], graph.target[edges]):
+        x0, y0 = pos[local[source]]
+        x1, y1 = pos[local[target]]
+        edge_x += [x0, x1, None]
+        edge_y += [y0, y1, None]
+    rank = graph.pagerank[nodes]
+    fig = go.Figure([
+        go.Scatter(x=edge_x, y=edge_y, mode='lines', hoverinfo='none',
+                   line={'width': 0.5, 'color': '#444444'}),
+        go.Scatter(x=pos[:, 0], y=pos[:, 1], mode='markers+text',
+                   text=['@' + name if i < 15 else ''
+                         for i, name in enumerate(graph.nodes[nodes])],
+                   textposition='top center',
+                   hovertext=['@' + name +
+                              '<br>PageRank: ' + format(r, '.4f') +
+                              '<br>In: ' + format(i, 'g') +
+                              ' | Out: ' + format(o, 'g')
+                              for name, r, i, o in
+                              zip(graph.nodes[nodes], rank,
+                                  graph.in_degree[nodes],
+                                  graph.out_degree[nodes])],
+                   hoverinfo='text',
+                   marker={'size': 8 + 40 * np.sqrt(rank / rank.max()),
+                           'color': graph.component[nodes],
+                           'colorscale': 'Viridis',
+                           'line': {'width': 0.5, 'color': 'white'}}),
+    ])
+    fig['layout'].update(height=700, showlegend=False,
+                         plot_bgcolor='#878787', paper_bgcolor='#878787',
+                         xaxis={'visible': False}, yaxis={'visible': False})
+    summary = (format(graph.n_nodes, ',') + ' users, ' +
+               format(graph.n_interactions, ',') + ' ' + edge_type.lower() +
+               ', ' + format(graph.n_components(), ',') +
+               ' connected groups (showing the top ' + str(len(nodes)) + ')' +
+               missing)
+    return fig, summary
+
+
+@app.callback(Output('timeseries_chart', 'figure'),
+              [Input('tabs', 'active_tab'),
+               Input('twitter_df', 'data'),
+               Input('timeseries_freq', 'value'),
+               Input('timeseries_metric', 'value'),
+               Input('timeseries_group', 'value'),
+               Input('timeseries_window', 'value')])
+def plot_timeseries(active_tab, df, freq, metric, group_col, window):
+    if (active_tab != 'timeseries_tab') or (df is None):
         raise PreventUpdate
-    df = pd.DataFrame(df)
-    num_cols = [c for c in df.columns if 'count' in c]
-    num_options = [{'label': c.replace('_', ' ').title(), 'value': c}
-                   for c in num_cols]
-    return num_options
+    key = latest_version(df)
+    layout = go.Layout(plot_bgcolor='#878787', paper_bgcolor='#878787')
+    if 'tweet_created_at' not in get_summary(key)['types']:
+        layout.title = 'No tweet times in this dataset'
+        return {'layout': layout}
+    freq = FREQUENCIES[freq]
+    if is_archive(key):
+        rolled = archive.load_rollup(key, group_col, freq)
+    else:
+        rolled = load_rollup(key, get_dataset(key), group_col, freq)
+    if metric not in rolled:
+        metric = 'tweets'
+    series = to_series(rolled, metric, freq, window or 1)
+    # plain UTC datetime64 values, which plotly serializes far faster than
+    # a tz-aware index
+    times = series.index.tz_convert(None).to_numpy()
+    fig = go.Figure([go.Scattergl(x=times, y=series[group].to_numpy(),
+                                  mode='lines', name=str(group))
+                     for group in series], layout=layout)
+    fig['layout'].update(height=600,
+                         showlegend=group_col is not None,
+                         yaxis={'title': metric.replace('_', ' ').title()},
+                         legend={'font': {'color': 'white'}})
+    return fig
 
 
-@app.callback(Output('twitter_df', 'data'),
+@app.callback(Output('fetch_job', 'data'),
               [Input('search_button', 'n_clicks')],
               [State('search_type', 'value'),
                State('twitter_search', 'value'),
@@ -189,39 +393,74 @@ def set_text_columns_ddown_options(df):
 def get_twitter_data_save_in_store(n_clicks, search_type, query, count, lang):
     if query is None:
         raise PreventUpdate
-    if search_type == 'Search Tweets':
-        df = adv.twitter.search(q=query + ' -filter:retweets',
-                                count=count, lang=lang,
-                                tweet_mode='extended')
-    elif search_type == 'Search Users':
-        resp_dfs = []
-        for i, num in enumerate(adv.twitter._get_counts(count, default=20),
-                                start=1):
-            df = adv.twitter.search_users(q=query, count=num, page=i,
-                                          include_entities=True)
-            resp_dfs.append(df)
-        df = pd.concat(resp_dfs)
-        df.columns = ['user_' + c for c in df.columns]
-    else:
-        df = adv.twitter.get_user_timeline(screen_name=query,
-                                           exclude_replies=False,
-                                           include_rts=True,
-                                           count=count,tweet_mode='extended')
-    for exclude in exclude_columns:
-        if exclude in df:
-            del df[exclude]
-    return df.to_dict('rows')
-
-
-@app.callback([Output('col_select', 'options'),
-               Output('output_table_col_select', 'options')],
-              [Input('twitter_df', 'data')])
-def set_columns_to_select(df):
+    return start_fetch_job(search_type, query, count, lang)
+
+
+@app.callback([Output('twitter_df', 'data'),
+               Output('fetch_interval', 'disabled'),
+               Output('fetch_status', 'children')],
+              [Input('fetch_interval', 'n_intervals'),
+               Input('fetch_job', 'data')],
+              [State('twitter_df', 'data')])
+def poll_fetch_job(n_intervals, job_id, current_key):
+    if job_id is None:
+        raise PreventUpdate
+    state = load_job_state(job_id)
+    if state is None:
+        return dash.no_update, True, 'Search expired, please submit again.'
+    key = state['dataset']
+    if (key is None) or (key == current_key):
+        key = dash.no_update
+    rows = format(state['rows'], ',')
+    if state['status'] == 'running':
+        return key, False, 'Fetching... ' + rows + ' results so far'
+    if state['status'] == 'error':
+        return key, True, ('Stopped after ' + rows + ' results: ' +
+                           state['error'])
+    return key, True, ''
+
+
+@app.callback(Output('dataset_status', 'children'),
+              [Input('twitter_df', 'data'),
+               Input('tabs', 'active_tab'),
+               Input('dataset_interval', 'n_intervals')])
+def check_dataset(df, active_tab, n_intervals):
+    """Tell the user when the dataset shown expired from the server cache,
+    which every callback reading it otherwise ignores"""
     if df is None:
         raise PreventUpdate
-    columns = [{'label': c.replace('_', ' ').title(), 'value': c}
-               for c in df[0].keys()]
-    return columns, columns
+    key = latest_version(df)
+    if archive.is_archive_key(key):
+        expired = archive.archive_files(key) is None
+    else:
+        expired = not dataset_exists(key)
+    return 'This dataset expired, please search again.' if expired else ''
+
+
+app.clientside_callback(
+    """
+    function(summary) {
+        if (!summary) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        var options = function(columns) {
+            return columns.map(function(column) {
+                var label = column.replace(/_/g, ' ').replace(
+                    /[a-z]+/gi, function(word) {
+                        return word.charAt(0).toUpperCase() +
+                            word.substr(1).toLowerCase();
+                    });
+                return {'label': label, 'value': column};
+            });
+        };
+        var columns = options(summary.columns);
+        return [options(summary.numeric_columns), columns, columns];
+    }
+    """,
+    [Output('numeric_columns', 'options'),
+     Output('col_select', 'options'),
+     Output('output_table_col_select', 'options')],
+    [Input('dataset_summary', 'data')])
 containers = ['container_num_filter', 'container_str_filter',
               'container_bool_filter', 'container_cat_filter',
               'container_date_filter']
@@ -234,55 +473,65 @@ containers = ['container_num_filter', 'container_str_filter',
 def dispaly_relevant_filter_container(df, col):
     if (col is None) or (df is None):
         raise PreventUpdate
-    df = pd.DataFrame(df)
-    for column in df:
-        if 'created' in column:
-            df[column] = pd.to_datetime(df[column])
-        if ('lang' in column) or ('source' in column):
-            df[column] = df[column].astype('category')
-
+    key = latest_version(df)
+    col_type = get_column_type(key, col)
+    # build the column's index now, before the user starts filtering
+    # (archives are filtered while they are read, without index)
+    if not is_archive(key):
+        load_column_index(key, get_dataset(key), col, col_type)
     dtypes = [['int', 'float'], ['object'], ['bool'],
               ['category'], ['datetime']]
-    result = [{'display': 'none'} if get_str_dtype(df, col) not in d
+    result = [{'display': 'none'} if col_type not in d
               else {'display': 'inline-block'} for d in dtypes]
     return result
 
 
-@app.callback([Output('num_filter', 'min'),
-               Output('num_filter', 'max'),
-               Output('num_filter', 'value')],
-              [Input('twitter_df', 'data'),
-               Input('col_select', 'value')])
-def set_rng_slider_max_min_val(df, column):
-    if column is None:
-        raise PreventUpdate
-    df = pd.DataFrame(df)
-    if column and (get_str_dtype(df, column) in ['int', 'float']):
-        minimum = df[column].min()
-        maximum = df[column].max()
-        return minimum, maximum, [minimum, maximum]
-    else:
-        return None, None, None
-
-
-@app.callback(Output('rng_slider_vals', 'children'),
-              [Input('num_filter', 'value')])
-def show_rng_slider_max_min(numbers):
-    if numbers is None:
-        raise PreventUpdate
-    return 'from: ' + ' to: '.join([str(numbers[0]), str(numbers[-1])])
-
-
-@app.callback(Output('cat_filter', 'options'),
-              [Input('twitter_df', 'data'),
-               Input('col_select', 'value')])
-def set_categorical_filter_options(df, column):
-    if column is None:
-        raise PreventUpdate
-    df = pd.DataFrame(df)
-    if any([x in column for x in ['lang', 'source']]):
-        return [{'label': x, 'value': x} for x in list(df[column].unique())]
-    return []
+app.clientside_callback(
+    """
+    function(summary, column) {
+        if (!column || !summary) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        var col_type = summary.types[column];
+        var filter = summary.filters[column] || {};
+        var numbers = [null, null, null];
+        var categories = [];
+        var dates = [null, null, null, null];
+        if (col_type === 'int' || col_type === 'float') {
+            numbers = [filter.min, filter.max, [filter.min, filter.max]];
+        } else if (col_type === 'category') {
+            categories = filter.values.map(function(x) {
+                return {'label': x, 'value': x};
+            });
+        } else if (col_type === 'datetime') {
+            dates = [filter.min, filter.max, filter.min, filter.max];
+        }
+        return numbers.concat([categories], dates);
+    }
+    """,
+    [Output('num_filter', 'min'),
+     Output('num_filter', 'max'),
+     Output('num_filter', 'value'),
+     Output('cat_filter', 'options'),
+     Output('date_filter', 'start_date'),
+     Output('date_filter', 'end_date'),
+     Output('date_filter', 'min_date_allowed'),
+     Output('date_filter', 'max_date_allowed')],
+    [Input('dataset_summary', 'data'),
+     Input('col_select', 'value')])
+
+
+app.clientside_callback(
+    """
+    function(numbers) {
+        if (!numbers) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        return 'from: ' + numbers[0] + ' to: ' + numbers[numbers.length - 1];
+    }
+    """,
+    Output('rng_slider_vals', 'children'),
+    [Input('num_filter', 'value')])
 
 
 @app.callback(Output('table', 'columns'),
@@ -296,24 +545,10 @@ def set_table_columns(columns):
             for c in columns]
 
 
-@app.callback([Output('date_filter', 'start_date'),
-               Output('date_filter', 'end_date'),
-               Output('date_filter', 'min_date_allowed'),
-               Output('date_filter', 'max_date_allowed')],
-              [Input('twitter_df', 'data'),
-               Input('col_select', 'value')])
-def set_date_filter_params(df, col):
-    if (col is None) or (df is None):
-        raise PreventUpdate
-    df = pd.DataFrame(df)
-    if 'created' in col:
-        start = df[col].min()
-        end = df[col].max()
-        return start, end, start, end
-    return None, None, None, None
-
-
-@app.callback(Output('table', 'data'),
+@app.callback([Output('table_page', 'data'),
+               Output('table', 'page_count'),
+               Output('filtered_rows', 'data'),
+               Output('table', 'page_current')],
               [Input('twitter_df', 'data'),
                Input('col_select', 'value'),
                Input('num_filter', 'value'),
@@ -321,9 +556,15 @@ def set_date_filter_params(df, col):
                Input('str_filter', 'value'),
                Input('bool_filter', 'value'),
                Input('date_filter', 'start_date'),
-               Input('date_filter', 'end_date')])
+               Input('date_filter', 'end_date'),
+               Input('table', 'page_current'),
+               Input('table', 'page_size'),
+               Input('table', 'sort_by'),
+               Input('output_table_col_select', 'value')],
+              [State('filtered_rows', 'data')])
 def filter_table(df, col, numbers, categories, string,
-                 bool_filter, start_date, end_date):
+                 bool_filter, start_date, end_date,
+                 page_current, page_size, sort_by, columns, filtered_rows):
     if df is None:
         raise PreventUpdate
     if all([param is None for param in
@@ -334,54 +575,159 @@ def filter_table(df, col, numbers, categories, string,
                              [numbers, categories, string,
                               bool_filter, start_date, end_date]]):
         raise PreventUpdate
-    df = pd.DataFrame(df)
-    for column in df:
-        if 'created' in column:
-            df[column] = pd.to_datetime(df[column])
-        if ('lang' in column) or ('source' in column):
-            df[column] = df[column].astype('category')
-    logging_dict = {k: v for k, v in locals().items()
-                   if k not in ['df', 'column'] and v is not None}
-    logging.info(msg=logging_dict)
-    if numbers and (get_str_dtype(df, col) in ['int', 'float']):
-        df = df[df[col].between(numbers[0], numbers[-1])]
-        return df.to_dict('rows')
-    elif categories and (get_str_dtype(df, col) == 'category'):
-        df = df[df[col].isin(categories)]
-        return df.to_dict('rows')
-    elif string and get_str_dtype(df, col) == 'object':
-        df = df[df[col].str.contains(string, case=False)]
-        return df.to_dict('rows')
-    elif (bool_filter is not None) and (get_str_dtype(df, col) == 'bool'):
-        df = df[df[col] == bool_filter]
-        return df.to_dict('rows')
-    elif start_date and end_date and (get_str_dtype(df, col) == 'datetime'):
-        df = df[df[col].between(start_date, end_date)]
-        return df.to_dict('rows')
+    key = latest_version(df)
+    col_type = get_column_type(key, col)
+    filters = {'col': col, 'numbers': numbers, 'categories': categories,
+               'string': string, 'bool_filter': bool_filter,
+               'start_date': start_date, 'end_date': end_date}
+    logging.info(msg={k: v for k, v in filters.items() if v is not None})
+    view = key + '.' + view_name(filters, sort_by)
+    if (filtered_rows or {}).get('view') != view:
+        # another dataset, filter or sort order starts at the first page
+        page_current = 0
+    if is_archive(key):
+        n_rows = archive.count_rows(key, col_type, filters)
+        total = get_summary(key)['rows']
     else:
-        return df.to_dict('rows')
-
-
-@app.callback(Output('row_summary', 'children'),
-              [Input('twitter_df', 'data'), Input('table', 'data')])
-def show_rows_summary(orig_table, filtered_table):
-    if filtered_table is None:
+        df = get_dataset(key)
+        rows = view_rows(key, df, col_type, filters, sort_by)
+        n_rows, total = len(rows), len(df)
+    page_size = page_size or 50
+    page_count = max(-(-n_rows // page_size), 1)
+    page_current = min(page_current or 0, page_count - 1)
+    start, stop = page_current * page_size, (page_current + 1) * page_size
+    if is_archive(key):
+        page = archive.read_rows(key, col_type, filters, sort_by, columns,
+                                 start, stop)
+    else:
+        columns = [c for c in (columns or df.columns) if c in df]
+        page = df.iloc[rows[start:stop]][columns]
+    return (to_columns(page, payload_float_digits), page_count,
+            {'rows': n_rows, 'total': total, 'view': view}, page_current)
+
+
+app.clientside_callback(
+    """
+    function(page) {
+        if (!page) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        var columns = Object.keys(page);
+        var n_rows = columns.length ? page[columns[0]].length : 0;
+        var rows = [];
+        for (var i = 0; i < n_rows; i++) {
+            var row = {};
+            for (var j = 0; j < columns.length; j++) {
+                row[columns[j]] = page[columns[j]][i];
+            }
+            rows.push(row);
+        }
+        return rows;
+    }
+    """,
+    Output('table', 'data'),
+    [Input('table_page', 'data')])
+
+
+app.clientside_callback(
+    """
+    function(filtered_rows) {
+        if (!filtered_rows) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        var rows = filtered_rows.rows, total = filtered_rows.total;
+        return rows + ' out of ' + total + ' rows (' +
+            (100 * rows / Math.max(total, 1)).toFixed(1) + '%)';
+    }
+    """,
+    Output('row_summary', 'children'),
+    [Input('filtered_rows', 'data')])
+
+
+@app.callback([Output('download_link', 'href'),
+               Output('download_parquet_link', 'href')],
+              [Input('twitter_df', 'data'),
+               Input('col_select', 'value'),
+               Input('num_filter', 'value'),
+               Input('cat_filter', 'value'),
+               Input('str_filter', 'value'),
+               Input('bool_filter', 'value'),
+               Input('date_filter', 'start_date'),
+               Input('date_filter', 'end_date'),
+               Input('table', 'sort_by'),
+               Input('output_table_col_select', 'value')])
+def download_df(data_df, col, numbers, categories, string,
+                bool_filter, start_date, end_date, sort_by, columns):
+    if data_df is None:
         raise PreventUpdate
-    summary = f"{len(filtered_table)} out of {len(orig_table)} " \
-              f"rows ({len(filtered_table)/len(orig_table):.1%})"
-    return summary
-
-
-@app.callback(Output('download_link', 'href'),
-              [Input('twitter_df', 'data')])
-def download_df(data_df):
-    df = pd.DataFrame(data_df)
-    csv_string = df.to_csv(index=False, encoding='utf-8')
-    csv_string = "data:text/csv;charset=utf-8," + quote(csv_string)
-    log_msg = (format(df.memory_usage().sum(), ',') +
+    filters = {'col': col, 'numbers': numbers, 'categories': categories,
+               'string': string, 'bool_filter': bool_filter,
+               'start_date': start_date, 'end_date': end_date}
+    query = urlencode({'filters': json.dumps(filters),
+                       'sort_by': json.dumps(sort_by or []),
+                       'columns': columns or []}, doseq=True)
+    return [app.get_relative_path('/download/' + data_df + '.' + fmt) +
+            '?' + query for fmt in ['csv', 'parquet']]
+
+
+@server.route(logo_url)
+def serve_logo():
+    """Serve the logo as a static file the browser can cache"""
+    response = send_file(logo_filename, mimetype='image/png',
+                         conditional=True)
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = 7 * 24 * 3600
+    return response
+
+
+@server.route('/download/<key>.<fmt>')
+def download_dataset(key, fmt):
+    """Stream a cached dataset as CSV or Parquet, optionally restricted to
+    a table view (filters and sort_by as JSON) and to some columns.
+
+    Archives are streamed as they are read, in archive order (sort_by is
+    ignored).
+    """
+    if archive.is_archive_key(key):
+        return download_archive(key, fmt)
+    key = latest_version(key)
+    df = load_dataset(key)
+    if (df is None) or (fmt not in ['csv', 'parquet']):
+        abort(404)
+    filters = json.loads(request.args.get('filters', 'null'))
+    sort_by = json.loads(request.args.get('sort_by', 'null'))
+    if filters or sort_by:
+        filters = filters or {}
+        col_type = get_column_type(key, filters.get('col'))
+        df = df.iloc[view_rows(key, df, col_type, filters, sort_by)]
+    columns = [c for c in request.args.getlist('columns') if c in df]
+    if columns:
+        df = df[columns]
+    log_msg = (format(df.memory_usage(deep=True).sum(), ',') +
                'bytes, shape:' + str(df.shape))
     logging.info(msg=log_msg)
-    return csv_string
+    if fmt == 'csv':
+        return Response(stream_with_context(iter_csv(df)),
+                        mimetype='text/csv')
+    return Response(stream_with_context(iter_parquet(df)),
+                    mimetype='application/octet-stream')
+
+
+def download_archive(key, fmt):
+    if (archive.archive_files(key) is None) or \
+            (fmt not in ['csv', 'parquet']):
+        abort(404)
+    filters = json.loads(request.args.get('filters', 'null')) or {}
+    col_type = get_column_type(key, filters.get('col'))
+    expression = archive.filter_expression(col_type, **filters)
+    columns = request.args.getlist('columns') or None
+    if fmt == 'csv':
+        return Response(stream_with_context(iter_csv_chunks(
+            archive.iter_chunks(key, columns, expression))),
+            mimetype='text/csv')
+    return Response(stream_with_context(archive.iter_parquet(
+        key, columns, expression)), mimetype='application/octet-stream')
 
 
 if __name__ == '__main__':
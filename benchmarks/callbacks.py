@@ -0,0 +1,248 @@
+"""Callbacks: time, peak memory and payload of every server-side callback
+of app.py, and how they grow with the number of tweets.
+
+Run from the repository root:
+
+    python -m benchmarks.callbacks [--sizes 1000 10000 100000] [--repeat 5]
+        [--save baseline.json] [--baseline baseline.json] [--threshold 0.25]
+
+Datasets are built with replay.synthetic_dataset (so they go through the
+same preparation as fetched searches) and kept in --data-dir for later
+runs. Each callback function is called directly, without Dash's HTTP
+layer:
+
+* cold: first call on a fresh dataset key, so derived data (token
+  matrices, indexes, rollups, figures...) is computed
+* warm: median of --repeat more calls, served from the derived cache
+* peak_mb: peak memory allocated by the cold call (tracemalloc, measured
+  on another fresh key so that tracing does not slow the timed call)
+* payload_kb: size of the JSON response sent to the browser, and
+  payload_gz_kb once compressed like the app compresses it (downloads
+  are sent uncompressed)
+
+The scaling report gives, per callback, the cold time at every size and
+the exponent k of time ~ rows^k between the smallest and largest sizes.
+With --baseline, the script exits with status 1 if a cold or warm time
+or a peak memory is more than --threshold above the baseline's (and more
+than --min-ms slower or --min-mb larger, to ignore noise on small
+measures). Every callback is called once before measuring, so that
+imports done on first use are not counted.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+
+import numpy as np
+import pandas as pd
+from plotly.utils import PlotlyJSONEncoder
+
+import app
+from twitter_stalker.cache import save_dataset, save_derived
+from twitter_stalker.constants import compress_level, compress_min_bytes
+from twitter_stalker.replay import synthetic_dataset
+
+TABLE_COLUMNS = ['tweet_created_at', 'user_screen_name',
+                 'user_followers_count', 'tweet_full_text', 'user_location']
+
+
+def callback(name):
+    """Return the function app.py registered as callback name"""
+    return getattr(app, name).__wrapped__
+
+
+def table_filters(key, col, **filters):
+    inputs = {'col': col, 'numbers': None, 'categories': None,
+              'string': None, 'bool_filter': None, 'start_date': None,
+              'end_date': None}
+    inputs.update(filters)
+    return [key] + list(inputs.values())
+
+
+def poll_done_job(key):
+    job_id = 'bench-' + uuid.uuid4().hex[:8]
+    save_derived(job_id, 'job', {'status': 'done', 'rows': 0, 'pages': 1,
+                                 'dataset': key, 'error': None,
+                                 'cached': False})
+    return callback('poll_fetch_job')(1, job_id, None)
+
+
+def download_csv(key):
+    response = app.server.test_client().get('/download/' + key + '.csv')
+    return response.data
+
+
+# name: function of a dataset key calling the callback like the browser
+SCENARIOS = {
+    'set_text_columns_dropdown_options': lambda key: callback(
+        'set_text_columns_dropdown_options')(1, 'python', 'Search Tweets'),
+    'summarize_dataset': lambda key: callback('summarize_dataset')(key),
+    'poll_fetch_job': poll_done_job,
+    'plot_wtd_frequency': lambda key: callback('plot_wtd_frequency')(
+        key, 'tweet_full_text', 'tweet_retweet_count', 'Words',
+        'Search Tweets'),
+    'plot_wtd_frequency (hashtags)': lambda key: callback(
+        'plot_wtd_frequency')(key, 'tweet_full_text', 'user_followers_count',
+                              'Hashtags', 'Search Tweets'),
+    'plot_user_analysis_chart': lambda key: callback(
+        'plot_user_analysis_chart')('user_analysis_tab', key,
+                                    'Search Tweets'),
+    'plot_network': lambda key: callback('plot_network')(
+        'network_tab', key, 'Mentions', 50),
+    'plot_timeseries': lambda key: callback('plot_timeseries')(
+        'timeseries_tab', key, 'Hour', 'tweets', 'tweet_lang', 3),
+    'dispaly_relevant_filter_container': lambda key: callback(
+        'dispaly_relevant_filter_container')(key, 'tweet_full_text'),
+    'set_table_columns': lambda key: callback('set_table_columns')(
+        TABLE_COLUMNS),
+    'filter_table (text)': lambda key: callback('filter_table')(
+        *table_filters(key, 'tweet_full_text', string='python'), 0, 50,
+        [{'column_id': 'tweet_retweet_count', 'direction': 'desc'}],
+        TABLE_COLUMNS, None),
+    'filter_table (range)': lambda key: callback('filter_table')(
+        *table_filters(key, 'user_followers_count', numbers=[100, 10000]),
+        0, 50, [], TABLE_COLUMNS, None),
+    'download_df': lambda key: callback('download_df')(
+        *table_filters(key, 'tweet_lang', categories=['en']), [],
+        TABLE_COLUMNS),
+    'download_dataset (csv)': download_csv,
+}
+
+
+def load_dataset_of_size(n, data_dir, seed=0):
+    """Return the synthetic dataset of n tweets, built once per data_dir"""
+    path = os.path.join(data_dir, 'synthetic-' + str(n) + '-' + str(seed) +
+                        '.pkl')
+    if os.path.exists(path):
+        return pd.read_pickle(path)
+    start = time.perf_counter()
+    df = synthetic_dataset(n, seed)
+    print('built ' + str(n) + ' tweets in ' +
+          format(time.perf_counter() - start, '.1f') + ' s', file=sys.stderr)
+    os.makedirs(data_dir, exist_ok=True)
+    df.to_pickle(path)
+    return df
+
+
+def payload_sizes(result):
+    """Return the size of a callback's response, and its compressed size"""
+    if isinstance(result, bytes):
+        return len(result), len(result)
+    payload = json.dumps(result, cls=PlotlyJSONEncoder).encode('utf-8')
+    if len(payload) < compress_min_bytes:
+        return len(payload), len(payload)
+    return len(payload), len(gzip.compress(payload, compress_level))
+
+
+def measure(scenario, df, repeat):
+    """Return cold and warm times (ms), peak memory (MB) and payload (KB)
+    of one scenario"""
+    key = save_dataset('bench-' + uuid.uuid4().hex[:8], df)
+    start = time.perf_counter()
+    result = scenario(key)
+    cold = time.perf_counter() - start
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        scenario(key)
+        warm.append(time.perf_counter() - start)
+    key = save_dataset('bench-' + uuid.uuid4().hex[:8], df)
+    tracemalloc.start()
+    scenario(key)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    payload, compressed = payload_sizes(result)
+    return {'cold_ms': cold * 1000, 'warm_ms': statistics.median(warm) * 1000,
+            'peak_mb': peak / 1024 ** 2, 'payload_kb': payload / 1024,
+            'payload_gz_kb': compressed / 1024}
+
+
+def scaling_report(results, sizes):
+    """Return the cold time of every callback per size, and its growth
+    exponent"""
+    report = results.pivot(index='callback', columns='rows',
+                           values='cold_ms')[sizes]
+    if len(sizes) > 1:
+        low, high = report[sizes[0]], report[sizes[-1]]
+        report['exponent'] = np.log(high / low) / np.log(sizes[-1] /
+                                                         sizes[0])
+    return report.loc[list(dict.fromkeys(results['callback']))]
+
+
+def regressions(results, baseline, threshold, min_ms, min_mb):
+    """Return a description of every measure more than threshold worse than
+    in baseline (a list of result rows)"""
+    baseline = {(b['callback'], b['rows']): b for b in baseline}
+    found = []
+    for row in results.to_dict('records'):
+        base = baseline.get((row['callback'], row['rows']))
+        if base is None:
+            continue
+        for measure_name in ['cold_ms', 'warm_ms', 'peak_mb']:
+            new, old = row[measure_name], base[measure_name]
+            if new - old < (min_ms if measure_name.endswith('_ms')
+                            else min_mb):
+                continue
+            if new > old * (1 + threshold):
+                found.append(row['callback'] + ' at ' + str(row['rows']) +
+                             ' rows: ' + measure_name + ' ' +
+                             format(old, '.1f') + ' -> ' + format(new, '.1f'))
+    return found
+
+
+def main(sizes, repeat, data_dir, names, save, baseline, threshold, min_ms,
+         min_mb):
+    logging.getLogger().setLevel(logging.WARNING)
+    rows = []
+    for i, n in enumerate(sizes):
+        df = load_dataset_of_size(n, data_dir)
+        if i == 0:
+            warm_up = save_dataset('bench-' + uuid.uuid4().hex[:8], df)
+            for name in names:
+                SCENARIOS[name](warm_up)
+        for name in names:
+            row = measure(SCENARIOS[name], df, repeat)
+            rows.append(dict(callback=name, rows=n, **row))
+    results = pd.DataFrame(rows)
+    pd.set_option('display.width', 160)
+    print(results.round(1).to_string(index=False))
+    print('\ncold time (ms) by rows, and exponent k of time ~ rows^k')
+    print(scaling_report(results, sizes).round(2).to_string())
+    if save:
+        with open(save, 'w') as f:
+            json.dump(rows, f, indent=1)
+    if baseline:
+        with open(baseline) as f:
+            found = regressions(results, json.load(f), threshold, min_ms,
+                                min_mb)
+        if found:
+            print('\nregressions beyond ' + format(threshold, '.0%') + ':')
+            print('\n'.join(found))
+            return 1
+        print('\nno regression beyond ' + format(threshold, '.0%'))
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--callbacks', nargs='+', default=list(SCENARIOS),
+                        choices=list(SCENARIOS), metavar='NAME')
+    parser.add_argument('--data-dir', default='/tmp/twitter_stalker_bench')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='results saved by an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.25)
+    parser.add_argument('--min-ms', type=float, default=5)
+    parser.add_argument('--min-mb', type=float, default=1)
+    args = parser.parse_args()
+    sys.exit(main(sorted(args.sizes), args.repeat, args.data_dir,
+                  args.callbacks, args.save, args.baseline, args.threshold,
+                  args.min_ms, args.min_mb))
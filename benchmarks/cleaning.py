@@ -0,0 +1,82 @@
+"""Tweet text cleaning: per-tweet TwitterStalker.trim vs clean_texts.
+
+Run from the repository root:
+
+    python -m benchmarks.cleaning [--sizes 1000 10000 100000] [--retweets 0.3]
+
+For every size it reports the time and the throughput, in seconds per
+million characters, of:
+
+* trim: the original per-tweet re.sub with an uncompiled pattern
+* clean_text: the same per tweet, with the precompiled pattern
+* clean_texts: one pass over the distinct texts of the whole column
+"""
+import argparse
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from twitter_stalker.text import clean_text, clean_texts
+
+
+def trim(tweet):
+    return ' '.join(re.sub(r"(@[A-Za-z0-9]+)|([^0-9A-Za-z \t]) | (\w+:\/\/\S+)", " ", tweet).split())
+
+
+def make_tweets(n, retweets=0.3, seed=0):
+    """Return n tweet-like texts with mentions, hashtags, URLs and
+    punctuation, a retweets fraction of them repeating earlier ones"""
+    rng = np.random.default_rng(seed)
+    vocab = np.array(['word%d' % i for i in range(2000)] +
+                     ['@user%d' % i for i in range(100)] +
+                     ['#tag%d' % i for i in range(100)] +
+                     ['https://t.co/abc%d' % i for i in range(100)] +
+                     ['!', '?', '...', '-', '&amp;', ':)', '\n'])
+    words = vocab[rng.integers(0, len(vocab), size=(n, 20))]
+    tweets = np.array([' '.join(row) for row in words], dtype=object)
+    repeated = np.flatnonzero(rng.random(n) < retweets)
+    repeated = repeated[repeated > 0]
+    tweets[repeated] = tweets[rng.integers(0, repeated)]
+    return pd.Series(tweets)
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main(sizes, retweets):
+    rows = []
+    for n in sizes:
+        tweets = make_tweets(n, retweets)
+        million_chars = tweets.str.len().sum() / 1e6
+        row = {'tweets': n, 'million_chars': round(million_chars, 2)}
+        expected = None
+        for name, func in [
+                ('trim', lambda: [trim(t) for t in tweets]),
+                ('clean_text', lambda: [clean_text(t) for t in tweets]),
+                ('clean_texts', lambda: clean_texts(tweets).tolist())]:
+            seconds, result = timed(func)
+            if expected is None:
+                expected = result
+            assert result == expected, name + ' differs from trim'
+            row[name] = seconds
+            row[name + '_per_mchar'] = seconds / million_chars
+        rows.append(row)
+    report = pd.DataFrame(rows)
+    report['speedup'] = report['trim'] / report['clean_texts']
+    pd.set_option('display.width', 160)
+    print(report.round(4).to_string(index=False))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--retweets', type=float, default=0.3,
+                        help='fraction of repeated texts')
+    args = parser.parse_args()
+    main(args.sizes, args.retweets)
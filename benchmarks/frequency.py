@@ -0,0 +1,80 @@
+"""Word frequency: adv.word_frequency vs the cached TokenMatrix engine.
+
+Run from the repository root:
+
+    python -m benchmarks.frequency [--sizes 1000 10000 100000]
+
+For every size and counting mode it times what plot_wtd_frequency does:
+
+* advertools: adv.word_frequency on the full column, top 20, re-sorted
+* cold: tokenizing into a TokenMatrix plus the top 20
+* reweight: the top 20 for another "Weighted by" column on a cached matrix
+* append: extending a cached matrix by 10% more rows plus the top 20
+"""
+import argparse
+import time
+
+import advertools as adv
+import numpy as np
+import pandas as pd
+
+from twitter_stalker.constants import phrase_len_dict
+from twitter_stalker.frequency import TokenMatrix, get_regex
+
+MODES = ['Words', 'Hashtags', 'Mentions', '2-word Phrases']
+
+
+def make_texts(n, seed=0):
+    """Return n tweet-like texts with Zipf distributed words"""
+    rng = np.random.default_rng(seed)
+    vocab = np.array(['word%d' % i for i in range(5000)] +
+                     ['#tag%d' % i for i in range(200)] +
+                     ['@user%d' % i for i in range(200)] +
+                     ['the', 'a', 'and', 'of', 'to'])
+    ranks = np.minimum(rng.zipf(1.3, size=(n, 12)), len(vocab)) - 1
+    return pd.Series([' '.join(row) for row in vocab[ranks]])
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main(sizes):
+    rows = []
+    for n in sizes:
+        texts = make_texts(int(n * 1.1))
+        rng = np.random.default_rng(1)
+        weights = pd.Series(rng.integers(0, 1000, len(texts)), name='w1')
+        other = pd.Series(rng.integers(0, 1000, len(texts)), name='w2')
+        head, head_w = texts[:n], weights[:n]
+        for mode in MODES:
+            kwargs = {'regex': get_regex(mode),
+                      'phrase_len': phrase_len_dict.get(mode) or 1}
+
+            def advertools():
+                df = adv.word_frequency(head, head_w, **kwargs)[:20]
+                df.sort_values('abs_freq', ascending=False)
+            matrix = TokenMatrix.from_texts(head, **kwargs)
+            matrix.frequency(head_w, k=20)
+            rows.append({
+                'rows': n, 'mode': mode,
+                'advertools': timed(advertools),
+                'cold': timed(lambda: TokenMatrix.from_texts(head, **kwargs)
+                              .frequency(head_w, k=20)),
+                'reweight': timed(lambda: matrix.frequency(other[:n], k=20)),
+                'append': timed(lambda: matrix.extend(texts[n:])
+                                .frequency(weights, k=20)),
+            })
+    report = pd.DataFrame(rows)
+    report['speedup'] = report['advertools'] / report['reweight']
+    pd.set_option('display.width', 120)
+    print(report.round(4).to_string(index=False))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[1000, 10000, 100000])
+    main(parser.parse_args().sizes)
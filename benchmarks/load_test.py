@@ -0,0 +1,140 @@
+"""Load test of the main callbacks of a running server.
+
+Start the server in production mode, then run from the repository root:
+
+    gunicorn -c gunicorn.conf.py app:server
+    python -m benchmarks.load_test [--url http://127.0.0.1:8050]
+        [--rows 20000] [--concurrency 8] [--requests 200]
+
+Unless --key names a dataset already cached by the server, a dataset of
+--rows tweets built with replay.synthetic_dataset is saved in the shared
+cache backend first (the script uses the same TWITTER_STALKER_* settings
+as the server, production ones by default). Each callback is then called
+--requests times by --concurrency clients, after one warm-up call, and
+the requests per second and latency percentiles are reported per
+callback.
+"""
+import argparse
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('TWITTER_STALKER_ENV', 'production')
+
+import numpy as np
+import pandas as pd
+import requests
+
+from twitter_stalker.cache import save_dataset
+from twitter_stalker.replay import synthetic_dataset
+
+
+def callback_payload(outputs, inputs, state=()):
+    """Return the body Dash posts to /_dash-update-component"""
+    outputs = [{'id': i, 'property': p} for i, p in outputs]
+    if len(outputs) == 1:
+        output = outputs[0]['id'] + '.' + outputs[0]['property']
+        outputs = outputs[0]
+    else:
+        output = '..' + '...'.join(o['id'] + '.' + o['property']
+                                   for o in outputs) + '..'
+    return {'output': output, 'outputs': outputs,
+            'inputs': [{'id': i, 'property': p, 'value': v}
+                       for i, p, v in inputs],
+            'changedPropIds': [inputs[0][0] + '.' + inputs[0][1]],
+            'state': [{'id': i, 'property': p, 'value': v}
+                      for i, p, v in state]}
+
+
+def scenarios(key):
+    """Return {name: (method, path, json body)} of the calls to time"""
+    table_inputs = [('twitter_df', 'data', key),
+                    ('col_select', 'value', 'tweet_retweet_count'),
+                    ('num_filter', 'value', [10, 60]),
+                    ('cat_filter', 'value', None),
+                    ('str_filter', 'value', None),
+                    ('bool_filter', 'value', None),
+                    ('date_filter', 'start_date', None),
+                    ('date_filter', 'end_date', None),
+                    ('table', 'page_current', 0),
+                    ('table', 'page_size', 50),
+                    ('table', 'sort_by', [{'column_id': 'tweet_created_at',
+                                           'direction': 'desc'}]),
+                    ('output_table_col_select', 'value', None)]
+    path = '/_dash-update-component'
+    return {
+        'word frequency': ('POST', path, callback_payload(
+            [('wtd_freq_chart', 'figure')],
+            [('twitter_df', 'data', key),
+             ('text_columns', 'value', 'tweet_full_text'),
+             ('numeric_columns', 'value', 'tweet_retweet_count'),
+             ('regex_options', 'value', 'Words'),
+             ('search_type', 'value', 'Search Tweets')])),
+        'table page': ('POST', path, callback_payload(
+            [('table_page', 'data'), ('table', 'page_count'),
+             ('filtered_rows', 'data'), ('table', 'page_current')],
+            table_inputs, [('filtered_rows', 'data', None)])),
+        'user analysis': ('POST', path, callback_payload(
+            [('user_analysis_chart', 'figure')],
+            [('tabs', 'active_tab', 'user_analysis_tab'),
+             ('twitter_df', 'data', key),
+             ('search_type', 'value', 'Search Tweets')])),
+        'activity': ('POST', path, callback_payload(
+            [('timeseries_chart', 'figure')],
+            [('tabs', 'active_tab', 'timeseries_tab'),
+             ('twitter_df', 'data', key),
+             ('timeseries_freq', 'value', 'Hour'),
+             ('timeseries_metric', 'value', 'tweets'),
+             ('timeseries_group', 'value', 'tweet_lang'),
+             ('timeseries_window', 'value', 1)])),
+        'csv download': ('GET', '/download/' + key + '.csv', None),
+    }
+
+
+def run(url, method, path, body, n_requests, concurrency):
+    """Return the latencies (seconds) of n_requests calls made by
+    `concurrency` threads, and the wall time they took"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+
+    def call(_):
+        start = time.perf_counter()
+        response = session.request(method, url + path, json=body)
+        response.raise_for_status()
+        response.content
+        return time.perf_counter() - start
+    call(None)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(call, range(n_requests)))
+    return np.array(latencies), time.perf_counter() - start
+
+
+def main(url, key, rows, n_requests, concurrency):
+    if key is None:
+        key = save_dataset('loadtest-' + uuid.uuid4().hex[:8],
+                           synthetic_dataset(rows))
+    report = []
+    for name, (method, path, body) in scenarios(key).items():
+        latencies, elapsed = run(url.rstrip('/'), method, path, body,
+                                 n_requests, concurrency)
+        report.append({'callback': name, 'requests': n_requests,
+                       'rps': n_requests / elapsed,
+                       'p50_ms': np.percentile(latencies, 50) * 1000,
+                       'p95_ms': np.percentile(latencies, 95) * 1000,
+                       'max_ms': latencies.max() * 1000})
+    print('dataset: ' + key + ', concurrency: ' + str(concurrency))
+    print(pd.DataFrame(report).round(1).to_string(index=False))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8050')
+    parser.add_argument('--key', help='key of a dataset cached by the server')
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+    main(args.url, args.key, args.rows, args.requests, args.concurrency)
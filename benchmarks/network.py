@@ -0,0 +1,55 @@
+"""Network tab: building the interaction Graph and laying out its top users.
+
+Run from the repository root:
+
+    python -m benchmarks.network [--edges 10000 100000 1000000] [--top 100]
+
+Mentions are drawn with Zipf distributed targets, so a few users get most
+of them as on Twitter. For every size it times building the Graph
+(degrees, PageRank and components) and the server-side layout of the top
+users, and reports the number of edges sent to the browser.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from twitter_stalker.network import Graph
+
+
+def make_edges(m, seed=0):
+    """Return m mentions between m // 5 users"""
+    rng = np.random.default_rng(seed)
+    n = max(m // 5, 2)
+    targets = np.minimum(rng.zipf(1.5, m), n) - 1
+    names = np.array(['user%d' % i for i in range(n)], dtype=object)
+    return pd.DataFrame({'source': names[rng.integers(0, n, m)],
+                         'target': names[targets]})
+
+
+def main(sizes, top):
+    rows = []
+    for m in sizes:
+        edges = make_edges(m)
+        start = time.perf_counter()
+        graph = Graph(edges)
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        nodes, shown, _ = graph.layout(top)
+        laid_out = time.perf_counter() - start
+        rows.append({'interactions': m, 'users': graph.n_nodes,
+                     'edges': graph.n_edges,
+                     'components': graph.n_components(), 'build': built,
+                     'layout': laid_out, 'edges_shown': len(shown)})
+    pd.set_option('display.width', 120)
+    print(pd.DataFrame(rows).round(4).to_string(index=False))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--edges', nargs='+', type=int,
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--top', type=int, default=100)
+    args = parser.parse_args()
+    main(args.edges, args.top)
@@ -0,0 +1,79 @@
+"""Startup time: how long `import app` takes and which imports it spends
+that time on.
+
+Run from the repository root:
+
+    python -m benchmarks.startup [--runs 5] [--top 15] [--max-ms 2000]
+
+Every run imports app in a fresh interpreter with `python -X importtime`.
+The report gives the median total, and the median cumulative time of the
+slowest modules imported by app and by the twitter_stalker package. The
+script exits with status 1 if the median total exceeds --max-ms, or if a
+module that should only be imported on first use (see LAZY_MODULES) was
+imported at startup.
+"""
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+# heavy dependencies only imported by the callbacks that need them
+LAZY_MODULES = ['advertools', 'scrapy', 'twisted', 'textblob', 'nltk',
+                'twython', 'tweepy']
+
+
+def import_times():
+    """Return {module: (cumulative microseconds, depth)} of one fresh
+    import of app"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             'import app'], stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, text=True,
+                            check=True).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.setdefault(name.strip(), (int(cumulative), depth))
+    return times
+
+
+def main(runs, top, max_ms):
+    samples = defaultdict(list)
+    lazy_imported = set()
+    for _ in range(runs):
+        times = import_times()
+        for name, (cumulative, depth) in times.items():
+            if depth <= 1 or name.startswith('twitter_stalker'):
+                samples[name].append(cumulative / 1000)
+        lazy_imported |= {name.split('.')[0] for name in times
+                          if name.split('.')[0] in LAZY_MODULES}
+    report = pd.DataFrame({'module': list(samples),
+                           'median_ms': [np.median(v)
+                                         for v in samples.values()]})
+    report = report.sort_values('median_ms', ascending=False)
+    total = report.loc[report['module'] == 'app', 'median_ms'].iloc[0]
+    print(report.head(top).round(1).to_string(index=False))
+    print('\nimport app: ' + format(total, '.0f') + ' ms (median of ' +
+          str(runs) + ' runs)')
+    failed = False
+    if lazy_imported:
+        print('imported at startup: ' + ', '.join(sorted(lazy_imported)))
+        failed = True
+    if (max_ms is not None) and (total > max_ms):
+        print('slower than ' + str(max_ms) + ' ms')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--max-ms', type=float)
+    args = parser.parse_args()
+    sys.exit(main(args.runs, args.top, args.max_ms))
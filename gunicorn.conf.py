@@ -0,0 +1,28 @@
+"""gunicorn settings of the production mode: `gunicorn -c gunicorn.conf.py
+app:server`.
+
+The app is preloaded, so the Dash layout and the language options are
+built once in the master before it forks the workers, which share
+datasets and figures through the sqlite cache backend (see
+TWITTER_STALKER_CACHE in twitter_stalker/constants.py).
+"""
+import multiprocessing
+import os
+
+os.environ.setdefault('TWITTER_STALKER_ENV', 'production')
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '8050')
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             min(multiprocessing.cpu_count() * 2 + 1, 8)))
+# each worker scores sentiment with a pool of processes of its own: share
+# the CPUs between them (set TWITTER_STALKER_SENTIMENT_PROCESSES to
+# override), read by the app as it is preloaded after this file
+os.environ.setdefault('TWITTER_STALKER_SENTIMENT_PROCESSES',
+                      str(max(multiprocessing.cpu_count() // workers, 1)))
+# background fetch jobs and streamed downloads run in threads
+worker_class = 'gthread'
+threads = int(os.environ.get('TWITTER_STALKER_THREADS', 4))
+preload_app = True
+timeout = int(os.environ.get('TWITTER_STALKER_TIMEOUT', 120))
+keepalive = 5
+accesslog = '-'
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import threading
+
+# before twitter_stalker reads its settings: per process caches, no query
+# cache, no archive, short backoffs and a version published per page
+os.environ.update({
+    'TWITTER_STALKER_CACHE': 'memory',
+    'TWITTER_STALKER_QUERY_CACHE_TTL': '0',
+    'TWITTER_STALKER_QUERY_CACHE_DIR': tempfile.mkdtemp(),
+    'TWITTER_STALKER_FETCH_PUBLISH_INTERVAL': '0',
+    'TWITTER_STALKER_FETCH_RETRIES': '1',
+    'TWITTER_STALKER_FETCH_MAX_BACKOFF': '1',
+})
+for name in ['TWITTER_STALKER_ENV', 'TWITTER_STALKER_REPLAY',
+             'TWITTER_STALKER_ARCHIVE_DIR', 'TWITTER_STALKER_RECORD_DIR']:
+    os.environ.pop(name, None)
+
+import pytest  # noqa: E402
+
+from twitter_stalker import core, fetch  # noqa: E402
+from twitter_stalker.replay import make_server  # noqa: E402
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """A replay server on a free port, which make_client points at"""
+    server = make_server(port=0, replay_dir=None, latency_ms=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(fetch, 'get_api_url', lambda: 'http://127.0.0.1:' +
+                        str(server.server_port))
+    # clients are shared per credentials, and would call another server
+    monkeypatch.setattr(core, '_clients', {})
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def twtr(server):
+    return fetch.make_client()
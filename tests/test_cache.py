@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from twitter_stalker.cache import (DiskBackend, MemoryBackend, SQLiteBackend,
+                                   TieredBackend)
+
+
+def make(kind, directory, ttl, max_items=10):
+    if kind == 'memory':
+        return MemoryBackend(max_items, ttl)
+    if kind == 'disk':
+        return DiskBackend(str(directory / 'disk'), max_items, ttl)
+    return SQLiteBackend(str(directory / 'cache.sqlite3'), max_items, ttl)
+
+
+BACKENDS = ['memory', 'disk', 'sqlite']
+
+
+@pytest.mark.parametrize('kind', BACKENDS)
+def test_ttl_counts_from_the_last_use(kind, tmp_path):
+    backend = make(kind, tmp_path, ttl=0.5)
+    backend.set('used', 1)
+    backend.set('unused', 2)
+    for _ in range(3):
+        time.sleep(0.3)
+        assert backend.get('used') == 1
+    assert not backend.exists('unused')
+    assert backend.get('unused') is None
+
+
+@pytest.mark.parametrize('kind', BACKENDS)
+def test_least_recently_used_entries_are_evicted(kind, tmp_path):
+    backend = make(kind, tmp_path, ttl=60, max_items=2)
+    for key in ['a', 'b']:
+        backend.set(key, key)
+        time.sleep(0.02)
+    backend.get('a')
+    time.sleep(0.02)
+    backend.set('c', 'c')
+    assert [k for k in 'abc' if backend.exists(k)] == ['a', 'c']
+
+
+@pytest.mark.parametrize('kind', BACKENDS)
+def test_local_hits_keep_shared_entries_alive(kind, tmp_path):
+    shared = make(kind, tmp_path, ttl=0.5)
+    tiered = TieredBackend(shared, MemoryBackend(4, 0.5))
+    tiered.touch_interval = 0.1
+    tiered.set('key', 1)
+    for _ in range(3):
+        time.sleep(0.3)
+        assert tiered.get('key') == 1
+    assert shared.exists('key')
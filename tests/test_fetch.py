@@ -0,0 +1,142 @@
+import time
+
+import pytest
+from twython import TwythonRateLimitError
+
+from twitter_stalker.cache import load_dataset
+from twitter_stalker.fetch import (FetchJob, RateLimiter, RateLimitExhausted,
+                                   call_with_backoff, iter_pages,
+                                   latest_version, load_job_state)
+from twitter_stalker.replay import TIMELINE_RESULTS, RateLimits
+
+
+def test_search_pages_follow_max_id(twtr):
+    pages = list(iter_pages(twtr, 'Search Tweets', 'python', 250, None))
+    assert [len(page) for page in pages] == [100, 100, 50]
+    for previous, page in zip(pages, pages[1:]):
+        assert page['tweet_id'].max() < previous['tweet_id'].min()
+    for page in pages:
+        assert page['tweet_id'].is_monotonic_decreasing
+
+
+def test_timeline_pages_stop_at_the_api_cap(twtr):
+    pages = list(iter_pages(twtr, 'Get User Timeline', 'bob', 5000, None))
+    ids = [i for page in pages for i in page['tweet_id']]
+    assert len(ids) == len(set(ids)) == TIMELINE_RESULTS
+    assert set(pages[0]['user_screen_name']) == {'bob'}
+
+
+def test_user_search_pages_in_page_order(server, twtr):
+    pages = list(iter_pages(twtr, 'Search Users', 'data', 60, None))
+    assert [len(page) for page in pages] == [20, 20, 20]
+    ids = [i for page in pages for i in page['user_id']]
+    assert len(set(ids)) == 60
+    expected = server.world.search_users('data', count=20, page=2)
+    assert pages[1]['user_id'].tolist() == [u['id'] for u in expected]
+
+
+def rate_limit(server, endpoint, calls, window=1):
+    server.rate_limits = RateLimits(window, {endpoint: calls})
+
+
+def test_rate_limited_call_is_retried_after_the_reset(server, twtr):
+    rate_limit(server, 'search/tweets', 1)
+    limiter = RateLimiter(100, 900)
+    call_with_backoff(twtr.search, limiter=limiter, q='python', count=5)
+    response = call_with_backoff(twtr.search, limiter=limiter, q='python',
+                                 count=5)
+    assert len(response['statuses']) == 5
+    # the first call, the rate limited one and its retry
+    assert limiter.stats()['calls'] == 3
+
+
+def test_rate_limited_call_raises_after_the_retries(server, twtr):
+    rate_limit(server, 'search/tweets', 1, window=60)
+    call_with_backoff(twtr.search, q='python', count=5)
+    with pytest.raises(TwythonRateLimitError):
+        call_with_backoff(twtr.search, retries=0, q='python', count=5)
+
+
+def test_non_blocking_call_does_not_wait_for_the_reset(server, twtr):
+    rate_limit(server, 'search/tweets', 1, window=60)
+    limiter = RateLimiter(100, 900)
+    call_with_backoff(twtr.search, limiter=limiter, q='python', count=5)
+    start = time.time()
+    with pytest.raises(RateLimitExhausted):
+        call_with_backoff(twtr.search, limiter=limiter, block=False,
+                          q='python', count=5)
+    with pytest.raises(RateLimitExhausted):
+        call_with_backoff(twtr.search, limiter=limiter, block=False,
+                          q='python', count=5)
+    assert time.time() - start < 1
+    # after the 429 the limiter refuses calls without calling Twitter
+    assert limiter.stats() == {'calls': 2, 'remaining': 0, 'waited': 0}
+
+
+def run_job(job_id, search_type, query, count, monkeypatch):
+    """Run a FetchJob, returning it and a copy of every state it saved"""
+    job = FetchJob(job_id, search_type, query, count, None)
+    states = []
+    save_state = job.save_state
+
+    def record(**changes):
+        save_state(**changes)
+        states.append(dict(job.state))
+    monkeypatch.setattr(job, 'save_state', record)
+    job.run()
+    return job, states
+
+
+def test_job_publishes_each_page(server, monkeypatch):
+    job, states = run_job('test-timeline', 'Get User Timeline', 'bob', 600,
+                          monkeypatch)
+    assert [(s['status'], s['pages'], s['rows']) for s in states] == [
+        ('running', 1, 200), ('running', 2, 400), ('running', 3, 600),
+        ('done', 3, 600)]
+    assert [s['dataset'] for s in states] == [
+        'test-timeline-1', 'test-timeline-2', 'test-timeline-3',
+        'test-timeline-3']
+    assert load_job_state('test-timeline') == states[-1]
+    # superseded versions are dropped, their keys lead to the last one,
+    # which has every page
+    assert load_dataset('test-timeline-1') is None
+    assert latest_version('test-timeline-1') == 'test-timeline-3'
+    assert latest_version('test-timeline-3') == 'test-timeline-3'
+    assert latest_version('unknown') == 'unknown'
+    df = load_dataset('test-timeline-3')
+    assert len(df) == 600
+    assert df['tweet_id'].is_unique
+
+
+def test_job_keeps_the_pages_fetched_before_an_error(server, monkeypatch):
+    rate_limit(server, 'statuses/user_timeline', 2, window=60)
+    job, states = run_job('test-limited', 'Get User Timeline', 'bob', 600,
+                          monkeypatch)
+    assert states[-1]['status'] == 'error'
+    assert 'Rate limit' in states[-1]['error']
+    assert (states[-1]['pages'], states[-1]['rows']) == (2, 400)
+    assert len(load_dataset(states[-1]['dataset'])) == 400
+
+
+def test_job_without_api_fails(server, monkeypatch):
+    monkeypatch.setattr('twitter_stalker.fetch.get_api_url',
+                        lambda: 'http://127.0.0.1:1')
+    job, states = run_job('test-offline', 'Search Tweets', 'python', 100,
+                          monkeypatch)
+    assert [s['status'] for s in states] == ['error']
+    assert states[-1]['dataset'] is None
+    assert states[-1]['error']
+
+
+def test_old_versions_are_served_after_the_job_moved_on(server,
+                                                         monkeypatch):
+    import app
+
+    job, states = run_job('test-refresh', 'Get User Timeline', 'bob', 400,
+                          monkeypatch)
+    old = states[0]['dataset']
+    assert old != job.state['dataset']
+    assert app.summarize_dataset.__wrapped__(old)['rows'] == 400
+    response = app.server.test_client().get('/download/' + old + '.csv')
+    assert response.status_code == 200
+    assert len(response.get_data(as_text=True).splitlines()) == 401
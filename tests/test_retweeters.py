@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from twitter_stalker.constants import auth_params
+from twitter_stalker.core import TwitterStalker
+from twitter_stalker.network import lookup_retweeters
+from twitter_stalker.replay import ID_STEP, TOP_ID, RateLimits
+
+
+@pytest.fixture
+def stalker(server):
+    return TwitterStalker(auth_params['app_key'], auth_params['app_secret'],
+                          auth_params['oauth_token'],
+                          auth_params['oauth_token_secret'])
+
+
+def tweet_ids(server, n, max_id=None):
+    return [tweet['id'] for tweet in
+            server.world.search('python', count=n,
+                                max_id=max_id)['statuses']]
+
+
+def ids_from(index):
+    return TOP_ID - index * ID_STEP
+
+
+def retweeters(server, tweet_id):
+    # the server gets tweet ids as strings from the URL
+    return [retweet['user']['screen_name']
+            for retweet in server.world.retweets(str(tweet_id), count=100)]
+
+
+def test_retweeters_of_each_tweet(server, stalker):
+    ids = tweet_ids(server, 12)
+    found = stalker.check_who_retweeted_many(ids + ids[:3], workers=4)
+    assert list(found) == ids
+    assert found == {tweet_id: retweeters(server, tweet_id)
+                     for tweet_id in ids}
+    assert any(found.values())
+    assert stalker.retweets_limiter.stats()['calls'] == 12
+
+
+def test_non_blocking_lookup_leaves_out_rate_limited_tweets(server, stalker):
+    server.rate_limits = RateLimits(60, {'statuses/retweets': 5})
+    ids = tweet_ids(server, 12)
+    start = time.time()
+    found = stalker.check_who_retweeted_many(ids, block=False)
+    assert time.time() - start < 1
+    assert len(found) == 5
+    assert found == {tweet_id: retweeters(server, tweet_id)
+                     for tweet_id in found}
+    assert stalker.retweets_limiter.stats()['remaining'] == 0
+
+
+def test_lookups_are_capped_per_call(server, stalker):
+    # ids of their own, lookups are cached per tweet
+    ids = tweet_ids(server, 25, max_id=ids_from(1000))
+    counts = []
+    for _ in range(3):
+        found, error = lookup_retweeters(ids, n_lookups=10)
+        assert error is None
+        counts.append(len(found))
+    assert counts == [10, 20, 25]
+    assert found == {tweet_id: retweeters(server, tweet_id)
+                     for tweet_id in ids}
+
+
+def test_lookup_errors_are_reported(server, stalker, monkeypatch):
+    def fail(**params):
+        raise ValueError('no such tweet')
+    monkeypatch.setattr(server.world, 'retweets', fail)
+    ids = tweet_ids(server, 3, max_id=ids_from(2000))
+    found, error = lookup_retweeters(ids)
+    assert found == {}
+    assert 'no such tweet' in error
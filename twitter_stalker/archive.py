@@ -0,0 +1,399 @@
+"""A persistent archive of fetched tweets, analysed without loading it.
+
+Completed "Search Tweets" results are appended as Parquet files
+partitioned by query and day of tweet:
+
+    <archive_dir>/query=<query>/date=<YYYY-MM-DD>/part-<time>-<id>.parquet
+
+A "Search Archive" for a query (``*`` for every query) opens the files
+archived so far under an archive key, used by the callbacks like a
+dataset key. Archives can be far larger than memory, so every analysis
+reads them archive_chunk_rows rows at a time, and only the columns it
+needs, with the chunked counterparts of the in-memory functions
+(frequency_of_chunks, rollup_chunks, edges_of_chunks, top_rows...).
+Results are cached per archive key like those of datasets: the key
+changes whenever files are added.
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import (is_categorical_dtype, is_integer_dtype,
+                              is_string_dtype)
+
+from .cache import load_derived, save_derived
+from .constants import archive_chunk_rows, archive_dir
+from .downloads import iter_parquet_batches
+from .frequency import frequency_of_chunks
+from .network import EDGE_COLUMNS, cache_graph, edges_of_chunks
+from .query_cache import to_arrow
+from .schema import json_scalar
+from .table import top_rows
+from .timeseries import (FREQUENCIES, TIME_COLUMN, coarsen, group_counts,
+                         rollup_chunks)
+from .utils import MAX_FILTER_CATEGORIES
+
+ARCHIVE_PREFIX = 'archive-'
+ALL_QUERIES = '*'
+USER_COLUMNS = ['user_screen_name', 'user_followers_count',
+                'user_statuses_count', 'user_friends_count',
+                'user_favourites_count', 'user_verified', 'tweet_source',
+                'user_lang', 'user_created_at']
+# per chunk partial results kept before they are merged into one
+MERGE_PARTIALS = 8
+
+
+def query_slug(query):
+    """Return the directory name of a query: lowercased, runs of anything
+    but letters, digits, # and @ replaced by _"""
+    return re.sub(r'[^\w#@]+', '_', (query or '').strip().lower()).strip('_')
+
+
+def is_archive_key(key):
+    """Return whether key (the value of `twitter_df`) is an archive key"""
+    return isinstance(key, str) and key.startswith(ARCHIVE_PREFIX)
+
+
+def to_archive_table(df):
+    """Return a dataset as an Arrow table with the types of the archive,
+    the same whatever the in-memory layout of the dataset: 64 bit
+    integers, plain strings for categoricals and Arrow strings, and
+    nested values as JSON"""
+    df = df.copy(deep=False)
+    for column in df:
+        dtype = df[column].dtype
+        if is_categorical_dtype(dtype) or (is_string_dtype(dtype) and
+                                           dtype != object):
+            series = df[column].astype(object)
+            df[column] = series.where(series.notna(), None)
+        elif is_integer_dtype(dtype):
+            df[column] = df[column].astype('Int64')
+    return to_arrow(df)
+
+
+def _archived_ids(directory):
+    """Return the tweet ids already archived in a partition directory"""
+    import pyarrow.parquet as pq
+
+    ids = [pq.read_table(path, columns=['tweet_id']).column(0).to_numpy()
+           for path in glob.glob(os.path.join(directory, '*.parquet'))]
+    return np.concatenate(ids) if ids else np.array([], dtype=np.int64)
+
+
+def append(df, query, root=archive_dir):
+    """Archive the tweets of df (a prepared "Search Tweets" dataset) found
+    by query, leaving out those already archived for the same query and
+    day. Return the number of tweets written."""
+    import pyarrow.parquet as pq
+
+    if (not root) or (not len(df)) or \
+            not {'tweet_id', TIME_COLUMN} <= set(df):
+        return 0
+    df = df.dropna(subset=['tweet_id', TIME_COLUMN])
+    df = df.drop_duplicates('tweet_id')
+    days = df[TIME_COLUMN].dt.strftime('%Y-%m-%d')
+    written = 0
+    for day, part in df.groupby(days, sort=True):
+        directory = os.path.join(root, 'query=' + (query_slug(query) or '_'),
+                                 'date=' + day)
+        os.makedirs(directory, exist_ok=True)
+        part = part[~part['tweet_id'].isin(_archived_ids(directory))]
+        if not len(part):
+            continue
+        path = os.path.join(directory, 'part-' + time.strftime(
+            '%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:8] + '.parquet')
+        pq.write_table(to_archive_table(part), path + '.tmp',
+                       row_group_size=archive_chunk_rows)
+        os.replace(path + '.tmp', path)
+        written += len(part)
+    logging.info(msg='archived ' + str(written) + ' of ' + str(len(df)) +
+                 ' tweets of ' + repr(query))
+    return written
+
+
+def open_archive(query, root=archive_dir):
+    """Return the archive key of the files archived so far for query (or
+    every query for ``*``), or None if there are none"""
+    slug = '*' if query.strip() == ALL_QUERIES else query_slug(query)
+    if (not root) or (not slug):
+        return None
+    files = sorted(glob.glob(os.path.join(root, 'query=' + slug, 'date=*',
+                                          '*.parquet')))
+    if not files:
+        return None
+    version = json.dumps([[path, os.path.getsize(path)] for path in files])
+    key = ARCHIVE_PREFIX + hashlib.sha1(version.encode('utf-8')).hexdigest()[
+        :16]
+    save_derived(key, 'files', files)
+    return key
+
+
+def archive_files(key):
+    """Return the files of an archive key, or None if it expired"""
+    return load_derived(key, 'files')
+
+
+def open_dataset(key):
+    """Return the pyarrow dataset of an archive key, its files' schemas
+    unified (columns missing from some files are null there)"""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    files = archive_files(key)
+    schema = load_derived(key, 'schema', lambda: pa.unify_schemas(
+        [pq.read_schema(path) for path in files],
+        promote_options='permissive'))
+    return ds.dataset(files, schema=schema, format='parquet')
+
+
+def iter_batches(key, columns=None, filter=None):
+    """Yield the Arrow record batches of an archive, at most
+    archive_chunk_rows rows each, restricted to the columns it has among
+    columns and to the rows matching filter (a pyarrow expression).
+    Batches are read one at a time to keep memory bounded."""
+    dataset = open_dataset(key)
+    if columns is not None:
+        columns = [c for c in dict.fromkeys(columns)
+                   if c in dataset.schema.names]
+    for batch in dataset.to_batches(columns=columns, filter=filter,
+                                    batch_size=archive_chunk_rows,
+                                    batch_readahead=1, fragment_readahead=1):
+        if batch.num_rows:
+            yield batch
+
+
+def iter_chunks(key, columns=None, filter=None):
+    """Yield the batches of iter_batches as DataFrames"""
+    for batch in iter_batches(key, columns, filter):
+        yield batch.to_pandas()
+
+
+def merge_partials(partials, merge):
+    """Merge the partial results of the chunks read so far into one with
+    merge (a function of the list of them) once there are MERGE_PARTIALS,
+    so that aggregating a chunk never goes over the results of all the
+    previous ones. Return the list left."""
+    if len(partials) >= MERGE_PARTIALS:
+        return [merge(partials)]
+    return partials
+
+
+def type_name(arrow_type):
+    """Return the filter type (see utils.dtype_name) of an Arrow type;
+    strings are 'object', summarize tells categories apart"""
+    import pyarrow.types as types
+
+    if types.is_timestamp(arrow_type) or types.is_date(arrow_type):
+        return 'datetime'
+    if types.is_boolean(arrow_type):
+        return 'bool'
+    if types.is_integer(arrow_type):
+        return 'int'
+    if types.is_floating(arrow_type):
+        return 'float'
+    return 'object'
+
+
+def summarize(key):
+    """Return the dataset_summary of an archive, computed in one pass over
+    the columns it needs: numeric and datetime bounds, and the values of
+    the ``*lang*`` and ``*source*`` columns, which are 'category' if there
+    are at most MAX_FILTER_CATEGORIES of them (see utils.dtype_name).
+    Users are counted from the distinct user_screen_name of each chunk,
+    kept as Arrow arrays and merged as they pile up."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    def distinct(arrays):
+        return pc.unique(pa.concat_arrays(arrays))
+
+    dataset = open_dataset(key)
+    types = {field.name: type_name(field.type) for field in dataset.schema}
+    bounded = [c for c, t in types.items() if t in ['int', 'float',
+                                                   'datetime']]
+    values = {c: set() for c, t in types.items() if t == 'object' and (
+        ('lang' in c) or ('source' in c))}
+    users = []
+    columns = bounded + list(values) + ['user_screen_name']
+    bounds = {}
+    for batch in iter_batches(key, columns):
+        batch = dict(zip(batch.schema.names, batch.columns))
+        for column in bounded:
+            extremes = pc.min_max(batch[column])
+            low, high = extremes['min'].as_py(), extremes['max'].as_py()
+            if low is not None:
+                old_low, old_high = bounds.get(column, (low, high))
+                bounds[column] = (min(old_low, low), max(old_high, high))
+        for column, seen in values.items():
+            if seen is not None:
+                seen.update(pc.unique(batch[column]).drop_null().to_pylist())
+                if len(seen) > MAX_FILTER_CATEGORIES:
+                    values[column] = None
+        if 'user_screen_name' in batch:
+            users = merge_partials(
+                users + [pc.unique(batch['user_screen_name'])], distinct)
+    n_users = len(distinct(users).drop_null()) if users else 0
+    filters = {}
+    for column, (low, high) in bounds.items():
+        filters[column] = {'min': json_scalar(pd.Timestamp(low)
+                                               if types[column] == 'datetime'
+                                               else low),
+                           'max': json_scalar(pd.Timestamp(high)
+                                               if types[column] == 'datetime'
+                                               else high)}
+    for column, seen in values.items():
+        if seen is not None:
+            types[column] = 'category'
+            filters[column] = {'values': sorted(seen)}
+    return {'rows': dataset.count_rows(), 'users': n_users,
+            'columns': list(types),
+            'numeric_columns': [c for c in types if 'count' in c],
+            'types': types, 'filters': filters}
+
+
+def load_summary(key):
+    """Return the summary of an archive, computed at most once"""
+    return load_derived(key, 'summary', lambda: summarize(key))
+
+
+def filter_expression(col_type, col=None, numbers=None, categories=None,
+                      string=None, bool_filter=None, start_date=None,
+                      end_date=None):
+    """Return the pyarrow expression of the filter table.filter_rows
+    applies to a dataset, or None if no filter applies"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    from .indexes import REGEX_CHARS
+
+    if col is None:
+        return None
+    field = ds.field(col)
+    if numbers and (col_type in ['int', 'float']):
+        return (field >= numbers[0]) & (field <= numbers[-1])
+    elif categories and (col_type == 'category'):
+        return field.isin(categories)
+    elif string and col_type == 'object':
+        match = pc.match_substring_regex if REGEX_CHARS & set(string) \
+            else pc.match_substring
+        return match(field, string, ignore_case=True)
+    elif (bool_filter is not None) and (col_type == 'bool'):
+        return field == bool(bool_filter)
+    elif start_date and end_date and (col_type == 'datetime'):
+        bounds = []
+        for value in [start_date, end_date]:
+            value = pd.Timestamp(value)
+            if value.tzinfo is None:
+                value = value.tz_localize('UTC')
+            bounds.append(pa.scalar(value.to_pydatetime(),
+                                    pa.timestamp('us', tz='UTC')))
+        return (field >= bounds[0]) & (field <= bounds[1])
+    return None
+
+
+def _filters_name(filters, sort_by=None):
+    params = json.dumps([filters, sort_by or []], sort_keys=True, default=str)
+    return hashlib.sha1(params.encode('utf-8')).hexdigest()[:16]
+
+
+def count_rows(key, col_type, filters):
+    """Return the number of rows of an archive passing filters (the
+    keyword arguments of filter_expression), counted once per filter"""
+    return load_derived(
+        key, 'count.' + _filters_name(filters),
+        lambda: open_dataset(key).count_rows(
+            filter=filter_expression(col_type, **filters)))
+
+
+def read_rows(key, col_type, filters, sort_by, columns, start, stop):
+    """Return rows start to stop of the archive view passing filters, in
+    sort_by order (archive order without sort_by), with columns (every
+    column if None)"""
+    if columns is not None:
+        columns = [c for c in columns if c in open_dataset(key).schema.names]
+    read = None if columns is None else \
+        columns + [s['column_id'] for s in sort_by or []]
+    rows = top_rows(iter_chunks(key, read,
+                                filter_expression(col_type, **filters)),
+                    stop, sort_by)
+    if rows is None:
+        return pd.DataFrame(columns=columns or [])
+    rows = rows.iloc[start:stop]
+    return rows if columns is None else rows[columns]
+
+
+def iter_parquet(key, columns=None, filter=None):
+    """Yield the rows of an archive passing filter as a Parquet file, one
+    row group per batch"""
+    import pyarrow as pa
+
+    schema = open_dataset(key).schema
+    if columns is not None:
+        schema = pa.schema([schema.field(c) for c in dict.fromkeys(columns)
+                            if c in schema.names])
+    return iter_parquet_batches(schema, iter_batches(key, schema.names,
+                                                     filter))
+
+
+def load_frequency(key, text_col, num_col, mode, k=20):
+    """Return the top k frequency table of text_col weighted by num_col
+    (see frequency.frequency_of_chunks), computed at most once"""
+    return load_derived(
+        key, 'frequency.' + text_col + '.' + num_col + '.' + mode,
+        lambda: frequency_of_chunks(iter_chunks(key, [text_col, num_col]),
+                                    text_col, num_col, mode, k))
+
+
+def load_users(key):
+    """Return the USER_COLUMNS of the first archived tweet of every user:
+    the first row of each user in every chunk, merged as they pile up"""
+    def first_rows(frames):
+        users = pd.concat(frames, ignore_index=True)
+        return users.drop_duplicates('user_screen_name', ignore_index=True)
+
+    def compute():
+        users = []
+        for chunk in iter_chunks(key, USER_COLUMNS):
+            users = merge_partials(
+                users + [chunk.drop_duplicates('user_screen_name')],
+                first_rows)
+        return first_rows(users) if users else None
+    return load_derived(key, 'users', compute)
+
+
+def load_graph(key, edge_type):
+    """Return the Graph of edge_type interactions of an archive, see
+    network.cache_graph"""
+    return cache_graph(key, edge_type, lambda: edges_of_chunks(
+        iter_chunks(key, EDGE_COLUMNS[edge_type]), edge_type))
+
+
+def load_rollup(key, group_col, freq):
+    """Return the rollup of an archive at freq, like timeseries.load_rollup.
+
+    The minute rollup reads the archive twice: once for the most frequent
+    values of group_col, once to count every chunk by (minute, group).
+    """
+    name = 'timeseries.' + str(group_col) + '.' + freq
+
+    def compute():
+        finest = list(FREQUENCIES.values())[0]
+        if freq != finest:
+            return coarsen(load_rollup(key, group_col, finest), freq)
+        columns = [TIME_COLUMN, group_col, 'tweet_retweet_count',
+                   'tweet_favorite_count']
+        keep = None
+        if group_col is not None:
+            keep = group_counts(iter_chunks(key, [group_col]),
+                                group_col).index[:8]
+        return rollup_chunks(iter_chunks(key, columns), group_col, freq, keep)
+    return load_derived(key, name, compute)
@@ -0,0 +1,382 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from .constants import (cache_backend, cache_dir, cache_local_items,
+                        cache_max_datasets, cache_max_items, cache_ttl)
+
+
+class MemoryBackend():
+    """In-process LRU cache with a per-entry time to live (seconds).
+
+    Like the shared backends, entries expire `ttl` seconds after they were
+    last used (read, written or touched), not after they were written.
+    """
+    def __init__(self, max_items=32, ttl=3600):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            used_at, value = item
+            now = time.time()
+            if now - used_at > self.ttl:
+                del self._items[key]
+                return None
+            self._items[key] = (now, value)
+            self._items.move_to_end(key)
+            return value
+
+    def touch(self, key):
+        self.get(key)
+
+    def exists(self, key):
+        """Return whether key has an entry, without using it"""
+        with self._lock:
+            item = self._items.get(key)
+            return (item is not None) and \
+                (time.time() - item[0] <= self.ttl)
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.time(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+class DiskBackend():
+    """Pickle files in a directory, shared by all processes using it.
+
+    The file modification time, set whenever an entry is used, is used
+    both for the time to live and for least-recently-used eviction, so
+    gunicorn workers pointing at the same directory see each other's
+    entries.
+    """
+    def __init__(self, directory, max_items=256, ttl=3600):
+        self.directory = directory
+        self.max_items = max_items
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path)
+            return value
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def touch(self, key):
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def exists(self, key):
+        """Return whether key has an entry, without using it"""
+        try:
+            return time.time() - os.path.getmtime(self._path(key)) <= \
+                self.ttl
+        except FileNotFoundError:
+            return False
+
+    def set(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.pkl'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                continue
+        entries.sort()
+        for _, path in entries[:max(len(entries) - self.max_items, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class SQLiteBackend():
+    """Pickled values in one SQLite database file, shared by all processes
+    using it (e.g. gunicorn workers), without an external service.
+
+    Each process and thread opens its own connection, so a backend created
+    before gunicorn forks its workers is safe to use in them. The database
+    runs in WAL mode, so readers do not wait for a writer. Entries expire
+    and are evicted by the time they were last used (used_at).
+    """
+    def __init__(self, path, max_items=256, ttl=3600):
+        self.path = path
+        self.max_items = max_items
+        self.ttl = ttl
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY '
+                         'KEY, value BLOB, stored_at REAL, used_at REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_used_at '
+                         'ON cache (used_at)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if (conn is None) or (self._local.pid != os.getpid()):
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute('SELECT value, used_at FROM cache WHERE key = ?',
+                           (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        with conn:
+            if now - row[1] > self.ttl:
+                conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+                return None
+            conn.execute('UPDATE cache SET used_at = ? WHERE key = ?',
+                         (now, key))
+        return pickle.loads(row[0])
+
+    def touch(self, key):
+        with self._connect() as conn:
+            conn.execute('UPDATE cache SET used_at = ? WHERE key = ?',
+                         (time.time(), key))
+
+    def exists(self, key):
+        """Return whether key has an entry, without using it"""
+        row = self._connect().execute(
+            'SELECT used_at FROM cache WHERE key = ?', (key,)).fetchone()
+        return (row is not None) and (time.time() - row[0] <= self.ttl)
+
+    def set(self, key, value):
+        value = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                         (key, sqlite3.Binary(value), now, now))
+            conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM '
+                         'cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)',
+                         (self.max_items,))
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+class TieredBackend():
+    """A shared backend with a small in-process MemoryBackend in front, so
+    a worker unpickles each entry once rather than on every request.
+
+    Entries are never modified once set (see save_dataset), except the
+    states of fetch jobs (keys ending in one of `mutable_suffixes`), which
+    are always read from the shared backend.
+
+    Entries used from the local cache are also touched in the shared
+    backend (at most every `touch_interval` seconds per entry), so that
+    they do not expire or get evicted there while a worker uses them.
+    """
+    mutable_suffixes = ('.job',)
+    touch_interval = 60
+
+    def __init__(self, shared, local):
+        self.shared = shared
+        self.local = local
+        self._touched = {}
+        self._lock = threading.Lock()
+
+    def _is_mutable(self, key):
+        return key.endswith(self.mutable_suffixes)
+
+    def _touch_shared(self, key, now):
+        with self._lock:
+            if now - self._touched.get(key, 0) < self.touch_interval:
+                return
+            self._touched[key] = now
+            if len(self._touched) > 4 * self.local.max_items:
+                self._touched = {k: t for k, t in self._touched.items()
+                                 if now - t < self.touch_interval}
+        self.shared.touch(key)
+
+    def get(self, key):
+        if self._is_mutable(key):
+            return self.shared.get(key)
+        value = self.local.get(key)
+        if value is None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+                with self._lock:
+                    self._touched[key] = time.time()
+        else:
+            self._touch_shared(key, time.time())
+        return value
+
+    def touch(self, key):
+        self.local.touch(key)
+        self.shared.touch(key)
+
+    def exists(self, key):
+        """Return whether key has an entry, without using it"""
+        return (not self._is_mutable(key) and self.local.exists(key)) or \
+            self.shared.exists(key)
+
+    def set(self, key, value):
+        self.shared.set(key, value)
+        if not self._is_mutable(key):
+            self.local.set(key, value)
+            with self._lock:
+                self._touched[key] = time.time()
+
+    def delete(self, key):
+        self.shared.delete(key)
+        self.local.delete(key)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+def make_backend(backend=cache_backend, name='cache', **kwargs):
+    """Return a cache backend by name: 'memory', or 'disk' or 'sqlite'
+    (with a per-process memory cache of cache_local_items entries in
+    front, unless it is 0); shared backends store their entries in
+    cache_dir, in a directory or database file called name"""
+    kwargs.setdefault('max_items', cache_max_items)
+    kwargs.setdefault('ttl', cache_ttl)
+    if backend == 'memory':
+        return MemoryBackend(**kwargs)
+    if backend == 'disk':
+        shared = DiskBackend(os.path.join(cache_dir, name), **kwargs)
+    elif backend == 'sqlite':
+        shared = SQLiteBackend(os.path.join(cache_dir, name + '.sqlite3'),
+                               **kwargs)
+    else:
+        raise ValueError('Unknown cache backend: ' + str(backend))
+    if cache_local_items <= 0:
+        return shared
+    return TieredBackend(shared, MemoryBackend(
+        min(cache_local_items, kwargs['max_items']), kwargs['ttl']))
+
+
+dataset_cache = make_backend(name='datasets', max_items=cache_max_datasets)
+derived_cache = make_backend(name='derived')
+
+
+def search_key(search_type, query, count, lang):
+    """Return a stable hash of the normalized search parameters"""
+    params = {'search_type': search_type,
+              'query': (query or '').strip().lower(),
+              'count': count,
+              'lang': lang}
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')
+                        ).hexdigest()[:16]
+
+
+def new_dataset_key(search_type, query, count, lang):
+    """Return a fresh key for a run of the given search"""
+    return (search_key(search_type, query, count, lang) + '-' +
+            uuid.uuid4().hex[:8])
+
+
+def save_dataset(key, df):
+    """Cache df under key, the value the client keeps in its store.
+
+    Cached datasets are never modified in place: a dataset that grows
+    (e.g. while a search is still being fetched) gets a new key for every
+    version, so everything derived from a key stays valid.
+    """
+    dataset_cache.set(key, df)
+    logging.info(msg='cached dataset ' + key + ', shape:' + str(df.shape))
+    return key
+
+
+def load_dataset(key):
+    """Return the cached DataFrame for key, or None if it expired"""
+    if key is None:
+        return None
+    return dataset_cache.get(key)
+
+
+def dataset_exists(key):
+    """Return whether dataset key is still cached, without counting it as
+    a use"""
+    return (key is not None) and dataset_cache.exists(key)
+
+
+def delete_dataset(key, derived=()):
+    """Remove dataset key from the cache, and the artifacts derived from
+    it named in derived"""
+    dataset_cache.delete(key)
+    for name in derived:
+        derived_cache.delete(key + '.' + name)
+
+
+def save_derived(key, name, value):
+    """Cache value as the artifact `name` derived from dataset key"""
+    derived_cache.set(key + '.' + name, value)
+
+
+def load_derived(key, name, compute=None):
+    """Return the artifact `name` derived from dataset key.
+
+    If it is missing and compute is given, compute() is called, cached and
+    returned, so each artifact is built at most once per dataset.
+    """
+    value = derived_cache.get(key + '.' + name)
+    if (value is None) and (compute is not None):
+        value = compute()
+        if value is not None:
+            save_derived(key, name, value)
+    return value
@@ -1,6 +1,5 @@
-import advertools as adv
-import base64
 import json
+import os
 
 auth_params={}
 with open("twitter_stalker/assets/auth.json","r") as f:
@@ -8,6 +7,127 @@ with open("twitter_stalker/assets/auth.json","r") as f:
     f.close()
 
 twitter_lang_metadata_filename = 'twitter_stalker/assets/twitter_lang_df.csv'
+# the language dropdown options, precomputed from the CSV above
+lang_options_filename = 'twitter_stalker/assets/lang_options.json'
+# the logo, served by app.py at logo_url
+logo_filename = 'twitter_stalker/assets/logo.png'
+logo_url = '/logo.png'
+
+# production mode (set by gunicorn.conf.py): several gunicorn workers
+# sharing their datasets and figures through the cache backend
+production = os.environ.get('TWITTER_STALKER_ENV') == 'production'
+
+# server-side dataset cache: 'memory' (per process), or 'disk' and 'sqlite'
+# (shared by every worker pointing at the same directory, the default in
+# production). Datasets and what is derived from them (figures, indexes,
+# table views, job states...) are kept apart, each with its own number of
+# entries, so that derived entries never push datasets out. Entries expire
+# cache_ttl seconds after they were last used, in every backend
+cache_backend = os.environ.get('TWITTER_STALKER_CACHE',
+                               'sqlite' if production else 'memory')
+cache_dir = os.environ.get('TWITTER_STALKER_CACHE_DIR', '/tmp/twitter_stalker')
+cache_max_datasets = int(os.environ.get('TWITTER_STALKER_CACHE_MAX_DATASETS',
+                                        16))
+cache_max_items = int(os.environ.get('TWITTER_STALKER_CACHE_MAX_ITEMS', 256))
+cache_ttl = int(os.environ.get('TWITTER_STALKER_CACHE_TTL', 3600))
+# entries of a shared (disk or sqlite) cache also kept in each process
+cache_local_items = int(os.environ.get('TWITTER_STALKER_CACHE_LOCAL_ITEMS',
+                                       16))
+
+# base URL of the Twitter API, e.g. http://127.0.0.1:8081 for a local stand-in
+twitter_api_url = os.environ.get('TWITTER_STALKER_API_URL')
+# offline mode: every process runs its own stand-in of the API (replay.py)
+# and calls it instead, answering from the responses recorded in
+# twitter_replay_dir or else with synthetic data, with a mean latency and
+# a rate limit window (0 for no limits)
+twitter_replay = os.environ.get('TWITTER_STALKER_REPLAY',
+                                '').lower() in ['1', 'true', 'yes']
+twitter_replay_dir = os.environ.get('TWITTER_STALKER_REPLAY_DIR')
+twitter_replay_latency_ms = float(
+    os.environ.get('TWITTER_STALKER_REPLAY_LATENCY_MS', 0))
+twitter_replay_window = float(os.environ.get('TWITTER_STALKER_REPLAY_WINDOW',
+                                             900))
+# directory the API responses are saved in, to be replayed later
+twitter_record_dir = os.environ.get('TWITTER_STALKER_RECORD_DIR')
+# background fetch jobs: number of threads, and the minimum number of
+# seconds between two published versions of a growing dataset
+fetch_workers = int(os.environ.get('TWITTER_STALKER_FETCH_WORKERS', 4))
+fetch_publish_interval = float(
+    os.environ.get('TWITTER_STALKER_FETCH_PUBLISH_INTERVAL', 1))
+# pages of "Search Users" fetched concurrently, and retries (with
+# exponential backoff, capped at fetch_max_backoff seconds) for rate limited
+# or failed API calls
+user_search_workers = int(os.environ.get('TWITTER_STALKER_USER_SEARCH_WORKERS',
+                                         5))
+fetch_retries = int(os.environ.get('TWITTER_STALKER_FETCH_RETRIES', 3))
+fetch_max_backoff = float(os.environ.get('TWITTER_STALKER_FETCH_MAX_BACKOFF',
+                                         60))
+# concurrent lookups of who retweeted a tweet, and the rate limit of the
+# statuses/retweets endpoint (calls per 15 minute window)
+retweet_workers = int(os.environ.get('TWITTER_STALKER_RETWEET_WORKERS', 8))
+retweets_rate_limit = int(
+    os.environ.get('TWITTER_STALKER_RETWEETS_RATE_LIMIT', 75))
+# most retweeted tweets whose retweeters the network tab looks up
+network_api_tweets = int(os.environ.get('TWITTER_STALKER_NETWORK_API_TWEETS',
+                                        50))
+# of which at most this many are looked up per request of the tab (the
+# lookups run in the request), the others on the next visits of the tab
+network_api_lookups = int(
+    os.environ.get('TWITTER_STALKER_NETWORK_API_LOOKUPS', 10))
+
+# persistent Parquet cache of complete search results, keyed by the
+# normalized search; a ttl of 0 disables it
+query_cache_dir = os.environ.get('TWITTER_STALKER_QUERY_CACHE_DIR',
+                                 '/tmp/twitter_stalker_queries')
+query_cache_ttl = int(os.environ.get('TWITTER_STALKER_QUERY_CACHE_TTL', 900))
+query_cache_max_bytes = int(
+    os.environ.get('TWITTER_STALKER_QUERY_CACHE_MAX_MB', 512)) * 1024 ** 2
+
+# archive of every completed "Search Tweets" result, as Parquet files
+# partitioned by query and day (see archive.py), which "Search Archive"
+# analyses archive_chunk_rows rows at a time; no directory, no archive
+archive_dir = os.environ.get('TWITTER_STALKER_ARCHIVE_DIR')
+archive_chunk_rows = int(os.environ.get('TWITTER_STALKER_ARCHIVE_CHUNK_ROWS',
+                                        50000))
+
+# sentiment scoring: processes used for large batches (every CPU by
+# default, CPUs divided by the number of workers under gunicorn, see
+# gunicorn.conf.py; TWITTER_STALKER_SENTIMENT_PROCESSES overrides both),
+# and the number of memoized scores kept per process
+sentiment_processes = int(os.environ.get('TWITTER_STALKER_SENTIMENT_PROCESSES',
+                                         os.cpu_count() or 1))
+sentiment_cache_size = int(
+    os.environ.get('TWITTER_STALKER_SENTIMENT_CACHE_SIZE', 100000))
+
+# keep the cleaned main text column (e.g. tweet_clean_text) in fetched
+# datasets, instead of only using it to score sentiment
+keep_clean_text = os.environ.get('TWITTER_STALKER_KEEP_CLEAN_TEXT',
+                                 '').lower() in ['1', 'true', 'yes']
+
+# callback metrics served at /metrics (see metrics.instrument), and the
+# directory the cProfile output of profiled callbacks is saved in
+metrics_enabled = os.environ.get('TWITTER_STALKER_METRICS',
+                                 '').lower() in ['1', 'true', 'yes']
+profile_dir = os.environ.get('TWITTER_STALKER_PROFILE_DIR',
+                             '/tmp/twitter_stalker_profiles')
+
+# compression of responses with Flask-Compress (JSON, HTML, CSS and JS;
+# downloads are streamed as they are): algorithms in order of preference
+# ('gzip', 'br', 'deflate'), gzip and Brotli levels, and the size below
+# which responses are sent uncompressed
+compress_responses = os.environ.get('TWITTER_STALKER_COMPRESS',
+                                    '1').lower() in ['1', 'true', 'yes']
+compress_algorithms = os.environ.get('TWITTER_STALKER_COMPRESS_ALGORITHMS',
+                                     'gzip').split(',')
+compress_level = int(os.environ.get('TWITTER_STALKER_COMPRESS_LEVEL', 6))
+compress_br_level = int(os.environ.get('TWITTER_STALKER_COMPRESS_BR_LEVEL',
+                                       4))
+compress_min_bytes = int(os.environ.get('TWITTER_STALKER_COMPRESS_MIN_BYTES',
+                                        1024))
+
+# digits after the decimal point kept in the floats sent to the table
+payload_float_digits = int(
+    os.environ.get('TWITTER_STALKER_PAYLOAD_FLOAT_DIGITS', 4))
 
 exclude_columns = ['tweet_entities', 'tweet_geo', 'user_entities',
                    'tweet_coordinates', 'tweet_metadata',
@@ -15,12 +135,26 @@ exclude_columns = ['tweet_entities', 'tweet_geo', 'user_entities',
                    'tweet_display_text_range', 'tweet_user', 'tweet_place',
                    'tweet_truncated']
 
-regex_dict = {'Emoji': adv.emoji.EMOJI_RAW,
-              'Mentions': adv.regex.MENTION_RAW,
-              'Hashtags': adv.regex.HASHTAG_RAW,}
+# API fields none of the views use, dropped by schema.compact_dataset: the
+# ids repeated as strings, profile appearance settings, and fields about
+# the authenticating user rather than the tweet or user
+unused_columns_regex = (r'_id_str$|^user_profile_|^user_default_profile|'
+                        r'^user_(following|follow_request_sent|notifications|'
+                        r'translator_type|is_translator|'
+                        r'is_translation_enabled|has_extended_profile|'
+                        r'contributors_enabled|utc_offset|time_zone)$|'
+                        r'^tweet_(favorited|retweeted)$')
+# string columns repeating the same few values over many tweets, stored as
+# categoricals by schema.compact_dataset ('lang' and 'source' columns
+# already are, see schema.normalize_dataset)
+category_columns = ['user_screen_name', 'user_name', 'user_location']
+
+# advertools (submodule, regex) counted by "Elements to count", looked up
+# on first use (see frequency.get_regex) as importing advertools is slow
+regex_dict = {'Emoji': ('emoji', 'EMOJI_RAW'),
+              'Mentions': ('regex', 'MENTION_RAW'),
+              'Hashtags': ('regex', 'HASHTAG_RAW'),}
 
 phrase_len_dict = {'Words': 1,
                    '2-word Phrases': 2,
                    '3-word Phrases': 3}
-
-img_base64 = base64.b64encode(open('twitter_stalker/assets/logo.png', 'rb').read()).decode('ascii')
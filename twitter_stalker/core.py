@@ -1,6 +1,38 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import tweepy
-import re
-from textblob import TextBlob
+from twython import TwythonError
+
+from .constants import retweet_workers, retweets_rate_limit
+from .fetch import (RateLimiter, RateLimitExhausted, call_with_backoff,
+                    make_client)
+from .sentiment import sentiment_scores
+from .text import clean_text, clean_texts
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_clients(consumer_key, consumer_secret, access_token, access_token_secret):
+    """Return the process-wide (tweepy API, Twython client, retweets
+    RateLimiter) of a set of credentials, created on first use.
+
+    The Twython client keeps its connections alive across calls and
+    threads, which tweepy's API does not.
+    """
+    credentials = (consumer_key, consumer_secret, access_token, access_token_secret)
+    with _clients_lock:
+        if credentials not in _clients:
+            auth = tweepy.OAuthHandler(consumer_key, consumer_secret)
+            auth.set_access_token(access_token, access_token_secret)
+            twtr = make_client(pool_size=retweet_workers, credentials={
+                'app_key': consumer_key, 'app_secret': consumer_secret,
+                'oauth_token': access_token,
+                'oauth_token_secret': access_token_secret})
+            _clients[credentials] = (tweepy.API(auth), twtr,
+                                     RateLimiter(retweets_rate_limit, 15 * 60))
+        return _clients[credentials]
 
 
 class TwitterStalker():
@@ -10,11 +42,10 @@ class TwitterStalker():
         self.access_token = access_token
         self.access_token_secret = access_token_secret
 
-        self.auth = tweepy.OAuthHandler(self.consumer_key, self.consumer_secret) 
-        self.auth.set_access_token(self.access_token, self.access_token_secret) 
-        
-        # calling the api  
-        self.api = tweepy.API(self.auth) 
+        # the api clients are shared by every instance with these credentials
+        self.api, self.twtr, self.retweets_limiter = get_clients(
+            consumer_key, consumer_secret, access_token, access_token_secret)
+        self.auth = self.api.auth
 
     def check_who_retweeted(self, tweet_id):
         retweets_list = self.api.retweets(tweet_id) 
@@ -26,19 +57,48 @@ class TwitterStalker():
 
         return all_retweeted
 
+    def _retweeters(self, tweet_id, block=True):
+        try:
+            retweets = call_with_backoff(self.twtr.get_retweets,
+                                         limiter=self.retweets_limiter,
+                                         block=block, id=tweet_id, count=100)
+        except RateLimitExhausted:
+            return None
+        except TwythonError as e:
+            # deleted or protected tweets have no visible retweets
+            if e.error_code in [403, 404]:
+                return []
+            raise
+        return [retweet['user']['screen_name'] for retweet in retweets]
+
+    def check_who_retweeted_many(self, tweet_ids, workers=retweet_workers,
+                                 block=True):
+        """Return {tweet_id: screen names of its retweeters} for every tweet
+        in tweet_ids, looked up concurrently by `workers` threads.
+
+        Calls are accounted for in the shared retweets rate limiter (see
+        `retweets_limiter.stats()`), so threads wait for the next rate limit
+        window instead of failing. With block=False they don't wait, and
+        the tweets left to look up once the window is used up are missing
+        from the result.
+        """
+        tweet_ids = list(dict.fromkeys(tweet_ids))
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            retweeters = pool.map(lambda tweet_id:
+                                  self._retweeters(tweet_id, block), tweet_ids)
+            return {tweet_id: names
+                    for tweet_id, names in zip(tweet_ids, retweeters)
+                    if names is not None}
+
     def trim(self, tweet):
-        return ' '.join(re.sub("(@[A-Za-z0-9]+)|([^0-9A-Za-z \t]) | (\w+:\/\/\S+)", " ", tweet).split())
+        return clean_text(tweet)
 
     def get_tweets(self, screen_name, count = 10):
         tweets = self.api.user_timeline(screen_name= screen_name, count=count, tweet_mode="extended")
 
-        tweets = [self.trim(tweet.full_text) for tweet in tweets]
-        return tweets
+        return clean_texts([tweet.full_text for tweet in tweets]).tolist()
 
     def get_tweet_sentiments(self, screen_name, count = 10):
-        tweets = self.api.user_timeline(screen_name= screen_name, count=count, tweet_mode="extended")
-
-        tweets = [self.trim(tweet.full_text) for tweet in tweets]
+        tweets = self.get_tweets(screen_name, count=count)
 
-        sentiments = [TextBlob(tweet).sentiment.polarity  for tweet in tweets]
-        return sentiments
\ No newline at end of file
+        return sentiment_scores(tweets).tolist()
\ No newline at end of file
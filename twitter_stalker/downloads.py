@@ -0,0 +1,66 @@
+from .query_cache import to_arrow
+
+
+def iter_csv(df, chunk_size=10000):
+    """Yield df as CSV text, chunk_size rows at a time"""
+    for start in range(0, max(len(df), 1), chunk_size):
+        yield df.iloc[start:start + chunk_size].to_csv(index=False,
+                                                       header=start == 0,
+                                                       encoding='utf-8')
+
+
+def iter_csv_chunks(chunks):
+    """Yield an iterable of DataFrames as one CSV text"""
+    for i, chunk in enumerate(chunks):
+        yield chunk.to_csv(index=False, header=i == 0, encoding='utf-8')
+
+
+class _ChunkSink():
+    """Write-only file that hands out what was written so far, so a
+    Parquet file can be streamed while it is being written"""
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_parquet(df, chunk_size=10000):
+    """Yield df as a Parquet file, writing one row group per chunk_size
+    rows and yielding the bytes of each as soon as it is written"""
+    table = to_arrow(df)
+    return iter_parquet_batches(table.schema, table.to_batches(chunk_size))
+
+
+def iter_parquet_batches(schema, batches):
+    """Yield Arrow record batches of schema as a Parquet file, one row
+    group per batch, yielding the bytes of each as soon as it is written"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+    for batch in batches:
+        writer.write_batch(batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
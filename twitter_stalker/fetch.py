@@ -0,0 +1,397 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from .archive import append, open_archive
+from .cache import (delete_dataset, load_derived, new_dataset_key,
+                    save_dataset, save_derived, search_key)
+from .constants import (archive_dir, auth_params, exclude_columns,
+                        fetch_max_backoff, fetch_publish_interval,
+                        fetch_retries, fetch_workers, keep_clean_text,
+                        twitter_api_url, twitter_record_dir, twitter_replay,
+                        user_search_workers)
+from .query_cache import query_cache
+from .schema import (append_dataset, compact_dataset, dataset_summary,
+                     normalize_dataset)
+from .sentiment import sentiment_scores
+from .text import clean_texts
+
+executor = ThreadPoolExecutor(max_workers=fetch_workers,
+                              thread_name_prefix='fetch')
+
+
+def get_api_url():
+    """Return the base URL of the Twitter API to call (None for the real
+    one), starting this process' replay server in offline mode"""
+    if twitter_replay:
+        from .replay import local_server_url
+        return local_server_url()
+    return twitter_api_url
+
+
+def make_client(pool_size=user_search_workers, credentials=None):
+    """Return a Twython client, pointed at get_api_url() if it is set, and
+    saving its responses in twitter_record_dir if that is set.
+
+    Its keep-alive connection pool is sized so that pool_size threads can
+    share the client. credentials (a dict with the keys of auth.json)
+    default to the app's own.
+    """
+    from requests.adapters import HTTPAdapter
+    from twython import Twython
+
+    twtr = Twython(**(credentials or auth_params))
+    api_url = get_api_url()
+    if api_url:
+        twtr.api_url = api_url.rstrip('/') + '/%s'
+    if twitter_record_dir:
+        from .replay import record_responses
+        twtr.client.hooks['response'].append(
+            record_responses(twitter_record_dir))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    twtr.client.mount('https://', adapter)
+    twtr.client.mount('http://', adapter)
+    return twtr
+
+
+class RateLimitExhausted(Exception):
+    """Raised by non-blocking calls instead of waiting for the rate limit
+    window to reset"""
+
+
+class RateLimiter():
+    """Client side accounting of an endpoint's rate limit, shared by the
+    threads calling it: at most `calls` calls per `window` seconds.
+
+    Callers block in `acquire` once the window is used up, rather than
+    each of them getting rate limited by Twitter.
+    """
+    def __init__(self, calls, window):
+        self.calls = calls
+        self.window = window
+        self.used = 0
+        self.reset = 0
+        self.total = 0
+        self.waited = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, block=True):
+        """Wait for a call to be available in the window and use it.
+
+        With block=False, return False at once if the window is used up
+        (True when a call was used).
+        """
+        while True:
+            with self._lock:
+                now = time.time()
+                if now >= self.reset:
+                    self.used, self.reset = 0, now + self.window
+                if self.used < self.calls:
+                    self.used += 1
+                    self.total += 1
+                    return True
+                if not block:
+                    return False
+                wait = self.reset - now
+                self.waited += wait
+            logging.info(msg='rate limit used up, waiting ' +
+                         format(wait, '.1f') + ' seconds')
+            time.sleep(wait)
+
+    def exhaust(self, reset):
+        """Mark the window as used up until reset (a Unix time), when
+        Twitter says so"""
+        with self._lock:
+            self.used = self.calls
+            self.reset = reset
+
+    def stats(self):
+        """Return the calls made, the calls left in the current window and
+        the seconds spent waiting for one"""
+        with self._lock:
+            left = self.calls if time.time() >= self.reset else \
+                self.calls - self.used
+            return {'calls': self.total, 'remaining': left,
+                    'waited': round(self.waited, 3)}
+
+
+def call_with_backoff(func, retries=fetch_retries, limiter=None, block=True,
+                      **params):
+    """Call a Twython endpoint, retrying with exponential backoff when it is
+    rate limited (waiting for the rate limit reset if Twitter sent one) or
+    when Twitter answers with a server error.
+
+    Every attempt is accounted for in limiter (a RateLimiter) if given.
+    With block=False, RateLimitExhausted is raised instead of waiting for
+    the limiter or for a rate limit reset.
+    """
+    from twython import TwythonError, TwythonRateLimitError
+
+    for attempt in range(retries + 1):
+        try:
+            if (limiter is not None) and not limiter.acquire(block):
+                raise RateLimitExhausted(func.__name__)
+            return func(**params)
+        except TwythonRateLimitError as e:
+            if e.retry_after and (limiter is not None):
+                limiter.exhaust(float(e.retry_after))
+            if not block:
+                raise RateLimitExhausted(func.__name__) from e
+            if attempt == retries:
+                raise
+            wait = 2 ** attempt
+            if e.retry_after:
+                wait = max(float(e.retry_after) - time.time(), wait)
+        except TwythonError as e:
+            if (e.error_code or 0) < 500 or attempt == retries:
+                raise
+            wait = 2 ** attempt
+        wait = min(wait, fetch_max_backoff)
+        logging.info(msg=func.__name__ + ' | retrying in ' +
+                     format(wait, '.1f') + ' seconds')
+        time.sleep(wait)
+
+
+def _finalize_page(df):
+    """Parse dates, split sources and expand entities like advertools"""
+    from advertools.twitter import _expand_entities
+
+    for col in df:
+        if 'created_at' in col:
+            df[col] = pd.to_datetime(df[col])
+    for col in list(df):
+        if 'source' in col:
+            df[col + '_url'] = df[col].str.extract('<a href="(.*)" rel=')[0]
+            df[col] = df[col].str.extract('nofollow">(.*)</a>')[0]
+    if 'tweet_entities' in df:
+        return _expand_entities(df)
+    return df
+
+
+def statuses_to_df(statuses):
+    """Return a list of tweet objects as a DataFrame, with the same
+    tweet_/user_ columns as advertools"""
+    tweet_df = pd.DataFrame(statuses)
+    tweet_df.columns = ['tweet_' + c for c in tweet_df.columns]
+    user_df = pd.DataFrame([x['user'] for x in statuses])
+    user_df.columns = ['user_' + c for c in user_df.columns]
+    return _finalize_page(pd.concat([tweet_df, user_df], axis=1, sort=False))
+
+
+def users_to_df(users):
+    """Return a list of user objects as a DataFrame of user_ columns"""
+    df = _finalize_page(pd.DataFrame(users))
+    df.columns = ['user_' + c for c in df.columns]
+    return df
+
+
+def iter_pages(twtr, search_type, query, count, lang):
+    """Yield the results of a search one API page (DataFrame) at a time"""
+    from advertools.twitter import DEFAULT_COUNTS, _get_counts
+
+    if search_type == 'Search Tweets':
+        max_id = None
+        for num in _get_counts(count, DEFAULT_COUNTS['search']):
+            statuses = call_with_backoff(twtr.search,
+                                         q=query + ' -filter:retweets',
+                                         count=num, lang=lang, max_id=max_id,
+                                         tweet_mode='extended')['statuses']
+            if not statuses:
+                break
+            yield statuses_to_df(statuses)
+            max_id = statuses[-1]['id'] - 1
+    elif search_type == 'Search Users':
+        yield from iter_user_pages(twtr, query, count)
+    else:
+        max_id = None
+        for num in _get_counts(count, DEFAULT_COUNTS['get_user_timeline']):
+            statuses = call_with_backoff(twtr.get_user_timeline,
+                                         screen_name=query,
+                                         exclude_replies=False,
+                                         include_rts=True, count=num,
+                                         max_id=max_id,
+                                         tweet_mode='extended')
+            if not statuses:
+                break
+            yield statuses_to_df(statuses)
+            max_id = statuses[-1]['id'] - 1
+
+
+def iter_user_pages(twtr, query, count, workers=user_search_workers):
+    """Yield the pages of a user search in page order, while up to
+    `workers` pages are requested concurrently.
+
+    Unlike tweets, user search pages are addressed by page number, so they
+    do not depend on each other. Iteration stops at the first empty page.
+    """
+    from advertools.twitter import _get_counts
+
+    counts = _get_counts(count, default=20)
+    with ThreadPoolExecutor(max_workers=min(workers, len(counts)),
+                            thread_name_prefix='user_search') as pool:
+        futures = [pool.submit(call_with_backoff, twtr.search_users, q=query,
+                               count=num, page=i, include_entities=True)
+                   for i, num in enumerate(counts, start=1)]
+        try:
+            for future in futures:
+                users = future.result()
+                if not users:
+                    break
+                yield users_to_df(users)
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def prepare_dataset(pages, clean_text=keep_clean_text):
+    """Concatenate fetched pages, drop unused columns, normalize, add the
+    sentiment of the cleaned main text column (and the cleaned text itself
+    if clean_text) and compact the result"""
+    df = pd.concat(pages, ignore_index=True, sort=False)
+    for exclude in exclude_columns:
+        if exclude in df:
+            del df[exclude]
+    df = normalize_dataset(df)
+    for text_col in ['tweet_full_text', 'user_description']:
+        if text_col in df:
+            prefix = text_col.split('_')[0]
+            cleaned = clean_texts(df[text_col])
+            if clean_text:
+                df[prefix + '_clean_text'] = cleaned
+            df[prefix + '_sentiment'] = sentiment_scores(cleaned)
+            break
+    return compact_dataset(df)
+
+
+def load_job_state(job_id):
+    """Return the state dict of a fetch job, or None if it is unknown"""
+    if job_id is None:
+        return None
+    return load_derived(job_id, 'job')
+
+
+def latest_version(key):
+    """Return the key of the latest version of dataset key: the dataset the
+    fetch job that published key has published since, or key itself"""
+    state = load_job_state(load_derived(key, 'job_id'))
+    if (state is None) or (state['dataset'] is None):
+        return key
+    return state['dataset']
+
+
+class FetchJob():
+    """Fetch a search page by page in the background.
+
+    Every `fetch_publish_interval` seconds (and after the last page) the
+    pages fetched since the last version are prepared and appended to it,
+    the rows so far are cached as a new dataset version (replacing the
+    previous one in the cache), and the job state is cached under the job
+    id, so whichever worker serves the polling request can pick up the
+    partial results. The key of a replaced version still leads to the
+    latest one, see latest_version.
+
+    Complete results are also written to the persistent query cache, and a
+    search found there is published at once without calling the API.
+    Complete "Search Tweets" results are added to the archive (see
+    archive.py), and a "Search Archive" publishes the archive key of the
+    query without fetching anything.
+    """
+    def __init__(self, job_id, search_type, query, count, lang):
+        self.job_id = job_id
+        self.search_type = search_type
+        self.query = query
+        self.count = int(count) if count else None
+        self.lang = lang
+        self.query_key = search_key(search_type, query, count, lang)
+        self.state = {'status': 'running', 'rows': 0, 'pages': 0,
+                      'dataset': None, 'error': None, 'cached': False}
+        self.df = None
+
+    def save_state(self, **state):
+        self.state.update(state)
+        save_derived(self.job_id, 'job', dict(self.state))
+
+    def publish(self, pages, df=None):
+        if df is None:
+            df = prepare_dataset(pages[self.state['pages']:])
+            if self.df is not None:
+                df = append_dataset(self.df, df)
+        self.df = df
+        key = save_dataset(self.job_id + '-' + str(len(pages)), df)
+        summary = dataset_summary(df)
+        save_derived(key, 'column_types', summary['types'])
+        save_derived(key, 'summary', summary)
+        save_derived(key, 'job_id', self.job_id)
+        previous = self.state['dataset']
+        if previous is not None:
+            # the rows of the previous version are a prefix of this one
+            save_derived(key, 'parent', previous)
+        self.save_state(rows=len(df), pages=len(pages), dataset=key)
+        if previous is not None:
+            # clients still holding previous get key from latest_version
+            delete_dataset(previous, ['summary', 'column_types'])
+        return df
+
+    def open_archive(self):
+        key = open_archive(self.query)
+        if key is None:
+            self.save_state(status='error',
+                            error='nothing archived for ' + repr(self.query))
+        else:
+            self.save_state(status='done', dataset=key)
+        return self.state
+
+    def run(self):
+        if self.search_type == 'Search Archive':
+            return self.open_archive()
+        pages = []
+        published_at = 0
+        error = None
+        df = query_cache.get(self.query_key)
+        if df is not None:
+            # re-normalize: Parquet does not keep e.g. empty categoricals
+            self.publish([df], compact_dataset(normalize_dataset(df)))
+            self.save_state(status='done', cached=True)
+            return self.state
+        try:
+            twtr = make_client()
+            for page in iter_pages(twtr, self.search_type, self.query,
+                                   self.count, self.lang):
+                pages.append(page)
+                if time.time() - published_at >= fetch_publish_interval:
+                    df = self.publish(pages)
+                    published_at = time.time()
+        except Exception as e:
+            logging.exception('fetch job ' + self.job_id + ' failed')
+            error = str(e)
+        try:
+            if pages and (self.state['pages'] != len(pages)):
+                df = self.publish(pages)
+        except Exception as e:
+            logging.exception('fetch job ' + self.job_id + ' failed')
+            error = error or str(e)
+        if pages and (error is None):
+            try:
+                query_cache.set(self.query_key, df)
+            except Exception:
+                logging.exception('could not cache ' + self.query_key)
+        if pages and (error is None) and archive_dir and \
+                (self.search_type == 'Search Tweets'):
+            try:
+                append(df, self.query)
+            except Exception:
+                logging.exception('could not archive ' + self.query_key)
+        self.save_state(status='error' if error else 'done', error=error)
+        return self.state
+
+
+def start_fetch_job(search_type, query, count, lang):
+    """Submit a FetchJob to the background executor and return its id"""
+    job_id = new_dataset_key(search_type, query, count, lang)
+    job = FetchJob(job_id, search_type, query, count, lang)
+    job.save_state()
+    executor.submit(job.run)
+    return job_id
@@ -0,0 +1,222 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from .cache import load_derived
+from .constants import phrase_len_dict, regex_dict
+
+
+def get_regex(mode):
+    """Return the advertools regex of an "Elements to count" mode, or None
+    for words and phrases"""
+    if mode not in regex_dict:
+        return None
+    import advertools as adv
+
+    module, name = regex_dict[mode]
+    return getattr(getattr(adv, module), name)
+
+
+def english_stopwords():
+    """Return advertools' English stop words"""
+    import advertools as adv
+
+    return adv.stopwords['english']
+
+
+def tokenize(texts, regex=None, phrase_len=1):
+    """Tokenize texts the way adv.word_frequency does, in bulk.
+
+    Return (doc_ids, tokens): two aligned arrays with one entry per
+    token occurrence, doc_ids being positions in texts.
+    """
+    from advertools.word_tokenize import WORD_DELIM
+
+    texts = pd.Series(texts, dtype=object).reset_index(drop=True).fillna('')
+    if regex is not None:
+        texts = texts.str.findall(re.compile(regex)).str.join(' ')
+    words = texts.str.lower().str.split().explode().dropna()
+    words = words.str.strip(WORD_DELIM)
+    doc_ids = words.index.to_numpy()
+    words = words.to_numpy(dtype=object)
+    if phrase_len > 1:
+        n = len(words) - phrase_len + 1
+        if n <= 0:
+            return np.array([], dtype=int), np.array([], dtype=object)
+        same_doc = doc_ids[:n] == doc_ids[phrase_len - 1:]
+        phrases = pd.Series(words[:n])
+        for i in range(1, phrase_len):
+            phrases = phrases + ' ' + words[i:n + i]
+        doc_ids = doc_ids[:n][same_doc]
+        words = phrases.to_numpy(dtype=object)[same_doc]
+    return doc_ids, words
+
+
+def top_k(values, k):
+    """Return the positions of the k largest values, largest first, using
+    a partial selection instead of sorting all of them"""
+    if (k is None) or (k >= len(values)):
+        return np.argsort(-values, kind='stable')
+    part = np.argpartition(-values, k - 1)[:k]
+    return part[np.argsort(-values[part], kind='stable')]
+
+
+class TokenMatrix():
+    """Sparse token-document matrix of a text column, in coordinate form.
+
+    Entry i says that document doc_ids[i] contains the token
+    vocab[token_ids[i]] (once per occurrence), with stop words already
+    removed, and doc_ids never decreases. Building it is the expensive
+    part; frequencies for any weights are then a sparse matrix-vector
+    product done with bincount.
+
+    Documents can be appended with `extend`, which only tokenizes the new
+    texts, and per-token counters are cached by weights name, so counting
+    a grown matrix only adds the contribution of the new documents.
+    """
+    def __init__(self, vocab, doc_ids, token_ids, n_docs, regex=None,
+                 phrase_len=1, rm_words=None):
+        self.vocab = vocab
+        self.doc_ids = doc_ids
+        self.token_ids = token_ids
+        self.n_docs = n_docs
+        self.regex = regex
+        self.phrase_len = phrase_len
+        self.rm_words = english_stopwords() if rm_words is None else rm_words
+        self._counts = {}
+
+    @classmethod
+    def from_texts(cls, texts, regex=None, phrase_len=1, rm_words=None):
+        empty = cls(np.array([], dtype=object), np.array([], dtype=int),
+                    np.array([], dtype=int), 0, regex=regex,
+                    phrase_len=phrase_len, rm_words=rm_words)
+        return empty.extend(texts)
+
+    def extend(self, texts):
+        """Return a new TokenMatrix with texts appended as documents"""
+        doc_ids, tokens = tokenize(texts, regex=self.regex,
+                                   phrase_len=self.phrase_len)
+        codes, uniques = pd.factorize(tokens)
+        keep = ~pd.Index(uniques).isin(list(self.rm_words))[codes]
+        codes, kept = pd.factorize(codes[keep])
+        uniques = uniques[kept]
+        vocab_ids = pd.Index(self.vocab).get_indexer(uniques)
+        new = vocab_ids == -1
+        vocab_ids[new] = len(self.vocab) + np.arange(new.sum())
+        matrix = TokenMatrix(np.concatenate([self.vocab, uniques[new]]),
+                             np.concatenate([self.doc_ids,
+                                             doc_ids[keep] + self.n_docs]),
+                             np.concatenate([self.token_ids,
+                                             vocab_ids[codes]]),
+                             self.n_docs + len(texts), regex=self.regex,
+                             phrase_len=self.phrase_len,
+                             rm_words=self.rm_words)
+        matrix._counts = dict(self._counts)
+        return matrix
+
+    def counts(self, weights=None):
+        """Return, for every token in vocab, the sum of the weights of the
+        documents containing it, counted once per occurrence (the number
+        of occurrences if weights is None).
+
+        Results are cached by weights.name (unnamed weights are not
+        cached), and only documents added since the cached result was
+        computed are counted.
+        """
+        name = 'abs_freq' if weights is None else weights.name
+        counted, counts = self._counts.get(name, (0, None))
+        start = np.searchsorted(self.doc_ids, counted)
+        doc_ids = self.doc_ids[start:]
+        if weights is not None:
+            weights = pd.Series(weights).fillna(0).to_numpy(dtype=float)
+            weights = weights[doc_ids]
+        new_counts = np.bincount(self.token_ids[start:], weights=weights,
+                                 minlength=len(self.vocab))
+        if weights is not None:
+            new_counts = new_counts.astype(float)
+        if counts is not None:
+            new_counts[:len(counts)] += counts
+        if name is not None:
+            self._counts[name] = (self.n_docs, new_counts)
+        return new_counts
+
+    def abs_freq(self):
+        """Return the number of occurrences of every token in vocab"""
+        return self.counts().astype(int)
+
+    def wtd_freq(self, weights):
+        """Return the weighted frequency of every token in vocab"""
+        return self.counts(pd.Series(weights).reset_index(drop=True))
+
+    def frequency(self, weights, k=None):
+        """Return a DataFrame like adv.word_frequency(texts, weights):
+        word, abs_freq, wtd_freq and rel_value, sorted by wtd_freq and
+        limited to the top k words"""
+        weights = pd.Series(weights).reset_index(drop=True)
+        return frequency_table(self.vocab, self.abs_freq(),
+                               self.wtd_freq(weights),
+                               pd.api.types.is_integer_dtype(weights.dtype), k)
+
+
+def frequency_table(vocab, abs_freq, wtd_freq, integer_weights, k=None):
+    """Return the DataFrame of TokenMatrix.frequency from the counts of
+    every token in vocab"""
+    order = top_k(wtd_freq, k)
+    abs_freq = abs_freq[order]
+    wtd_freq = np.round(wtd_freq[order])
+    if integer_weights:
+        wtd_freq = wtd_freq.astype(int)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rel_value = np.round(wtd_freq / abs_freq)
+    return pd.DataFrame({'word': vocab[order],
+                         'abs_freq': abs_freq,
+                         'wtd_freq': wtd_freq,
+                         'rel_value': rel_value})
+
+
+def frequency_of_chunks(chunks, text_col, num_col, mode, k=None):
+    """Return the frequency table of the texts of an iterable of DataFrames
+    weighted by num_col, tokenizing one chunk at a time so that only the
+    running counts are kept between chunks"""
+    abs_freq = pd.Series(dtype=int)
+    wtd_freq = pd.Series(dtype=float)
+    integer_weights = True
+    for chunk in chunks:
+        tokens = TokenMatrix.from_texts(chunk[text_col], regex=get_regex(mode),
+                                        phrase_len=phrase_len_dict.get(mode)
+                                        or 1)
+        weights = chunk[num_col].reset_index(drop=True)
+        integer_weights = integer_weights and (
+            pd.api.types.is_integer_dtype(weights.dtype) or
+            weights.dropna().mod(1).eq(0).all())
+        abs_freq = abs_freq.add(pd.Series(tokens.abs_freq(),
+                                          index=tokens.vocab), fill_value=0)
+        wtd_freq = wtd_freq.add(pd.Series(tokens.wtd_freq(weights),
+                                          index=tokens.vocab), fill_value=0)
+    return frequency_table(abs_freq.index.to_numpy(dtype=object),
+                           abs_freq.to_numpy(dtype=int),
+                           wtd_freq.reindex(abs_freq.index).to_numpy(),
+                           integer_weights, k)
+
+
+def load_token_matrix(key, df, text_col, mode):
+    """Return the TokenMatrix of df[text_col] for a counting mode ('Words',
+    'Emoji', '2-word Phrases', ...), built at most once per dataset key.
+
+    If the dataset grew from a parent version (see fetch.FetchJob) whose
+    matrix is cached, that matrix is extended with the new rows instead of
+    tokenizing every row again.
+    """
+    name = 'tokens.' + text_col + '.' + mode
+
+    def build():
+        parent = load_derived(key, 'parent')
+        matrix = None if parent is None else load_derived(parent, name)
+        if (matrix is not None) and (matrix.n_docs <= len(df)):
+            return matrix.extend(df[text_col].iloc[matrix.n_docs:])
+        return TokenMatrix.from_texts(df[text_col],
+                                      regex=get_regex(mode),
+                                      phrase_len=phrase_len_dict.get(mode)
+                                      or 1)
+    return load_derived(key, name, build)
@@ -1,22 +1,50 @@
+import csv
+import json
+import os
+
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
-import pandas as pd
 import plotly.graph_objects as go
 from dash_table import DataTable
 
-from .constants import img_base64, twitter_lang_metadata_filename
+from .constants import (archive_dir, lang_options_filename, logo_url,
+                        twitter_lang_metadata_filename)
+
+
+def load_lang_options(csv_path=twitter_lang_metadata_filename,
+                      json_path=lang_options_filename):
+    """Return the language dropdown options from their precomputed JSON
+    file, rebuilding it from the CSV if it is missing or older"""
+    try:
+        if os.path.getmtime(json_path) >= os.path.getmtime(csv_path):
+            with open(json_path, encoding='utf-8') as f:
+                return json.load(f)
+    except FileNotFoundError:
+        pass
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        languages = sorted(csv.DictReader(f), key=lambda x: x['name'])
+    options = [{'label': x['name'] + ' | ' + x['local_name'],
+                'value': x['code']} for x in languages]
+    try:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(options, f, ensure_ascii=False, indent=1)
+    except OSError:
+        pass
+    return options
 
-twtr_lang_df = pd.read_csv(twitter_lang_metadata_filename)
-twtr_lang_df = twtr_lang_df.sort_values('name')
-lang_options = [{'label': loc_name, 'value': code}
-                for loc_name, code in
-                zip(twtr_lang_df['name'] + ' | ' + twtr_lang_df['local_name'],
-                    twtr_lang_df['code'])]
+
+lang_options = load_lang_options()
 
 
 Layout = html.Div([
-    dcc.Loading(dcc.Store(id='twitter_df', storage_type='memory')),
+    dcc.Store(id='twitter_df', storage_type='memory'),
+    dcc.Store(id='fetch_job', storage_type='memory'),
+    dcc.Store(id='dataset_summary', storage_type='memory'),
+    dcc.Store(id='filtered_rows', storage_type='memory'),
+    dcc.Store(id='table_page', storage_type='memory'),
+    dcc.Interval(id='fetch_interval', interval=1000, disabled=True),
+    dcc.Interval(id='dataset_interval', interval=60 * 1000),
     html.Br(),
     dbc.Row([
         dbc.Col([
@@ -25,7 +53,7 @@ Layout = html.Div([
         ], lg=4, xs=15),
         dbc.Col([
             html.A([
-                html.Img(src='data:image/png;base64,' + img_base64,
+                html.Img(src=logo_url,
                          width=400, style={'display': 'inline-block'}),
             ]),
             html.Br(),
@@ -39,7 +67,8 @@ Layout = html.Div([
                         options=[{'label': c, 'value': c}
                                  for c in ['Search Tweets',
                                            'Search Users',
-                                           'Get User Timeline']],
+                                           'Get User Timeline'] +
+                                 (['Search Archive'] if archive_dir else [])],
                         value="Search Tweets",
                         style={'color':'black'}
                         )
@@ -65,6 +94,12 @@ Layout = html.Div([
             dbc.Button(id='search_button', children='Submit', outline=True, color='primary'),
         ], lg=2, xs=10),
     ]),
+    dbc.Row([
+        dbc.Col(lg=2, xs=10),
+        dbc.Col([html.Div(id='fetch_status', style={'color': 'white'}),
+                 html.Div(id='dataset_status', style={'color': 'white'})],
+                lg=8, xs=10),
+    ]),
     html.Hr(),
     dbc.Container([
         dbc.Col(lg=2, xs=10),
@@ -122,6 +157,88 @@ Layout = html.Div([
                                       })
                 ]),
             ], tab_id='user_analysis_tab', label='User Analysis'),
+            dbc.Tab([
+                html.Br(),
+                dbc.Row([
+                    dbc.Col([
+                        dbc.Label('Interactions:', color='primary'),
+                        dcc.Dropdown(id='network_edge_type',
+                                     options=[{'label': x, 'value': x}
+                                              for x in ['Mentions', 'Retweets',
+                                                        'Retweeters (API)']],
+                                     value='Mentions', clearable=False),
+                    ], lg=3, xs=9,
+                        style={'color': 'black'}),
+                    dbc.Col([
+                        dbc.Label('Top users shown:', color='primary'),
+                        dcc.Slider(id='network_top_n', min=10, max=200,
+                                   step=10, value=50,
+                                   marks={x: str(x)
+                                          for x in [10, 50, 100, 150, 200]}),
+                    ], lg=4, xs=9),
+                ]),
+                html.Br(),
+                html.H3(id='network_summary',
+                        style={'textAlign': 'center', 'color': 'white'}),
+                dcc.Loading([
+                    dcc.Graph(id='network_chart',
+                              config={'displayModeBar': False},
+                              figure={'layout': go.Layout(plot_bgcolor='#878787',
+                                                          paper_bgcolor='#878787')
+                                      })
+                ]),
+            ], tab_id='network_tab', label='Network'),
+            dbc.Tab([
+                html.Br(),
+                dbc.Row([
+                    dbc.Col([
+                        dbc.Label('Granularity:', color='primary'),
+                        dcc.Dropdown(id='timeseries_freq',
+                                     options=[{'label': x, 'value': x}
+                                              for x in ['Minute', 'Hour',
+                                                        'Day']],
+                                     value='Hour', clearable=False),
+                    ], lg=2, xs=9,
+                        style={'color': 'black'}),
+                    dbc.Col([
+                        dbc.Label('Measure:', color='primary'),
+                        dcc.Dropdown(id='timeseries_metric',
+                                     options=[{'label': 'Tweets',
+                                               'value': 'tweets'},
+                                              {'label': 'Retweet Count',
+                                               'value': 'tweet_retweet_count'},
+                                              {'label': 'Favorite Count',
+                                               'value': 'tweet_favorite_count'}],
+                                     value='tweets', clearable=False),
+                    ], lg=3, xs=9,
+                        style={'color': 'black'}),
+                    dbc.Col([
+                        dbc.Label('Split by:', color='primary'),
+                        dcc.Dropdown(id='timeseries_group',
+                                     options=[{'label': 'Language',
+                                               'value': 'tweet_lang'},
+                                              {'label': 'Tweet Source',
+                                               'value': 'tweet_source'},
+                                              {'label': 'User',
+                                               'value': 'user_screen_name'}],
+                                     placeholder='All tweets'),
+                    ], lg=3, xs=9,
+                        style={'color': 'black'}),
+                    dbc.Col([
+                        dbc.Label('Rolling mean (periods):', color='primary'),
+                        dcc.Slider(id='timeseries_window', min=1, max=24,
+                                   step=1, value=1,
+                                   marks={x: str(x) for x in [1, 6, 12, 24]}),
+                    ], lg=3, xs=9),
+                ]),
+                dcc.Loading([
+                    dcc.Graph(id='timeseries_chart',
+                              config={'displayModeBar': False},
+                              figure={'layout': go.Layout(plot_bgcolor='#878787',
+                                                          paper_bgcolor='#878787')
+                                      })
+                ]),
+            ], tab_id='timeseries_tab', label='Activity'),
         ], id='tabs'),
     ]),
     html.Hr(), html.Br(),
@@ -163,9 +280,13 @@ Layout = html.Div([
                 lg=0, xs=0),
         ], style={'width': '20%', 'display': 'inline-block'}),
         dbc.Col(id='row_summary', lg=2, xs=11),
-        dbc.Col(html.A('Download Table', id='download_link',
-                       download="rawdata.csv", href="", target="_blank",
-                       n_clicks=0), lg=2, xs=11),
+        dbc.Col([html.A('Download Table', id='download_link',
+                        download="rawdata.csv", href="", target="_blank",
+                        n_clicks=0),
+                 ' | ',
+                 html.A('Parquet', id='download_parquet_link',
+                        download="rawdata.parquet", href="",
+                        target="_blank", n_clicks=0)], lg=2, xs=11),
     ], style={'position': 'relative', 'zIndex': 5}),
     dbc.Row([
         dbc.Col([
@@ -179,8 +300,10 @@ Layout = html.Div([
         dbc.Col([
             html.Br(),
             dcc.Loading(
-                DataTable(id='table', sort_action='native',
-                          virtualization=True,
+                DataTable(id='table', sort_action='custom',
+                          sort_mode='multi', sort_by=[],
+                          page_action='custom', page_current=0,
+                          page_size=50,
                           fixed_rows={'headers': True},
                           style_header={'backgroundColor': 'rgb(30, 30, 30)'},
                           style_cell_conditional=[{
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+from .cache import load_derived
+
+REGEX_CHARS = set('.^$*+?{}[]\\|()')
+
+
+class SortedIndex():
+    """The non-missing values of a numeric or datetime column in sorted
+    order, so that range filters are two binary searches"""
+    def __init__(self, series):
+        self.tz = getattr(series.dtype, 'tz', None)
+        self.is_datetime = pd.api.types.is_datetime64_any_dtype(series.dtype)
+        present = series.notna().to_numpy()
+        values = series[present]
+        if self.is_datetime:
+            values = pd.DatetimeIndex(values).asi8
+        else:
+            values = values.to_numpy(dtype=float)
+        order = np.argsort(values, kind='stable')
+        self.values = values[order]
+        self.rows = np.flatnonzero(present)[order]
+
+    def _bound(self, value):
+        if not self.is_datetime:
+            return value
+        value = pd.Timestamp(value)
+        if (self.tz is not None) and (value.tzinfo is None):
+            value = value.tz_localize(self.tz)
+        return value.value
+
+    def between(self, low, high):
+        """Return the positions of the rows with low <= value <= high"""
+        start = np.searchsorted(self.values, self._bound(low), side='left')
+        end = np.searchsorted(self.values, self._bound(high), side='right')
+        return np.sort(self.rows[start:end])
+
+
+class BitmapIndex():
+    """A packed bitmap of the rows holding each value of a categorical or
+    boolean column"""
+    def __init__(self, series):
+        codes, uniques = pd.factorize(series)
+        self.n_rows = len(series)
+        self.bitmaps = {value: np.packbits(codes == i)
+                        for i, value in enumerate(uniques)}
+
+    def isin(self, values):
+        """Return the positions of the rows holding any of values"""
+        bits = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+        for value in values:
+            if value in self.bitmaps:
+                bits |= self.bitmaps[value]
+        return np.flatnonzero(np.unpackbits(bits, count=self.n_rows))
+
+
+class TrigramIndex():
+    """Posting lists of the rows containing each trigram of the lowercased
+    text of a string column, for case insensitive substring search.
+
+    Trigrams are packed into one int64 (21 bits per code point), and
+    the (trigram, row) pairs are kept sorted, so a posting list is a
+    slice found by binary search.
+    """
+    def __init__(self, series):
+        texts = series.astype(object).fillna('').astype(str).str.lower()
+        self.n_rows = len(texts)
+        chars = np.frombuffer('\x00'.join(texts).encode('utf-32-le'),
+                              dtype=np.uint32).astype(np.int64)
+        rows = np.repeat(np.arange(self.n_rows, dtype=np.int32),
+                         texts.str.len().to_numpy() + 1)[:len(chars)]
+        keys = (chars[:-2] << 42) | (chars[1:-1] << 21) | chars[2:]
+        valid = (rows[:-2] == rows[2:]) & (chars[2:] != 0) & \
+            (chars[1:-1] != 0)
+        keys, rows = keys[valid], rows[:-2][valid]
+        order = np.lexsort((rows, keys))
+        keys, rows = keys[order], rows[order]
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = (keys[1:] != keys[:-1]) | (rows[1:] != rows[:-1])
+        keys, self.rows = keys[first], rows[first]
+        self.keys, self.starts = np.unique(keys, return_index=True)
+        self.starts = np.append(self.starts, len(keys))
+
+    def candidates(self, query):
+        """Return the positions of the rows containing every trigram of
+        query (all rows if it is shorter than three characters)"""
+        chars = np.frombuffer(query.lower().encode('utf-32-le'),
+                              dtype=np.uint32).astype(np.int64)
+        if len(chars) < 3:
+            return np.arange(self.n_rows)
+        keys = np.unique((chars[:-2] << 42) | (chars[1:-1] << 21) |
+                         chars[2:])
+        rows = None
+        for key in keys:
+            i = np.searchsorted(self.keys, key)
+            if (i == len(self.keys)) or (self.keys[i] != key):
+                return np.array([], dtype=int)
+            posting = self.rows[self.starts[i]:self.starts[i + 1]]
+            rows = posting if rows is None else \
+                np.intersect1d(rows, posting, assume_unique=True)
+        return rows
+
+    def contains(self, series, query):
+        """Return the positions of the rows of series (the indexed column)
+        matching series.str.contains(query, case=False).
+
+        Queries using regex syntax are matched by scanning every row.
+        """
+        if REGEX_CHARS & set(query):
+            mask = series.str.contains(query, case=False)
+            return np.flatnonzero(mask.fillna(False).to_numpy(dtype=bool))
+        rows = self.candidates(query)
+        found = series.iloc[rows].str.contains(query, case=False, regex=False)
+        return rows[found.fillna(False).to_numpy(dtype=bool)]
+
+
+def build_index(series, col_type):
+    """Return the index matching a column's filter type"""
+    if col_type in ['int', 'float', 'datetime']:
+        return SortedIndex(series)
+    if col_type in ['category', 'bool']:
+        return BitmapIndex(series)
+    return TrigramIndex(series)
+
+
+def load_column_index(key, df, col, col_type):
+    """Return the index of df[col], built at most once per dataset key"""
+    return load_derived(key, 'index.' + col,
+                        lambda: build_index(df[col], col_type))
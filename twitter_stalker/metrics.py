@@ -0,0 +1,232 @@
+import cProfile
+import functools
+import logging
+import os
+import pstats
+import threading
+import time
+
+from .constants import metrics_enabled, profile_dir
+
+SECONDS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+BYTES_BUCKETS = [10 ** i for i in range(2, 9)]
+ROWS_BUCKETS = [10 ** i for i in range(1, 8)]
+
+
+class Histogram():
+    """A Prometheus histogram with one label, `callback`, kept in process
+    (each gunicorn worker exposes its own)"""
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, callback, value):
+        with self._lock:
+            counts, total = self.series.get(
+                callback, ([0] * (len(self.buckets) + 1), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.series[callback] = (counts, total + value)
+
+    def expose(self):
+        """Return the histogram in the Prometheus text format"""
+        lines = ['# HELP ' + self.name + ' ' + self.help_text,
+                 '# TYPE ' + self.name + ' histogram']
+        with self._lock:
+            for callback, (counts, total) in sorted(self.series.items()):
+                label = 'callback="' + callback + '"'
+                for bound, count in zip(self.buckets + ['+Inf'], counts):
+                    lines.append(self.name + '_bucket{' + label + ',le="' +
+                                 str(bound) + '"} ' + str(count))
+                lines.append(self.name + '_sum{' + label + '} ' +
+                             format(total, 'g'))
+                lines.append(self.name + '_count{' + label + '} ' +
+                             str(counts[-1]))
+        return '\n'.join(lines)
+
+
+callback_seconds = Histogram(
+    'twitter_stalker_callback_seconds',
+    'Wall time of Dash callback requests, serialization included',
+    SECONDS_BUCKETS)
+function_seconds = Histogram(
+    'twitter_stalker_callback_function_seconds',
+    'Time spent in the callback functions themselves', SECONDS_BUCKETS)
+request_bytes = Histogram(
+    'twitter_stalker_callback_request_bytes',
+    'Size of Dash callback request bodies', BYTES_BUCKETS)
+response_bytes = Histogram(
+    'twitter_stalker_callback_response_bytes',
+    'Size of Dash callback responses', BYTES_BUCKETS)
+dataset_seconds = Histogram(
+    'twitter_stalker_dataset_load_seconds',
+    'Time taken to get the DataFrame of a dataset key from the cache',
+    SECONDS_BUCKETS)
+dataset_rows = Histogram(
+    'twitter_stalker_dataset_rows',
+    'Rows of the DataFrames loaded by callbacks', ROWS_BUCKETS)
+HISTOGRAMS = [callback_seconds, function_seconds, request_bytes,
+              response_bytes, dataset_seconds, dataset_rows]
+
+# names of the functions wrapped by profiled, the only ones start_profile
+# accepts, as they come from request URLs
+_callbacks = set()
+_profiles = {}
+_profiles_lock = threading.Lock()
+
+
+def _current_callback():
+    import flask
+
+    if flask.has_request_context():
+        return flask.g.get('metrics_callback', 'none')
+    return 'none'
+
+
+def observe_dataset_load(seconds, rows):
+    """Record that the running callback took seconds to load a dataset of
+    rows rows (a no-op unless metrics are enabled)"""
+    if metrics_enabled:
+        callback = _current_callback()
+        dataset_seconds.observe(callback, seconds)
+        dataset_rows.observe(callback, rows)
+
+
+def start_profile(callback, calls):
+    """Profile the next `calls` calls of callback (a function name),
+    returning False if no profiled function has that name"""
+    if callback not in _callbacks:
+        return False
+    with _profiles_lock:
+        _profiles[callback] = {'left': calls, 'stats': None}
+    return True
+
+
+def _dump_profile(callback, stats):
+    os.makedirs(profile_dir, exist_ok=True)
+    path = os.path.join(profile_dir, callback + '-' +
+                        time.strftime('%Y%m%d-%H%M%S') + '.prof')
+    stats.dump_stats(path)
+    logging.info(msg='cProfile output of ' + callback + ' saved to ' + path)
+    return path
+
+
+def profiled(func):
+    """Wrap a callback function to time it and, when start_profile was
+    called for it, run it under cProfile"""
+    name = func.__name__
+    _callbacks.add(name)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _profiles_lock:
+            profiling = _profiles.get(name, {}).get('left', 0) > 0
+        profile = cProfile.Profile() if profiling else None
+        start = time.perf_counter()
+        try:
+            if profile is None:
+                return func(*args, **kwargs)
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            function_seconds.observe(name, time.perf_counter() - start)
+            if profile is not None:
+                _add_profile(name, profile)
+    return wrapper
+
+
+def _add_profile(name, profile):
+    with _profiles_lock:
+        state = _profiles[name]
+        if state['stats'] is None:
+            state['stats'] = pstats.Stats(profile)
+        else:
+            state['stats'].add(profile)
+        state['left'] -= 1
+        if state['left'] == 0:
+            state['path'] = _dump_profile(name, state['stats'])
+
+
+def profile_report(callback, limit=40):
+    """Return the collected cProfile statistics of callback as text"""
+    import io
+
+    with _profiles_lock:
+        state = _profiles.get(callback)
+        if (state is None) or (state['stats'] is None):
+            return None
+        out = io.StringIO()
+        state['stats'].stream = out
+        state['stats'].sort_stats('cumulative').print_stats(limit)
+    header = (callback + ': ' + str(state['left']) + ' profiled calls left, ' +
+              'saved to ' + state.get('path', '(not yet)') + '\n')
+    return header + out.getvalue()
+
+
+def instrument(app):
+    """Record metrics for every callback of a Dash app, and serve them.
+
+    Must be called before the callbacks are declared, as it wraps the
+    functions given to app.callback. Adds the routes:
+
+    * /metrics: the histograms in the Prometheus text format
+    * /metrics/profile/<callback>?calls=N: profile the next N calls of
+      the callback function named callback (N defaults to 10), the
+      statistics being saved in profile_dir once done; 404 if no callback
+      function has that name
+    * /metrics/profile/<callback>/stats: the statistics collected so far
+    """
+    import flask
+
+    server = app.server
+    dash_callback = app.callback
+
+    def callback(*args, **kwargs):
+        register = dash_callback(*args, **kwargs)
+        return lambda func: register(profiled(func))
+    app.callback = callback
+
+    @server.before_request
+    def start_timer():
+        if flask.request.path.endswith('_dash-update-component'):
+            body = flask.request.get_json(silent=True) or {}
+            func = app.callback_map.get(body.get('output'), {}).get('callback')
+            flask.g.metrics_callback = getattr(func, '__name__', 'unknown')
+            flask.g.metrics_start = time.perf_counter()
+
+    @server.after_request
+    def record(response):
+        if 'metrics_start' in flask.g:
+            name = flask.g.metrics_callback
+            callback_seconds.observe(
+                name, time.perf_counter() - flask.g.metrics_start)
+            request_bytes.observe(name, flask.request.content_length or 0)
+            if not response.direct_passthrough:
+                response_bytes.observe(
+                    name, response.calculate_content_length() or 0)
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        text = '\n'.join(h.expose() for h in HISTOGRAMS) + '\n'
+        return flask.Response(text, mimetype='text/plain; version=0.0.4')
+
+    @server.route('/metrics/profile/<callback>')
+    def profile(callback):
+        calls = flask.request.args.get('calls', 10, type=int)
+        if not start_profile(callback, calls):
+            flask.abort(404)
+        return flask.Response('profiling the next ' + str(calls) +
+                              ' calls of ' + callback + '\n',
+                              mimetype='text/plain')
+
+    @server.route('/metrics/profile/<callback>/stats')
+    def profile_stats(callback):
+        report = profile_report(callback)
+        if report is None:
+            flask.abort(404)
+        return flask.Response(report, mimetype='text/plain')
@@ -0,0 +1,306 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from .cache import load_derived, save_derived
+from .constants import auth_params, network_api_lookups, network_api_tweets
+
+MENTION_PATTERN = r'@(\w+)'
+RETWEET_PATTERN = r'^RT @(\w+):'
+# columns read by every edge type
+EDGE_COLUMNS = {
+    'Mentions': ['user_screen_name', 'tweet_entities_mentions'],
+    'Retweets': ['user_screen_name', 'tweet_full_text'],
+    'Retweeters (API)': ['user_screen_name', 'tweet_id',
+                         'tweet_retweet_count', 'tweet_full_text'],
+}
+RETWEETER_COLUMNS = EDGE_COLUMNS['Retweeters (API)']
+
+
+def _edges(sources, targets):
+    return pd.DataFrame({'source': np.asarray(sources, dtype=object),
+                         'target': np.asarray(targets, dtype=object)})
+
+
+def mention_edges(df):
+    """Return a DataFrame of (source, target) screen names, one row per
+    user mentioned (tweet_entities_mentions) in a tweet of source"""
+    if not {'user_screen_name', 'tweet_entities_mentions'} <= set(df):
+        return _edges([], [])
+    mentions = (df['tweet_entities_mentions'].reset_index(drop=True)
+                .fillna('').astype(str).str.extractall(MENTION_PATTERN)[0])
+    rows = mentions.index.get_level_values(0)
+    return _edges(df['user_screen_name'].to_numpy()[rows], mentions)
+
+
+def retweet_edges(df):
+    """Return a DataFrame of (source, target) screen names, one row per
+    tweet of the dataset in which source retweeted target ("RT @target:")"""
+    if not {'user_screen_name', 'tweet_full_text'} <= set(df):
+        return _edges([], [])
+    authors = (df['tweet_full_text'].reset_index(drop=True).fillna('')
+               .astype(str).str.extract(RETWEET_PATTERN)[0])
+    rows = np.flatnonzero(authors.notna().to_numpy())
+    return _edges(df['user_screen_name'].to_numpy()[rows],
+                  authors.to_numpy()[rows])
+
+
+def most_retweeted(df, n_tweets=network_api_tweets):
+    """Return the n_tweets most retweeted original tweets (not "RT @") of
+    df that were retweeted at least once"""
+    originals = df[~df['tweet_full_text'].fillna('').astype(str)
+                   .str.startswith('RT @')]
+    top = originals.nlargest(n_tweets, 'tweet_retweet_count')
+    return top[top['tweet_retweet_count'] > 0]
+
+
+def lookup_retweeters(tweet_ids, n_lookups=network_api_lookups):
+    """Return ({tweet_id: screen names of its retweeters}, error) for the
+    tweet_ids cached or among the first n_lookups others looked up without
+    waiting for the retweets rate limit (see
+    TwitterStalker.check_who_retweeted_many), caching each lookup.
+
+    error is the message of the Twitter error that stopped the lookups, or
+    None.
+    """
+    from twython import TwythonError
+
+    from .core import TwitterStalker
+
+    found = {}
+    for tweet_id in tweet_ids:
+        names = load_derived('tweet-' + str(tweet_id), 'retweeters')
+        if names is not None:
+            found[tweet_id] = names
+    missing = [tweet_id for tweet_id in tweet_ids if tweet_id not in found]
+    if missing:
+        stalker = TwitterStalker(auth_params['app_key'],
+                                 auth_params['app_secret'],
+                                 auth_params['oauth_token'],
+                                 auth_params['oauth_token_secret'])
+        try:
+            looked_up = stalker.check_who_retweeted_many(
+                missing[:n_lookups], block=False)
+        except TwythonError as e:
+            logging.exception('could not look up retweeters')
+            return found, str(e)
+        for tweet_id, names in looked_up.items():
+            save_derived('tweet-' + str(tweet_id), 'retweeters', names)
+        found.update(looked_up)
+    return found, None
+
+
+def retweeter_edges(df, n_tweets=network_api_tweets):
+    """Return a DataFrame of (source, target) screen names, one row per
+    retweeter (source) of the n_tweets most retweeted original tweets of
+    the dataset, see lookup_retweeters.
+
+    The number of those tweets whose retweeters are left to look up is
+    the 'missing' entry of the DataFrame's attrs, and the error that
+    stopped the lookups, if any, its 'error' entry.
+    """
+    if not set(RETWEETER_COLUMNS) <= set(df):
+        return _edges([], [])
+    top = most_retweeted(df, n_tweets)
+    retweeters, error = lookup_retweeters(list(dict.fromkeys(
+        top['tweet_id'])))
+    authors = dict(zip(top['tweet_id'], top['user_screen_name']))
+    pairs = [(name, authors[tweet_id])
+             for tweet_id, names in retweeters.items() for name in names]
+    edges = _edges([s for s, _ in pairs], [t for _, t in pairs])
+    edges.attrs['missing'] = top['tweet_id'].nunique() - len(retweeters)
+    edges.attrs['error'] = error
+    return edges
+
+
+class Graph():
+    """A directed, weighted graph of who interacts with whom, with edges
+    pointing from a user to the user they mention or retweet.
+
+    Edges are kept as sparse COO arrays (source, target, weight), duplicate
+    interactions adding up to the weight of one edge (edges may also come
+    with a weight column, counted as that many interactions), and every
+    measure is computed with NumPy over those arrays: degrees, PageRank and
+    weakly connected components.
+
+    `missing` counts the tweets whose retweeters are not in the graph yet,
+    and `error` is the error that stopped looking them up, if any (see
+    retweeter_edges).
+    """
+    missing = 0
+    error = None
+
+    def __init__(self, edges):
+        self.missing = edges.attrs.get('missing', 0)
+        self.error = edges.attrs.get('error')
+        edges = edges[edges['source'] != edges['target']]
+        codes, self.nodes = pd.factorize(
+            pd.concat([edges['source'], edges['target']], ignore_index=True))
+        n, m = len(self.nodes), len(edges)
+        pairs, inverse = np.unique(codes[:m].astype(np.int64) * n +
+                                   codes[m:], return_inverse=True)
+        self.source, self.target = pairs // max(n, 1), pairs % max(n, 1)
+        self.weight = np.bincount(
+            inverse, weights=edges['weight'].to_numpy(dtype=float)
+            if 'weight' in edges else None,
+            minlength=len(pairs)).astype(float)
+        self.n_interactions = int(self.weight.sum())
+        self.in_degree = np.bincount(self.target, weights=self.weight,
+                                     minlength=n)
+        self.out_degree = np.bincount(self.source, weights=self.weight,
+                                      minlength=n)
+        self.pagerank = self._pagerank()
+        self.component = self._components()
+
+    @property
+    def n_nodes(self):
+        return len(self.nodes)
+
+    @property
+    def n_edges(self):
+        return len(self.source)
+
+    def _pagerank(self, damping=0.85, tol=1e-10, max_iter=100):
+        """Power iteration, each step a sparse matrix-vector product done
+        with bincount; rank of users without out edges is spread evenly"""
+        n = self.n_nodes
+        if n == 0:
+            return np.array([])
+        share = self.weight / self.out_degree[self.source]
+        dangling = self.out_degree == 0
+        rank = np.full(n, 1 / n)
+        for _ in range(max_iter):
+            new = np.bincount(self.target, weights=rank[self.source] * share,
+                              minlength=n)
+            new = damping * (new + rank[dangling].sum() / n) + \
+                (1 - damping) / n
+            converged = np.abs(new - rank).sum() < tol
+            rank = new
+            if converged:
+                break
+        return rank
+
+    def _components(self):
+        """Label propagation of the minimum node id along edges in both
+        directions, with pointer jumping; components are then numbered
+        from the largest"""
+        labels = np.arange(self.n_nodes)
+        while True:
+            new = labels.copy()
+            np.minimum.at(new, self.target, labels[self.source])
+            np.minimum.at(new, self.source, labels[self.target])
+            new = new[new]
+            if np.array_equal(new, labels):
+                break
+            labels = new
+        _, codes, sizes = np.unique(labels, return_inverse=True,
+                                    return_counts=True)
+        rank = np.empty(len(sizes), dtype=int)
+        rank[np.argsort(-sizes, kind='stable')] = np.arange(len(sizes))
+        return rank[codes]
+
+    def n_components(self):
+        return int(self.component.max()) + 1 if self.n_nodes else 0
+
+    def top_subgraph(self, n):
+        """Return the ids of the n users with the highest PageRank, and the
+        positions of the edges between them"""
+        nodes = np.argsort(-self.pagerank, kind='stable')[:n]
+        keep = np.zeros(self.n_nodes, dtype=bool)
+        keep[nodes] = True
+        return nodes, np.flatnonzero(keep[self.source] & keep[self.target])
+
+    def layout(self, n, iterations=100, seed=0):
+        """Return (nodes, edges, positions) of the top n subgraph, laid out
+        with Fruchterman-Reingold force-directed placement in the unit
+        square"""
+        nodes, edges = self.top_subgraph(n)
+        local = np.full(self.n_nodes, -1)
+        local[nodes] = np.arange(len(nodes))
+        source, target = local[self.source[edges]], local[self.target[edges]]
+        weight = np.log1p(self.weight[edges])
+        rng = np.random.default_rng(seed)
+        pos = rng.random((len(nodes), 2))
+        k = np.sqrt(1 / max(len(nodes), 1))
+        temperature = 0.1
+        for _ in range(iterations):
+            delta = pos[:, None, :] - pos[None, :, :]
+            distance = np.maximum(np.linalg.norm(delta, axis=-1), 0.01)
+            disp = (delta * (k * k / distance ** 2)[..., None]).sum(axis=1)
+            pull = delta[source, target] * \
+                (distance[source, target] * weight / k)[:, None]
+            np.add.at(disp, source, -pull)
+            np.add.at(disp, target, pull)
+            disp -= (pos - 0.5) * k
+            length = np.maximum(np.linalg.norm(disp, axis=1), 1e-9)
+            pos += disp * (np.minimum(length, temperature) / length)[:, None]
+            temperature *= 0.95
+        low, high = pos.min(axis=0), pos.max(axis=0)
+        pos = (pos - low) / np.where(high > low, high - low, 1)
+        return nodes, edges, pos
+
+
+def build_edges(df, edge_type):
+    """Return the interactions of edge_type ('Mentions', 'Retweets' or
+    'Retweeters (API)') in df"""
+    if edge_type == 'Retweets':
+        return retweet_edges(df)
+    if edge_type == 'Retweeters (API)':
+        return retweeter_edges(df)
+    return mention_edges(df)
+
+
+def edges_of_chunks(chunks, edge_type):
+    """Return the interactions of edge_type in an iterable of DataFrames,
+    as one (source, target, weight) row per pair, counted one chunk at a
+    time"""
+    if edge_type == 'Retweeters (API)':
+        top = None
+        for chunk in chunks:
+            if set(RETWEETER_COLUMNS) <= set(chunk):
+                top = most_retweeted(pd.concat([top,
+                                                chunk[RETWEETER_COLUMNS]]))
+        return _edges([], []) if top is None else retweeter_edges(top)
+    weights = None
+    for chunk in chunks:
+        counts = build_edges(chunk, edge_type).groupby(
+            ['source', 'target']).size()
+        weights = counts if weights is None else weights.add(counts,
+                                                             fill_value=0)
+    if weights is None or not len(weights):
+        return _edges([], []).assign(weight=[])
+    return pd.DataFrame({'source': weights.index.get_level_values(0),
+                         'target': weights.index.get_level_values(1),
+                         'weight': weights.to_numpy(dtype=float)})
+
+
+def cache_graph(key, edge_type, edges):
+    """Return the Graph of the edge_type interactions of dataset key,
+    built from edges() at most once.
+
+    Graphs with missing retweeters are not cached, so that the next call
+    looks them up again.
+    """
+    name = 'network.' + edge_type
+    graph = load_derived(key, name)
+    if graph is None:
+        graph = Graph(edges())
+        if not graph.missing:
+            save_derived(key, name, graph)
+    return graph
+
+
+def load_graph(key, df, edge_type):
+    """Return the Graph of edge_type interactions of dataset key, see
+    cache_graph"""
+    return cache_graph(key, edge_type, lambda: build_edges(df, edge_type))
+
+
+def load_layout(key, graph, edge_type, n):
+    """Return graph.layout(n) of the edge_type graph of dataset key,
+    computed at most once per complete graph"""
+    if graph.missing:
+        return graph.layout(n)
+    return load_derived(key, 'network.' + edge_type + '.layout.' + str(n),
+                        lambda: graph.layout(n))
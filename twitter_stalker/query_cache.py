@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from pandas.api.types import is_object_dtype
+
+from .constants import (query_cache_dir, query_cache_max_bytes,
+                        query_cache_ttl)
+
+JSON_COLUMNS_KEY = b'twitter_stalker_json_columns'
+
+
+def _nested_columns(df):
+    """Return the object columns holding dicts or lists (e.g. user_status),
+    which are stored as JSON strings"""
+    nested = []
+    for column in df:
+        if is_object_dtype(df[column].dtype):
+            values = df[column].dropna()
+            if len(values) and values.map(
+                    lambda x: isinstance(x, (dict, list))).any():
+                nested.append(column)
+    return nested
+
+
+def to_arrow(df):
+    """Return df as an Arrow table, with nested columns as JSON strings
+    (their names are listed in the schema metadata)"""
+    import pyarrow as pa
+
+    nested = _nested_columns(df)
+    if nested:
+        df = df.copy(deep=False)
+        for column in nested:
+            df[column] = df[column].map(
+                lambda x: x if x is None else json.dumps(x))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[JSON_COLUMNS_KEY] = json.dumps(nested).encode('utf-8')
+    return table.replace_schema_metadata(metadata)
+
+
+class QueryCache():
+    """Fetched search results stored as Parquet files, one per search key.
+
+    Entries written more than `ttl` seconds ago are misses (a ttl of 0
+    disables the cache), and the least recently used files are removed
+    once the directory grows beyond `max_bytes`: a file's modification
+    time is when it was written, its access time when it was last hit.
+    Hits and misses are counted per process, see `stats`.
+    """
+    def __init__(self, directory, ttl=900, max_bytes=512 * 1024 ** 2):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.parquet')
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        """Return the cached DataFrame for key, or None"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) >= self.ttl:
+                self._count(False)
+                return None
+            table = pq.read_table(path)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            self._count(False)
+            return None
+        # touch the access time only, the modification time stays the
+        # time the entry was written
+        os.utime(path, (time.time(), os.path.getmtime(path)))
+        df = table.to_pandas()
+        metadata = table.schema.metadata or {}
+        for column in json.loads(metadata.get(JSON_COLUMNS_KEY, b'[]')):
+            df[column] = df[column].map(
+                lambda x: json.loads(x) if isinstance(x, str) else x)
+        self._count(True)
+        logging.info(msg='query cache hit ' + key + ', shape:' +
+                     str(df.shape) + ', ' + str(self.stats()))
+        return df
+
+    def set(self, key, df):
+        """Store df under key and evict old entries beyond max_bytes"""
+        if self.ttl <= 0:
+            return
+        import pyarrow.parquet as pq
+
+        table = to_arrow(df)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.parquet'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((max(stat.st_atime, stat.st_mtime),
+                            stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        """Return hit/miss counts of this process and the hit ratio"""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0}
+
+
+query_cache = QueryCache(query_cache_dir, ttl=query_cache_ttl,
+                         max_bytes=query_cache_max_bytes)
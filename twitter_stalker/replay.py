@@ -0,0 +1,513 @@
+"""A local stand-in for the Twitter API endpoints the app calls, so that
+searches can be run, benchmarked and load tested without network access.
+
+Responses recorded from the real API (see record_responses) are replayed
+as they were; any other request is answered with synthetic tweets and
+users, generated deterministically from the query and seed, paginated
+like the real endpoints, with rate limit headers (and 429 errors once a
+limit is used up) and optional latency.
+
+Run it standalone, and point the app at it:
+
+    python -m twitter_stalker.replay --port 8081 [--replay-dir DIR]
+    TWITTER_STALKER_API_URL=http://127.0.0.1:8081 python app.py
+
+or set TWITTER_STALKER_REPLAY=1 to have every process of the app start
+one in a background thread.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+from .constants import (twitter_replay_dir, twitter_replay_latency_ms,
+                        twitter_replay_window)
+
+# calls per window of each endpoint, as documented for user auth
+RATE_LIMITS = {'search/tweets': 180, 'statuses/user_timeline': 900,
+               'users/search': 900, 'statuses/retweets': 75}
+# tweets a search can page through, and the API's own caps for timelines
+# and user searches
+SEARCH_RESULTS = 100000
+TIMELINE_RESULTS = 3200
+USER_SEARCH_RESULTS = 1000
+
+N_USERS = 50000
+TOP_ID = 1390000000000000000
+ID_STEP = 4096
+NOW = datetime(2021, 5, 10, 12, tzinfo=timezone.utc)
+SECONDS_PER_TWEET = 3
+
+WORDS = ('the to and a of in is it you that for on this with be are was have '
+         'not just but at so all my about what like people can will one '
+         'new time today more data python code learn open source project '
+         'release team world news update great good love best happy '
+         'amazing thanks excited bad worst sad hate terrible broken slow '
+         'fast free week year day night work game music video read post '
+         'thread here now how why when who think know need want see make '
+         'share help check out big small first last next').split()
+HASHTAGS = ['python', 'datascience', 'MachineLearning', 'AI', 'news', 'dash',
+            'pandas', 'opensource', 'BigData', 'tech', 'COVID19', 'music']
+EMOJI = ['\U0001f600', '\U0001f602', '\U0001f525', '\U0001f64f', '❤',
+         '\U0001f44d', '\U0001f680', '\U0001f622']
+SOURCES = [('Twitter for iPhone', 'http://twitter.com/download/iphone'),
+           ('Twitter for Android', 'http://twitter.com/download/android'),
+           ('Twitter Web App', 'https://mobile.twitter.com'),
+           ('TweetDeck', 'https://about.twitter.com/products/tweetdeck'),
+           ('Hootsuite Inc.', 'https://www.hootsuite.com')]
+LANGS = ['en'] * 12 + ['es', 'es', 'fr', 'ar', 'ja', 'de', 'pt', 'und']
+LOCATIONS = ['', '', '', 'New York, NY', 'London, England', 'Paris, France',
+             'Cairo, Egypt', 'Tokyo', 'Berlin', 'San Francisco, CA', 'Earth',
+             'India', 'Lagos, Nigeria', 'Sydney, Australia']
+SYLLABLES = ['al', 'ba', 'co', 'da', 'el', 'fi', 'go', 'ha', 'in', 'jo',
+             'ka', 'lu', 'ma', 'no', 'or', 'pa', 'ri', 'sa', 'ta', 'vi']
+
+
+def twitter_time(dt):
+    """Format a datetime like the API's created_at fields"""
+    return dt.strftime('%a %b %d %H:%M:%S +0000 %Y')
+
+
+def zipf_weights(n, s=1.0):
+    """Return the cumulative weights of a Zipf distribution over n items"""
+    return list(itertools.accumulate(1 / (k + 1) ** s for k in range(n)))
+
+
+WORD_WEIGHTS = zipf_weights(len(WORDS))
+HASHTAG_WEIGHTS = zipf_weights(len(HASHTAGS))
+USER_WEIGHTS = zipf_weights(N_USERS, 0.9)
+USERS = range(N_USERS)
+
+
+class SyntheticTwitter():
+    """Deterministic synthetic tweets and users.
+
+    Tweet i of a query (0 being the most recent) and user j are generated
+    from their own seeded random generator, so any page can be produced
+    without generating the ones before it.
+    """
+    def __init__(self, seed=0):
+        self.seed = seed
+
+    def _random(self, *parts):
+        key = json.dumps([self.seed] + list(parts)).encode('utf-8')
+        return random.Random(zlib.crc32(key) << 32 | zlib.adler32(key))
+
+    def user(self, j):
+        rnd = self._random('user', j)
+        name = ''.join(rnd.choice(SYLLABLES)
+                       for _ in range(rnd.randint(2, 4))).title()
+        screen_name = name.lower() + str(j)
+        created = NOW - timedelta(days=rnd.uniform(30, 5000))
+        followers = int(rnd.lognormvariate(5, 2))
+        return {
+            'id': 10 ** 8 + j, 'id_str': str(10 ** 8 + j),
+            'name': name + ' ' + rnd.choice(SYLLABLES).title(),
+            'screen_name': screen_name,
+            'location': rnd.choice(LOCATIONS),
+            'description': ' '.join(rnd.choice(WORDS)
+                                    for _ in range(rnd.randint(0, 15))),
+            'url': None, 'entities': {'description': {'urls': []}},
+            'protected': False,
+            'followers_count': followers,
+            'friends_count': int(rnd.lognormvariate(5, 1.2)),
+            'listed_count': followers // 200,
+            'created_at': twitter_time(created),
+            'favourites_count': int(rnd.lognormvariate(6, 2)),
+            'utc_offset': None, 'time_zone': None,
+            'geo_enabled': rnd.random() < 0.3,
+            'verified': rnd.random() < 0.01 + 0.2 * (followers > 100000),
+            'statuses_count': int(rnd.lognormvariate(7, 2)) + 1,
+            'lang': None, 'contributors_enabled': False,
+            'is_translator': False, 'is_translation_enabled': False,
+            'profile_background_color': 'F5F8FA',
+            'profile_background_image_url': None,
+            'profile_background_image_url_https': None,
+            'profile_background_tile': False,
+            'profile_image_url': 'http://pbs.twimg.com/profile_images/' +
+            str(j) + '/photo_normal.jpg',
+            'profile_image_url_https': 'https://pbs.twimg.com/'
+            'profile_images/' + str(j) + '/photo_normal.jpg',
+            'profile_link_color': '1DA1F2',
+            'profile_sidebar_border_color': 'C0DEED',
+            'profile_sidebar_fill_color': 'DDEEF6',
+            'profile_text_color': '333333',
+            'profile_use_background_image': True,
+            'has_extended_profile': rnd.random() < 0.5,
+            'default_profile': rnd.random() < 0.6,
+            'default_profile_image': rnd.random() < 0.05,
+            'following': None, 'follow_request_sent': None,
+            'notifications': None, 'translator_type': 'none',
+        }
+
+    def _text(self, rnd):
+        """Return a tweet text and its entities"""
+        parts, entities = [], {'hashtags': [], 'symbols': [],
+                               'user_mentions': [], 'urls': []}
+        position = 0
+
+        def add(token, kind=None, entity=None):
+            nonlocal position
+            if parts:
+                position += 1
+            if kind is not None:
+                entity['indices'] = [position, position + len(token)]
+                entities[kind].append(entity)
+            parts.append(token)
+            position += len(token)
+        if rnd.random() < 0.3:
+            user = self.user(rnd.choices(USERS, cum_weights=USER_WEIGHTS)[0])
+            add('@' + user['screen_name'], 'user_mentions',
+                {'screen_name': user['screen_name'], 'name': user['name'],
+                 'id': user['id'], 'id_str': user['id_str']})
+        for word in rnd.choices(WORDS, cum_weights=WORD_WEIGHTS,
+                                k=rnd.randint(4, 30)):
+            draw = rnd.random()
+            if draw < 0.05:
+                tag = rnd.choices(HASHTAGS, cum_weights=HASHTAG_WEIGHTS)[0]
+                add('#' + tag, 'hashtags', {'text': tag})
+            elif draw < 0.07:
+                add(rnd.choice(EMOJI))
+            else:
+                add(word)
+        if rnd.random() < 0.15:
+            url = 'https://t.co/' + format(rnd.getrandbits(40), 'x')
+            add(url, 'urls', {'url': url,
+                              'expanded_url': 'https://example.com/' +
+                              format(rnd.getrandbits(24), 'x'),
+                              'display_url': 'example.com/…'})
+        return ' '.join(parts), entities
+
+    def tweet(self, query, i, lang=None, retweets=True, with_user=True):
+        """Return tweet i (0 for the most recent) of the results of query"""
+        rnd = self._random('tweet', query, i)
+        tweet_id = TOP_ID - i * ID_STEP
+        created = NOW - timedelta(
+            seconds=i * SECONDS_PER_TWEET + rnd.uniform(0, 2))
+        author = self.user(rnd.choices(USERS, cum_weights=USER_WEIGHTS)[0])
+        name, url = rnd.choice(SOURCES)
+        tweet = {
+            'created_at': twitter_time(created),
+            'id': tweet_id, 'id_str': str(tweet_id),
+            'full_text': None, 'truncated': False,
+            'display_text_range': None, 'entities': None,
+            'metadata': {'iso_language_code': lang or 'en',
+                         'result_type': 'recent'},
+            'source': '<a href="' + url + '" rel="nofollow">' + name +
+            '</a>',
+            'in_reply_to_status_id': None, 'in_reply_to_status_id_str': None,
+            'in_reply_to_user_id': None, 'in_reply_to_user_id_str': None,
+            'in_reply_to_screen_name': None,
+            'user': author,
+            'geo': None, 'coordinates': None, 'place': None,
+            'contributors': None, 'is_quote_status': False,
+            'retweet_count': int(rnd.paretovariate(1.5)) - 1,
+            'favorite_count': int(rnd.paretovariate(1.2)) - 1,
+            'favorited': False, 'retweeted': False,
+            'lang': lang or rnd.choice(LANGS),
+        }
+        if retweets and (rnd.random() < 0.2):
+            original = self.tweet(query, i + SEARCH_RESULTS, lang,
+                                  retweets=False)
+            original_author = original['user']['screen_name']
+            tweet['full_text'] = ('RT @' + original_author + ': ' +
+                                  original['full_text'])
+            shift = len(original_author) + 6
+            entities = json.loads(json.dumps(original['entities']))
+            for values in entities.values():
+                for entity in values:
+                    entity['indices'] = [k + shift
+                                         for k in entity['indices']]
+            entities['user_mentions'].insert(0, {
+                'screen_name': original_author,
+                'name': original['user']['name'],
+                'id': original['user']['id'],
+                'id_str': original['user']['id_str'],
+                'indices': [3, shift - 2]})
+            tweet['entities'] = entities
+            tweet['retweet_count'] = original['retweet_count']
+            tweet['favorite_count'] = 0
+            tweet['retweeted_status'] = original
+        else:
+            tweet['full_text'], tweet['entities'] = self._text(rnd)
+        tweet['display_text_range'] = [0, len(tweet['full_text'])]
+        if not with_user:
+            del tweet['user']
+        return tweet
+
+    @staticmethod
+    def _first_index(max_id):
+        if max_id is None:
+            return 0
+        return max(-(-(TOP_ID - int(max_id)) // ID_STEP), 0)
+
+    def search(self, q, count=15, max_id=None, lang=None, **params):
+        """GET search/tweets"""
+        count = min(int(count), 100)
+        retweets = '-filter:retweets' not in q
+        start = self._first_index(max_id)
+        end = min(start + count, SEARCH_RESULTS)
+        statuses = [self.tweet(q, i, lang, retweets)
+                    for i in range(start, end)]
+        metadata = {'completed_in': 0.05, 'max_id': TOP_ID,
+                    'max_id_str': str(TOP_ID), 'query': q,
+                    'refresh_url': '?' + urlencode({'since_id': TOP_ID,
+                                                    'q': q}),
+                    'count': count, 'since_id': 0, 'since_id_str': '0'}
+        if statuses and end < SEARCH_RESULTS:
+            metadata['next_results'] = '?' + urlencode(
+                {'max_id': statuses[-1]['id'] - 1, 'q': q, 'count': count})
+        return {'statuses': statuses, 'search_metadata': metadata}
+
+    def user_timeline(self, screen_name, count=20, max_id=None,
+                      include_rts='true', **params):
+        """GET statuses/user_timeline, every tweet by screen_name"""
+        count = min(int(count), 200)
+        start = self._first_index(max_id)
+        end = min(start + count, TIMELINE_RESULTS)
+        author = self.user(zlib.crc32(screen_name.encode('utf-8')) % N_USERS)
+        author['screen_name'] = screen_name
+        retweets = str(include_rts).lower() != 'false'
+        statuses = []
+        for i in range(start, end):
+            tweet = self.tweet('@' + screen_name, i, retweets=retweets)
+            tweet['user'] = author
+            statuses.append(tweet)
+        return statuses
+
+    def search_users(self, q, count=20, page=1, **params):
+        """GET users/search, up to USER_SEARCH_RESULTS users"""
+        count = min(int(count), 20)
+        start = (int(page) - 1) * count
+        end = min(start + count, USER_SEARCH_RESULTS)
+        offset = zlib.crc32(q.encode('utf-8'))
+        users = []
+        for k in range(start, end):
+            user = self.user((offset + k * 7919) % N_USERS)
+            user['status'] = self.tweet('@' + user['screen_name'], 0,
+                                        with_user=False)
+            users.append(user)
+        return users
+
+    def retweets(self, tweet_id, count=100, **params):
+        """GET statuses/retweets/:id, the latest retweets of a tweet"""
+        index = self._first_index(tweet_id)
+        original = self.tweet('retweeted', index, retweets=False)
+        original['id'], original['id_str'] = int(tweet_id), str(tweet_id)
+        rnd = self._random('retweets', tweet_id)
+        n = min(int(count), 100, max(original['retweet_count'], 0))
+        tweets = []
+        for k in range(n):
+            user = self.user(rnd.choices(USERS, cum_weights=USER_WEIGHTS)[0])
+            tweets.append({
+                'created_at': original['created_at'],
+                'id': int(tweet_id) + k + 1, 'id_str': str(int(tweet_id) +
+                                                           k + 1),
+                'text': 'RT @' + original['user']['screen_name'] + ': ' +
+                original['full_text'][:100],
+                'user': user, 'retweeted_status': original,
+                'retweet_count': original['retweet_count'],
+                'favorite_count': 0, 'lang': original['lang']})
+        return tweets
+
+
+def synthetic_pages(n, seed=0, query='synthetic', search_type='Search Tweets'):
+    """Yield n synthetic search results as DataFrame pages, like
+    fetch.iter_pages"""
+    from .fetch import statuses_to_df, users_to_df
+
+    world = SyntheticTwitter(seed)
+    if search_type == 'Search Users':
+        for page in range(1, -(-min(n, USER_SEARCH_RESULTS) // 20) + 1):
+            yield users_to_df(world.search_users(query, 20, page))
+        return
+    for start in range(0, n, 100):
+        statuses = [world.tweet(query, i, retweets=False)
+                    for i in range(start, min(start + 100, n))]
+        yield statuses_to_df(statuses)
+
+
+def synthetic_dataset(n, seed=0, query='synthetic'):
+    """Return a dataset of n synthetic tweets, prepared like fetched ones
+    (see fetch.prepare_dataset)"""
+    from .fetch import prepare_dataset
+
+    return prepare_dataset(list(synthetic_pages(n, seed, query)))
+
+
+def recording_key(path, params):
+    """Return the file name of the recording of a GET request"""
+    path = '/' + path.strip('/')
+    params = urlencode(sorted((k, v) for k, v in params
+                              if not k.startswith('oauth_')))
+    digest = hashlib.sha1((path + '?' + params).encode('utf-8')).hexdigest()
+    return path.strip('/').replace('/', '_') + '-' + digest[:16] + '.json'
+
+
+def record_responses(directory):
+    """Return a requests response hook that saves the API responses of a
+    client in directory, for ReplayServer to serve"""
+    os.makedirs(directory, exist_ok=True)
+
+    def record(response, *args, **kwargs):
+        url = urlparse(response.url)
+        headers = {k: v for k, v in response.headers.items()
+                   if k.lower().startswith('x-rate-limit')}
+        path = os.path.join(directory, recording_key(
+            url.path, parse_qsl(url.query, keep_blank_values=True)))
+        with open(path, 'w') as f:
+            json.dump({'status': response.status_code, 'headers': headers,
+                       'body': response.text}, f)
+    return record
+
+
+class RateLimits():
+    """Calls left per endpoint in the current window of `window` seconds
+    (no limits if window is 0)"""
+    def __init__(self, window=900, limits=RATE_LIMITS):
+        self.window = window
+        self.limits = limits
+        self.windows = {}
+        self._lock = threading.Lock()
+
+    def call(self, endpoint):
+        """Count a call, returning (limit, remaining, reset) or None if the
+        endpoint is not limited"""
+        limit = self.limits.get(endpoint)
+        if (limit is None) or not self.window:
+            return None
+        now = time.time()
+        with self._lock:
+            used, reset = self.windows.get(endpoint, (0, 0))
+            if now >= reset:
+                used, reset = 0, int(now + self.window)
+            used += 1
+            self.windows[endpoint] = (used, reset)
+        return limit, limit - used, reset
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    server_version = 'TwitterStalkerReplay'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logging.debug(msg='replay | ' + format % args)
+
+    def send_json(self, status, body, headers=None):
+        data = body.encode('utf-8') if isinstance(body, str) else \
+            json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, str(v))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        options = self.server.options
+        latency = options['latency_ms'] / 1000
+        if latency:
+            time.sleep(random.uniform(0.5 * latency, 1.5 * latency))
+        url = urlparse(self.path)
+        params = parse_qsl(url.query, keep_blank_values=True)
+        if options['replay_dir']:
+            path = os.path.join(options['replay_dir'],
+                                recording_key(url.path, params))
+            if os.path.exists(path):
+                with open(path) as f:
+                    recorded = json.load(f)
+                return self.send_json(recorded['status'], recorded['body'],
+                                      recorded['headers'])
+        # /1.1/search/tweets.json -> search/tweets
+        endpoint = url.path.split('/', 2)[-1].rsplit('.', 1)[0]
+        params = dict(params)
+        world = self.server.world
+        if endpoint.startswith('statuses/retweets/'):
+            endpoint, params['tweet_id'] = endpoint.rsplit('/', 1)
+        handlers = {'search/tweets': world.search,
+                    'statuses/user_timeline': world.user_timeline,
+                    'users/search': world.search_users,
+                    'statuses/retweets': world.retweets}
+        if endpoint not in handlers:
+            return self.send_json(404, {'errors': [
+                {'code': 34, 'message': 'Sorry, that page does not exist.'}]})
+        limits = self.server.rate_limits.call(endpoint)
+        headers = {}
+        if limits is not None:
+            limit, remaining, reset = limits
+            headers = {'x-rate-limit-limit': limit,
+                       'x-rate-limit-remaining': max(remaining, 0),
+                       'x-rate-limit-reset': reset}
+            if remaining < 0:
+                return self.send_json(429, {'errors': [
+                    {'code': 88, 'message': 'Rate limit exceeded'}]},
+                    headers)
+        try:
+            body = handlers[endpoint](**params)
+        except (TypeError, ValueError) as e:
+            return self.send_json(400, {'errors': [
+                {'code': 44, 'message': str(e)}]}, headers)
+        self.send_json(200, body, headers)
+
+
+def make_server(host='127.0.0.1', port=8081, seed=0,
+                replay_dir=twitter_replay_dir,
+                latency_ms=twitter_replay_latency_ms,
+                window=twitter_replay_window):
+    """Return a ThreadingHTTPServer standing in for the Twitter API (port 0
+    picks a free port)"""
+    server = ThreadingHTTPServer((host, port), ReplayHandler)
+    server.daemon_threads = True
+    server.world = SyntheticTwitter(seed)
+    server.rate_limits = RateLimits(window)
+    server.options = {'replay_dir': replay_dir, 'latency_ms': latency_ms}
+    return server
+
+
+_local_server = None
+_local_server_lock = threading.Lock()
+
+
+def local_server_url():
+    """Return the URL of this process' replay server, started on a free
+    port in a background thread on first use"""
+    global _local_server
+    with _local_server_lock:
+        if _local_server is None:
+            _local_server = make_server(port=0)
+            threading.Thread(target=_local_server.serve_forever,
+                             name='replay', daemon=True).start()
+            logging.info(msg='replay server listening on port ' +
+                         str(_local_server.server_port))
+    return 'http://127.0.0.1:' + str(_local_server.server_port)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--replay-dir', default=twitter_replay_dir,
+                        help='responses saved with TWITTER_STALKER_RECORD_DIR')
+    parser.add_argument('--latency-ms', type=float,
+                        default=twitter_replay_latency_ms,
+                        help='mean latency added to every response')
+    parser.add_argument('--window', type=float, default=twitter_replay_window,
+                        help='rate limit window in seconds, 0 for no limits')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = make_server(args.host, args.port, args.seed, args.replay_dir,
+                         args.latency_ms, args.window)
+    logging.info(msg='replay server listening on http://' + args.host + ':' +
+                 str(server.server_port))
+    server.serve_forever()
@@ -0,0 +1,145 @@
+import logging
+import re
+
+import pandas as pd
+from pandas.api.types import (infer_dtype, is_extension_array_dtype,
+                              is_float_dtype, is_integer_dtype,
+                              is_object_dtype)
+
+from .constants import category_columns, unused_columns_regex
+from .utils import dtype_name
+
+
+def normalize_dataset(df):
+    """Give a freshly fetched DataFrame its canonical, typed schema.
+
+    * ``*created*`` columns become UTC datetimes
+    * ``*lang*`` and ``*source*`` columns become categoricals
+    * object columns holding only booleans become the nullable ``boolean``
+    * object columns holding only integers, and ``*count*`` float columns
+      that only hold whole numbers (NaN after a concat), become ``Int64``
+    """
+    df = df.reset_index(drop=True)
+    for column in df:
+        series = df[column]
+        if 'created' in column:
+            df[column] = pd.to_datetime(series, utc=True, errors='coerce')
+        elif ('lang' in column) or ('source' in column):
+            df[column] = series.astype('category')
+        elif is_object_dtype(series.dtype):
+            inferred = infer_dtype(series, skipna=True)
+            if inferred == 'boolean':
+                df[column] = series.astype('boolean')
+            elif inferred == 'integer':
+                df[column] = series.astype('Int64')
+        elif is_float_dtype(series.dtype) and ('count' in column):
+            if series.dropna().mod(1).eq(0).all():
+                df[column] = series.astype('Int64')
+    return df
+
+
+def string_dtype():
+    """Return the Arrow backed string dtype, or pandas' own string dtype
+    where it has none (pandas < 1.3, or no pyarrow)"""
+    try:
+        return pd.StringDtype('pyarrow')
+    except (TypeError, ImportError):
+        return pd.StringDtype()
+
+
+def compact_dataset(df):
+    """Return a normalized dataset in a compact memory layout.
+
+    * columns matching ``unused_columns_regex`` are dropped
+    * integer columns are downcast to the smallest type holding their
+      values (nullable ones stay nullable)
+    * string columns in ``category_columns`` become categoricals, other
+      string columns Arrow backed strings (see ``string_dtype``)
+
+    The size before and after is logged.
+    """
+    before = df.memory_usage(deep=True).sum()
+    df = df.drop(columns=[c for c in df if re.search(unused_columns_regex, c)])
+    for column in df:
+        series = df[column]
+        if is_integer_dtype(series.dtype):
+            if is_extension_array_dtype(series.dtype):
+                # pandas < 1.3 can't downcast nullable integers reliably:
+                # downcast the values, then go back to the nullable type
+                values = pd.to_numeric(series.dropna().to_numpy('int64'),
+                                       downcast='integer')
+                df[column] = series.astype(values.dtype.name.title())
+            else:
+                df[column] = pd.to_numeric(series, downcast='integer')
+        elif is_object_dtype(series.dtype) and \
+                infer_dtype(series, skipna=True) in ['string', 'empty']:
+            if column in category_columns:
+                df[column] = series.astype('category')
+            else:
+                df[column] = series.astype(string_dtype())
+    after = df.memory_usage(deep=True).sum()
+    logging.info(msg='compacted dataset: ' + format(before, ',') + ' -> ' +
+                 format(after, ',') + ' bytes, shape:' + str(df.shape))
+    return df
+
+
+def append_dataset(df, new):
+    """Return the rows of the prepared dataset new appended to those of
+    the prepared dataset df.
+
+    Columns whose types differ between the two (e.g. categoricals with
+    different categories) come out of the concatenation as objects, and
+    only those are normalized and compacted again.
+    """
+    combined = pd.concat([df, new], ignore_index=True, sort=False)
+    drifted = [c for c in combined
+               if is_object_dtype(combined[c].dtype) and not all(
+                   is_object_dtype(part[c].dtype)
+                   for part in [df, new] if c in part)]
+    if drifted:
+        fixed = compact_dataset(normalize_dataset(combined[drifted]))
+        for column in fixed:
+            combined[column] = fixed[column]
+    return combined
+
+
+def column_types(df):
+    """Return a {column: filter type} dict, see utils.dtype_name"""
+    return {column: dtype_name(df[column]) for column in df}
+
+
+def json_scalar(value):
+    """Return a NumPy/pandas scalar as a JSON serializable value"""
+    if pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value.item() if hasattr(value, 'item') else value
+
+
+def dataset_summary(df):
+    """Return the metadata the UI shows about a dataset, computed in one
+    pass and JSON serializable so it can be kept in a dcc.Store:
+
+    * rows, users: number of rows and of distinct user_screen_name
+    * columns, numeric_columns: names of every column and of the
+      ``*count*`` columns (the dropdown options are built clientside)
+    * types: see column_types
+    * filters: {column: {'min', 'max'}} of numeric and datetime columns,
+      and {column: {'values'}} of category columns
+    """
+    types = column_types(df)
+    filters = {}
+    for column, col_type in types.items():
+        if col_type in ['int', 'float', 'datetime']:
+            filters[column] = {'min': json_scalar(df[column].min()),
+                               'max': json_scalar(df[column].max())}
+        elif col_type == 'category':
+            filters[column] = {'values': [
+                json_scalar(x) for x in df[column].cat.categories]}
+    users = df['user_screen_name'].nunique() \
+        if 'user_screen_name' in df else 0
+    return {'rows': len(df), 'users': int(users),
+            'columns': list(df.columns),
+            'numeric_columns': [c for c in df if 'count' in c],
+            'types': types, 'filters': filters}
@@ -0,0 +1,78 @@
+import hashlib
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .constants import sentiment_cache_size, sentiment_processes
+
+_scores = OrderedDict()
+_scores_lock = threading.Lock()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def polarity(text):
+    """Return the TextBlob polarity of text, from -1 to 1"""
+    from textblob import TextBlob
+
+    return TextBlob(text).sentiment.polarity
+
+
+def _score_chunk(texts):
+    return [polarity(text) for text in texts]
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, as forking a threaded server process is unsafe
+            _pool = ProcessPoolExecutor(
+                max_workers=sentiment_processes,
+                mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def sentiment_scores(texts, processes=sentiment_processes, chunk_size=500):
+    """Return the polarity of every text as a NumPy array aligned with texts.
+
+    Texts are deduplicated and scores are memoized by text hash in a
+    bounded LRU cache (`sentiment_cache_size` entries), so only texts never
+    seen before are scored. When there are more than chunk_size of those
+    and processes > 1, they are scored in chunks on a process pool.
+    Missing values score 0.
+    """
+    texts = pd.Series(texts, dtype=object).fillna('').astype(str)
+    codes, uniques = pd.factorize(texts)
+    hashes = [hashlib.sha1(text.encode('utf-8')).digest()
+              for text in uniques]
+    scores = np.zeros(len(uniques))
+    missing = []
+    with _scores_lock:
+        for i, text_hash in enumerate(hashes):
+            if text_hash in _scores:
+                _scores.move_to_end(text_hash)
+                scores[i] = _scores[text_hash]
+            else:
+                missing.append(i)
+    if missing:
+        to_score = [uniques[i] for i in missing]
+        if (processes > 1) and (len(to_score) > chunk_size):
+            chunks = [to_score[i:i + chunk_size]
+                      for i in range(0, len(to_score), chunk_size)]
+            results = [score
+                       for chunk in _get_pool().map(_score_chunk, chunks)
+                       for score in chunk]
+        else:
+            results = _score_chunk(to_score)
+        scores[missing] = results
+        with _scores_lock:
+            for i, score in zip(missing, results):
+                _scores[hashes[i]] = score
+            while len(_scores) > sentiment_cache_size:
+                _scores.popitem(last=False)
+    return scores[codes]
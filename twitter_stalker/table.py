@@ -0,0 +1,87 @@
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+
+from .cache import load_derived
+from .indexes import load_column_index
+
+
+def filter_rows(key, df, col_type, col=None, numbers=None, categories=None,
+                string=None, bool_filter=None, start_date=None,
+                end_date=None):
+    """Return the positions of the rows of df kept by the filter widget
+    that matches the type of col, or None if no filter applies.
+
+    Rows are looked up in the column's index (see indexes.py) rather than
+    found by scanning the column.
+    """
+    if numbers and (col_type in ['int', 'float']):
+        index = load_column_index(key, df, col, col_type)
+        return index.between(numbers[0], numbers[-1])
+    elif categories and (col_type == 'category'):
+        return load_column_index(key, df, col, col_type).isin(categories)
+    elif string and col_type == 'object':
+        index = load_column_index(key, df, col, col_type)
+        return index.contains(df[col], string)
+    elif (bool_filter is not None) and (col_type == 'bool'):
+        index = load_column_index(key, df, col, col_type)
+        return index.isin([bool(bool_filter)])
+    elif start_date and end_date and (col_type == 'datetime'):
+        index = load_column_index(key, df, col, col_type)
+        return index.between(start_date, end_date)
+    return None
+
+
+def sort_rows(df, rows, sort_by):
+    """Return rows (positions in df) ordered by a DataTable sort_by list,
+    missing values last"""
+    if not sort_by:
+        return rows
+    view = df.iloc[rows][[s['column_id'] for s in sort_by]]
+    view = view.reset_index(drop=True)
+    order = view.sort_values([s['column_id'] for s in sort_by],
+                             ascending=[s['direction'] == 'asc'
+                                        for s in sort_by],
+                             kind='mergesort', na_position='last').index
+    return rows[order.to_numpy()]
+
+
+def top_rows(chunks, n, sort_by=None):
+    """Return the first n rows of an iterable of DataFrames in sort_by
+    order (in chunk order without sort_by, reading no further chunk once
+    n rows are found), keeping at most n rows between chunks"""
+    top = None
+    for chunk in chunks:
+        top = chunk if top is None else pd.concat([top, chunk],
+                                                  ignore_index=True)
+        if sort_by:
+            top = top.iloc[sort_rows(top, np.arange(len(top)), sort_by)[:n]]
+        elif len(top) >= n:
+            return top.iloc[:n]
+    return top
+
+
+def view_name(filters, sort_by=None):
+    """Return a name for the rows passing filters in sort_by order"""
+    params = json.dumps([filters, sort_by or []], sort_keys=True,
+                        default=str)
+    return 'view.' + hashlib.sha1(params.encode('utf-8')).hexdigest()[:16]
+
+
+def view_rows(key, df, col_type, filters, sort_by=None):
+    """Return the positions of the rows of dataset key that pass filters
+    (a dict of the keyword arguments of filter_rows), in sort_by order.
+
+    The result is cached per dataset, filters and sort order, so paging
+    through a view only slices it.
+    """
+    name = view_name(filters, sort_by)
+
+    def build():
+        rows = filter_rows(key, df, col_type, **filters)
+        if rows is None:
+            rows = np.arange(len(df))
+        return sort_rows(df, rows, sort_by)
+    return load_derived(key, name, build)
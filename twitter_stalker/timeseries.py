@@ -0,0 +1,104 @@
+import pandas as pd
+
+from .cache import load_derived
+
+TIME_COLUMN = 'tweet_created_at'
+# pandas offset aliases of the granularities offered, from the finest
+FREQUENCIES = {'Minute': 'T', 'Hour': 'H', 'Day': 'D'}
+METRICS = ['tweets', 'tweet_retweet_count', 'tweet_favorite_count']
+# buckets beyond which empty ones are not filled with zeros
+MAX_FILLED_BUCKETS = 20000
+
+
+def top_groups(series, top=8):
+    """Return series with every value but its `top` most frequent ones
+    replaced by 'Other'"""
+    series = series.astype(object).fillna('Unknown')
+    keep = series.value_counts().index[:top]
+    return series.where(series.isin(keep), 'Other')
+
+
+def rollup(df, group_col=None, freq='T', top=8):
+    """Return the number of tweets and the sum of every other metric per
+    time bucket of freq and group (the `top` most frequent values of
+    group_col), indexed by (time, group), empty buckets left out"""
+    times = df[TIME_COLUMN].dt.floor(freq)
+    if group_col is None:
+        groups = pd.Series('All tweets', index=df.index)
+    else:
+        groups = top_groups(df[group_col], top)
+    data = pd.DataFrame({'time': times, 'group': groups, 'tweets': 1})
+    for metric in METRICS[1:]:
+        if metric in df:
+            data[metric] = df[metric].fillna(0).astype(float)
+    data = data.dropna(subset=['time'])
+    return data.groupby(['time', 'group'], sort=True).sum()
+
+
+def group_counts(chunks, group_col):
+    """Return the number of rows per value of group_col in an iterable of
+    DataFrames, most frequent first"""
+    counts = pd.Series(dtype=float)
+    for chunk in chunks:
+        counts = counts.add(chunk[group_col].astype(object).fillna('Unknown')
+                            .value_counts(), fill_value=0)
+    return counts.sort_values(ascending=False, kind='mergesort')
+
+
+def rollup_chunks(chunks, group_col=None, freq='T', keep=None):
+    """Return the rollup of an iterable of DataFrames, rolling up one chunk
+    at a time and adding up the buckets; values of group_col not in keep
+    are 'Other'"""
+    rolled = None
+    for chunk in chunks:
+        if group_col is not None:
+            groups = chunk[group_col].astype(object).fillna('Unknown')
+            chunk = chunk.assign(**{group_col: groups.where(groups.isin(keep),
+                                                            'Other')})
+        part = rollup(chunk, group_col, freq, top=None)
+        rolled = part if rolled is None else \
+            pd.concat([rolled, part]).groupby(level=['time', 'group'],
+                                              sort=True).sum()
+    return rolled
+
+
+def coarsen(rolled, freq):
+    """Return a finer rollup aggregated to the coarser freq"""
+    times = rolled.index.get_level_values('time').floor(freq)
+    groups = rolled.index.get_level_values('group')
+    rolled = rolled.groupby([times, groups], sort=True).sum()
+    rolled.index.names = ['time', 'group']
+    return rolled
+
+
+def load_rollup(key, df, group_col, freq):
+    """Return the rollup of dataset key at freq.
+
+    Only the minute rollup scans the dataset; coarser ones are aggregated
+    from it, and every rollup is cached per dataset.
+    """
+    name = 'timeseries.' + str(group_col) + '.' + freq
+
+    def compute():
+        finest = list(FREQUENCIES.values())[0]
+        if freq == finest:
+            return rollup(df, group_col, freq)
+        return coarsen(load_rollup(key, df, group_col, finest), freq)
+    return load_derived(key, name, compute)
+
+
+def to_series(rolled, metric, freq, window=1):
+    """Return a DataFrame with one column per group of a rollup, holding
+    metric per time bucket, empty buckets as 0 (unless there are more
+    than MAX_FILLED_BUCKETS of them), smoothed with a rolling mean over
+    `window` buckets"""
+    wide = rolled[metric].unstack('group', fill_value=0)
+    if len(wide):
+        n_buckets = (wide.index[-1] - wide.index[0]) / pd.Timedelta(
+            pd.tseries.frequencies.to_offset(freq)) + 1
+        if n_buckets <= MAX_FILLED_BUCKETS:
+            wide = wide.asfreq(freq, fill_value=0)
+    if window > 1:
+        wide = wide.rolling(window, min_periods=1).mean()
+    order = wide.sum().sort_values(ascending=False).index
+    return wide[order]
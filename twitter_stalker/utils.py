@@ -1,7 +1,75 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import (is_bool_dtype, is_categorical_dtype,
+                              is_datetime64_any_dtype, is_extension_array_dtype,
+                              is_float_dtype, is_integer_dtype)
+
+from .constants import category_columns
+
+MAX_FILTER_CATEGORIES = 500
+
+
+def dtype_name(series, max_categories=MAX_FILTER_CATEGORIES):
+    """Return the filter type of series: datetime, category, bool, int,
+    float or object (categoricals with more than max_categories values,
+    and those in category_columns, which are only categoricals to save
+    memory, are searched as text rather than picked from a dropdown)"""
+    dtype = series.dtype
+    if is_datetime64_any_dtype(dtype):
+        return 'datetime'
+    if is_categorical_dtype(dtype):
+        if (len(dtype.categories) > max_categories) or \
+                (series.name in category_columns):
+            return 'object'
+        return 'category'
+    if is_bool_dtype(dtype):
+        return 'bool'
+    if is_integer_dtype(dtype):
+        return 'int'
+    if is_float_dtype(dtype):
+        return 'float'
+    return 'object'
+
+
 def get_str_dtype(df, col):
     """Return dtype of col in df"""
-    dtypes = ['datetime', 'bool', 'int', 'float',
-              'object', 'category']
-    for d in dtypes:
-        if d in str(df.dtypes.loc[col]).lower():
-            return d
\ No newline at end of file
+    return dtype_name(df[col])
+
+
+def to_columns(df, float_digits=None):
+    """Return df as a {column: list of values} dict, which the browser
+    turns back into rows (column names are not repeated in every row),
+    with floats rounded to float_digits and missing values of nullable
+    (Int64, boolean) columns as None so they can be serialized to JSON"""
+    df = df.copy(deep=False)
+    for column in df:
+        dtype = df[column].dtype
+        if is_float_dtype(dtype) and (float_digits is not None):
+            df[column] = df[column].round(float_digits)
+        elif is_extension_array_dtype(dtype) and \
+                not is_categorical_dtype(dtype):
+            series = df[column].astype(object)
+            df[column] = series.where(series.notna(), None)
+    return df.to_dict('list')
+
+
+def bin_values(series, bins=30):
+    """Return the centers, counts and widths of a histogram of the
+    non-missing values of a numeric or datetime series, binned with
+    np.histogram (dates are binned as nanoseconds, widths are then in ms
+    like plotly's date axes)"""
+    values = series.dropna()
+    is_datetime = is_datetime64_any_dtype(values.dtype)
+    if is_datetime:
+        values = pd.DatetimeIndex(values).asi8
+    else:
+        values = values.to_numpy(dtype=float)
+    if len(values) == 0:
+        return np.array([]), np.array([]), np.array([])
+    counts, edges = np.histogram(values, bins=bins)
+    centers = (edges[:-1] + edges[1:]) / 2
+    widths = np.diff(edges)
+    if is_datetime:
+        centers = pd.to_datetime(centers.astype(np.int64), utc=True)
+        widths = widths / 1e6
+    return centers, counts, widths